@@ -1,25 +1,48 @@
-from fastapi import FastAPI
-from app.routers import countries
+import asyncio
+import contextlib
+
+from fastapi import FastAPI, Response
+from app.routers import countries, contents
+from app.middleware import RouteMetricsMiddleware
 
 
 from gbq_manager import GBQManager
 from gbq_content_manager import AppBQContentManager
-from config import Config
-from app.root_handlers import status_ok, app_home
+from gbq_content_manager.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.root_handlers import status_ok, app_home, readiness
+
 
+def create_app(configclass=None, bq=None) -> FastAPI:
+    # configclass: app configuration class, config.Config by default
+    # bq: optional BigQuery backend (BQBackend interface), a GBQManager by default
+    if configclass is None:
+        # Imported on use: callers passing their configuration never depend on the config module
+        from config import Config
+        configclass = Config
 
-def create_app(configclass=Config) -> FastAPI:
-    root_app = FastAPI()
+    @contextlib.asynccontextmanager
+    async def lifespan(fastapi_app):
+        # Requests are served while the BigQuery client is built and contents are warmed up in background
+        warm_up = asyncio.create_task(app_bq_cm.warm_up())
+        yield
+        warm_up.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warm_up
+        # Schedulers started by init_app: stopped with the app, runs in progress waited for a while
+        await asyncio.to_thread(app_bq_cm.stop_schedulers, 10.0)
+
+    root_app = FastAPI(lifespan=lifespan)
     root_app.config = configclass().to_dict()
     # Create a BigQuery connection manager and link to this app
-    bq = GBQManager()
+    if bq is None:
+        bq = GBQManager()
     bq.init_app(root_app)
 
     # Basic Big Query sourced data in memory content manager
     # Loads data from BQ using a preconfigured set
     # Basic management of content freshness
     # to avoid running BigQuery sql queries
-    # Improvement: adding content cache service (redis, memcache)
+    # Optional shared content cache tier (sqlite file, redis) set with CONTENT_SHARED_CACHE_URL
 
     app_bq_cm = AppBQContentManager()
     app_bq_cm.init_app(root_app, bq=bq)
@@ -34,8 +57,32 @@ def create_app(configclass=Config) -> FastAPI:
     async def root():
         return status_ok()
 
+    # Readiness: 503 until the BigQuery client is built and warm contents are loaded
+    @root_app.get("/readiness")
+    async def ready():
+        return readiness(app_bq_cm)
+
+    # Prometheus text format metrics: content cache, BigQuery jobs and route latency
+    @root_app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=app_bq_cm.metrics.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    # Dry run estimates and status per registered query
+    @root_app.get("/status/queries", include_in_schema=False)
+    async def query_costs():
+        return app_bq_cm.query_costs.results()
+
+    # BigQuery circuit breaker state and contents in backoff after failed loads
+    @root_app.get("/status/bigquery", include_in_schema=False)
+    async def bigquery_status():
+        return app_bq_cm.backend_status()
+
+    root_app.add_middleware(RouteMetricsMiddleware, histogram=app_bq_cm.metrics.http_duration)
+
     # Example of using modular routes with router
     root_app.include_router(countries.router)
+    # Batch of contents in one request
+    root_app.include_router(contents.router)
 
     return root_app
 
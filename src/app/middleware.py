@@ -0,0 +1,31 @@
+import time
+
+
+class RouteMetricsMiddleware:
+    # ASGI middleware recording HTTP request duration per route template in a metrics histogram
+    # Route templates (e.g. /countries/{country}/evolution/) keep the number of series bounded
+    # Plain ASGI: no request or response objects built, cheap enough for every request
+
+    def __init__(self, app, histogram):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # Router stores the matched route in the request scope
+            route = scope.get('route')
+            self.histogram.observe(time.perf_counter() - start, getattr(route, 'path', 'unmatched'),
+                                   scope['method'], status[0])
@@ -1,4 +1,5 @@
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 
 
 def status_ok():
@@ -9,3 +10,10 @@ def status_ok():
 def app_home(current_app):
     payload = {"name": current_app.config.get('API_NAME'), "ver": current_app.config.get('API_VER')}
     return jsonable_encoder(payload)
+
+
+def readiness(content_manager):
+    # 200 once the BigQuery client is built and warm contents are loaded, 503 before
+    state = content_manager.readiness_state()
+    status_code = 200 if state['status'] == 'ready' else 503
+    return JSONResponse(content=jsonable_encoder(state), status_code=status_code)
@@ -0,0 +1,36 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Query, Request
+from pydantic import BaseModel, Field
+from app.routers.route_handlers import get_contents as contents
+from app.routers.route_handlers import get_content as content
+
+
+class ContentItem(BaseModel):
+    # Registered content key and its query parameters, e.g. {"country": "Spain"}
+    key: str
+    params: dict = Field(default_factory=dict)
+
+
+class ContentBatch(BaseModel):
+    contents: List[ContentItem]
+
+
+router = APIRouter()
+
+
+@router.post("/contents/", tags=["contents"])
+async def get_contents(request: Request, batch: ContentBatch):
+    return await contents(request, batch.contents)
+
+
+# Any registered content by key, e.g. /contents/get_country_territories/?country=Spain&format=ndjson
+# limit, page_token: cursor based pagination, next page token in X-Next-Page-Token header
+# format=ndjson: rows streamed as newline delimited JSON
+@router.get("/contents/{key}/", tags=["contents"])
+async def get_content(request: Request, key: str, country: Optional[str] = None,
+                      country_list: Optional[List[str]] = Query(None), start_date: Optional[str] = None,
+                      limit: Optional[int] = Query(None, ge=1, le=10000), page_token: Optional[str] = None,
+                      response_format: Optional[str] = Query(None, alias='format')):
+    return await content(request, key, limit, page_token, response_format,
+                         country=country, country_list=country_list, start_date=start_date)
@@ -1,15 +1,21 @@
-from fastapi import APIRouter
+from typing import Optional
+
+from fastapi import APIRouter, Query, Request
 from app.routers.route_handlers import get_countries as countries
 from app.routers.route_handlers import get_country_evolution as country_evolution
 
 router = APIRouter()
 
 
+# Optional on list routes:
+# limit, page_token: cursor based pagination, next page token in X-Next-Page-Token header
+# format=ndjson: rows streamed as newline delimited JSON
 @router.get("/countries/", tags=["countries"])
-def get_countries():
-    return countries()
+async def get_countries(request: Request, limit: Optional[int] = Query(None, ge=1, le=10000),
+                        page_token: Optional[str] = None, response_format: Optional[str] = Query(None, alias='format')):
+    return await countries(request, limit, page_token, response_format)
 
 
 @router.get("/countries/{country}/evolution/", tags=["countries"])
-def get_countries_evolution(country: str):
-    return country_evolution(country)
+async def get_countries_evolution(request: Request, country: str):
+    return await country_evolution(request, country)
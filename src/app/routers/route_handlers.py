@@ -1,20 +1,174 @@
-from fastapi.encoders import jsonable_encoder
-from gbq_content_manager import AppBQContentManager
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from gbq_content_manager import AppBQContentManager, ContentUnavailable
+from gbq_content_manager.admission import AdmissionRejected
+from gbq_content_manager.encoding import IDENTITY, GZIP, BROTLI, choose_encoding, compress, encode_json
 
 # Singleton
 # Includes the app configuration set in app factory
 bq_cm = AppBQContentManager()
 
+NDJSON = 'application/x-ndjson'
+# Rows per page when page_token is given without limit
+DEFAULT_PAGE_LIMIT = 100
+
+
+def not_modified(content, request: Request) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # Weak comparison, any encoding of the same data matches
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return not tags.isdisjoint(content.etag(encoding) for encoding in (IDENTITY, GZIP, BROTLI))
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None and content.loaded_at is not None:
+        try:
+            return int(content.loaded_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def unavailable(content_key, retry_after) -> HTTPException:
+    # Content failed to load and no previous data, or cache miss shed: clients retry after retry_after seconds
+    return HTTPException(status_code=503, detail="Content {} not available".format(content_key),
+                         headers={'Retry-After': str(max(1, int(retry_after)))})
+
+
+def content_response(content, request: Request) -> Response:
+    # Pre-encoded JSON body of a content, compressed if accepted by the client
+    # Body and entity tag are built when content data is loaded
+    # Conditional requests for unchanged content get a 304 response
+    encoding = choose_encoding(request.headers.get('accept-encoding'), size=len(content.encoded()))
+    headers = {'Vary': 'Accept-Encoding', 'ETag': content.etag(encoding),
+               'Cache-Control': 'public, max-age={}'.format(bq_cm.content_max_age(content))}
+    if content.loaded_at is not None:
+        headers['Last-Modified'] = formatdate(content.loaded_at, usegmt=True)
+    if not_modified(content, request):
+        return Response(status_code=304, headers=headers)
+    if encoding != IDENTITY:
+        headers['Content-Encoding'] = encoding
+    return Response(content=content.encoded(encoding), media_type='application/json', headers=headers)
+
+
+def wants_ndjson(request: Request, response_format=None) -> bool:
+    return response_format == 'ndjson' or NDJSON in request.headers.get('accept', '')
+
+
+def encode_rows(rows) -> bytes:
+    # NDJSON: one JSON encoded row per line
+    return b''.join(encode_json(row) + b'\n' for row in rows)
+
 
-def get_countries():
+def content_page_response(content, request: Request, limit, page_token=None) -> Response:
+    # Page of content rows, next page token in X-Next-Page-Token and Link headers
+    try:
+        rows, next_page_token = bq_cm.content_page(content, limit, page_token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    body = encode_json(rows)
+    encoding = choose_encoding(request.headers.get('accept-encoding'), size=len(body))
+    headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'public, max-age={}'.format(bq_cm.content_max_age(content))}
+    if next_page_token is not None:
+        headers['X-Next-Page-Token'] = next_page_token
+        headers['Link'] = '<{}>; rel="next"'.format(request.url.include_query_params(page_token=next_page_token,
+                                                                                     limit=limit))
+    if encoding != IDENTITY:
+        headers['Content-Encoding'] = encoding
+    return Response(content=compress(body, encoding), media_type='application/json', headers=headers)
+
+
+async def content_stream_response(key, **kwargs) -> Response:
+    # NDJSON stream of content rows, page by page
+    pages = bq_cm.stream_content_async(key, **kwargs)
+    # First page read before the response starts, so errors still get an error status code
+    try:
+        first_page = await pages.__anext__()
+    except StopAsyncIteration:
+        first_page = []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (ContentUnavailable, AdmissionRejected) as e:
+        raise unavailable(key, e.retry_after)
+    except Exception:
+        raise HTTPException(status_code=502, detail="Content {} not available".format(key))
+
+    async def body():
+        yield encode_rows(first_page)
+        async for page in pages:
+            yield encode_rows(page)
+
+    return StreamingResponse(body(), media_type=NDJSON, headers={'Cache-Control': 'no-store'})
+
+
+async def content_rows(request: Request, key, limit=None, page_token=None, response_format=None, **kwargs):
+    # Whole content from its pre-encoded body, a page of its rows (limit, page_token)
+    # or an NDJSON stream of its rows (format=ndjson or Accept: application/x-ndjson)
+    if wants_ndjson(request, response_format):
+        return await content_stream_response(key, **kwargs)
+    try:
+        content = await bq_cm.get_content_async(key=key, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        raise unavailable(key, e.retry_after)
+    if content.rows is None:
+        # Load failed: last good data is served when there is any, 503 otherwise
+        raise unavailable(key, bq_cm.content_retry_after(content))
+    if limit is not None or page_token is not None:
+        return content_page_response(content, request, limit or DEFAULT_PAGE_LIMIT, page_token)
+    return content_response(content, request)
+
+
+async def get_countries(request: Request, limit=None, page_token=None, response_format=None):
     key = get_countries.__name__
-    payload = bq_cm.load_content(key=key)
-    return jsonable_encoder(payload)
+    return await content_rows(request, key, limit, page_token, response_format)
 
 
-def get_country_evolution(country: str):
+async def get_country_evolution(request: Request, country: str, limit=None, page_token=None, response_format=None):
     # Total cases confirmed for latest date published for  country
     # List of territories for country
     key = get_country_evolution.__name__
-    payload = bq_cm.load_content(key=key, country=country)
-    return jsonable_encoder(payload)
\ No newline at end of file
+    return await content_rows(request, key, limit, page_token, response_format, country=country)
+
+
+async def get_content(request: Request, key, limit=None, page_token=None, response_format=None, **kwargs):
+    # Any registered content, parameters not used by its query are ignored
+    if key not in bq_cm.sql_queries:
+        raise HTTPException(status_code=404, detail="Unknown content {}".format(key))
+    kwargs = {name: value for name, value in kwargs.items() if value is not None}
+    return await content_rows(request, key, limit, page_token, response_format, **kwargs)
+
+
+async def get_contents(request: Request, items):
+    # Batch of contents in one response: a JSON list with, for each item in request order,
+    # key, params and either content_key and data, or error (with retry_after for contents failing to load)
+    # Data bodies are the pre-encoded bodies of each content, not encoded again
+    max_items = bq_cm.app.config.get('CONTENT_BATCH_MAX_ITEMS', 50)
+    if len(items) > max_items:
+        raise HTTPException(status_code=413, detail="Max {} contents per batch".format(max_items))
+    results = await bq_cm.get_contents_async([(item.key, item.params) for item in items])
+    parts = []
+    for item, (content_key, result) in zip(items, results):
+        if isinstance(result, AdmissionRejected):
+            parts.append(encode_json({'key': item.key, 'params': item.params, 'content_key': content_key,
+                                      'error': str(result), 'retry_after': result.retry_after}))
+        elif isinstance(result, Exception):
+            parts.append(encode_json({'key': item.key, 'params': item.params, 'error': str(result)}))
+        elif result.rows is None:
+            parts.append(encode_json({'key': item.key, 'params': item.params, 'content_key': content_key,
+                                      'error': "Content not available",
+                                      'retry_after': bq_cm.content_retry_after(result)}))
+        else:
+            head = encode_json({'key': item.key, 'params': item.params, 'content_key': content_key})
+            parts.append(head[:-1] + b',"data":' + result.encoded() + b'}')
+    body = b'[' + b','.join(parts) + b']'
+    encoding = choose_encoding(request.headers.get('accept-encoding'), size=len(body))
+    headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-store'}
+    if encoding != IDENTITY:
+        headers['Content-Encoding'] = encoding
+    return Response(content=compress(body, encoding), media_type='application/json', headers=headers)
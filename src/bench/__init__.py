@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import os
+import resource
+import statistics
+import time
+
+from app import create_app
+from config import Config
+from gbq_content_manager import AppBQContentManager
+from gbq_manager.fake import FakeBQManager
+
+# Load testing benchmarks for the content path
+# The FastAPI app is driven in process through its ASGI interface by concurrent clients,
+# with a FakeBQManager backend simulating BigQuery job latency and failures
+
+SCENARIOS = ('cold_miss', 'warm_hit', 'rollover_stampede', 'many_keys', 'miss_burst')
+
+
+class BenchConfig(Config):
+    # Benchmarks never use Google Cloud credentials
+    BQ_SA_KEY_JSON_FILE = ''
+    # Fake jobs are polled faster than real ones
+    BQ_POLL_INITIAL_DELAY = 0.01
+    BQ_POLL_MAX_DELAY = 0.1
+
+
+def rss_bytes() -> int:
+    # Current resident set size, peak RSS where /proc is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+async def asgi_get(app, path, headers=None):
+    # Minimal ASGI client: GET path, returns (status code, body size)
+    path, _, query_string = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode('utf-8'), 'root_path': '',
+             'query_string': query_string.encode('utf-8'),
+             'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (headers or {}).items()],
+             'client': ('127.0.0.1', 50000), 'server': ('bench', 80)}
+    response = {'status': None, 'size': 0}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['size'] += len(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return response['status'], response['size']
+
+
+async def drive(app, paths, clients, headers=None):
+    # clients concurrent clients sending GET requests for paths, in order
+    # Returns latencies in seconds, status code counts and elapsed seconds
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    latencies = []
+    statuses = {}
+
+    async def client():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            status, size = await asgi_get(app, path, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    return latencies, statuses, time.perf_counter() - start
+
+
+def country_rows(sql_query, query_parameters):
+    # Evolution-like rows for a country, a list of countries otherwise
+    country = query_parameters.get('country')
+    if country is not None:
+        return [{'country_region': country, 'latest_date': '2023-03-09', 'total_confirmed': 13770429,
+                 'total_dead': 119479, 'drate': 0.87, 'inc_m_confirmed': 27342, 'inc_m_dead': 367,
+                 'rate_inc_c_m2': -0.15, 'rate_inc_d_m2': 0.04}]
+    return [{'country_region': 'Country {:04d}'.format(i)} for i in range(200)]
+
+
+class Benchmark:
+
+    def __init__(self, clients=50, requests=1000, keys=20, latency=0.2, failure_rate=0.0, config_class=BenchConfig):
+        self.clients = clients
+        self.requests = requests
+        self.keys = keys
+        self.bq = FakeBQManager(rows=country_rows, latency=latency, failure_rate=failure_rate, seed=0)
+        self.app = create_app(configclass=config_class, bq=self.bq)
+        self.content_manager = AppBQContentManager()
+
+    def reset(self):
+        self.content_manager.contents.clear()
+        self.bq.reset()
+
+    def country_paths(self, count, offset=0):
+        return ['/countries/Country {:04d}/evolution/'.format(offset + i % count) for i in range(self.requests)]
+
+    def age_contents(self, days=1):
+        # Simulate a date rollover: every content loaded days ago
+        for content_key, content in self.content_manager.contents.items():
+            content.last_run = content.last_run - datetime.timedelta(days=days)
+            content.loaded_at = content.loaded_at - days * 24 * 3600
+
+    async def cold_miss(self):
+        # Every request is the first one for its key
+        self.reset()
+        paths = ['/countries/Country {:04d}/evolution/'.format(i) for i in range(self.requests)]
+        return await drive(self.app, paths, self.clients)
+
+    async def warm_hit(self):
+        # All keys loaded before measuring
+        self.reset()
+        paths = self.country_paths(self.keys) + ['/countries/'] * (self.requests // 10)
+        await drive(self.app, sorted(set(paths)), self.clients)
+        self.bq.reset()
+        return await drive(self.app, paths, self.clients)
+
+    async def rollover_stampede(self):
+        # Keys loaded yesterday, all clients requesting them at once after midnight
+        self.reset()
+        paths = self.country_paths(self.keys)
+        await drive(self.app, sorted(set(paths)), self.clients)
+        self.age_contents()
+        self.bq.reset()
+        return await drive(self.app, paths, self.clients)
+
+    async def many_keys(self):
+        # Crawler-like traffic: few hits per key, many distinct keys
+        self.reset()
+        paths = self.country_paths(max(self.requests // 2, 1), offset=10000)
+        return await drive(self.app, paths, self.clients)
+
+    async def miss_burst(self):
+        # Burst of cold misses for distinct keys while other clients request cached keys
+        # Latencies of the cache hits only, statuses of all requests: misses over the admission limits get 503
+        self.reset()
+        hit_paths = self.country_paths(self.keys)
+        await drive(self.app, sorted(set(hit_paths)), self.clients)
+        miss_paths = ['/countries/Country {:04d}/evolution/'.format(20000 + i) for i in range(self.requests)]
+        (latencies, statuses, elapsed), (_, miss_statuses, _) = await asyncio.gather(
+            drive(self.app, hit_paths, max(self.clients // 5, 1)), drive(self.app, miss_paths, self.clients * 4))
+        for status, count in miss_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        return latencies, statuses, elapsed
+
+    def run(self, scenario):
+        rss_before = rss_bytes()
+        latencies, statuses, elapsed = asyncio.run(getattr(self, scenario)())
+        bq_stats = self.bq.stats()
+        return {'scenario': scenario,
+                'requests': len(latencies),
+                'clients': self.clients,
+                'seconds': round(elapsed, 3),
+                'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+                'statuses': statuses,
+                'bq_jobs': bq_stats['jobs'],
+                'bq_failures': bq_stats['failures'],
+                'bq_max_in_flight': bq_stats['max_in_flight'],
+                'contents': len(self.content_manager.contents),
+                'rss_mb': round(rss_bytes() / 1024 / 1024, 1),
+                'rss_delta_mb': round((rss_bytes() - rss_before) / 1024 / 1024, 1)}
@@ -0,0 +1,40 @@
+import argparse
+import json
+import logging
+
+from bench import Benchmark, SCENARIOS
+
+# Content path load testing benchmark
+# Usage, from src folder:
+#   python -m bench --scenario all --clients 50 --requests 2000 --latency 0.2
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Content path load testing benchmark')
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--keys', type=int, default=20, help='distinct content keys in warm and rollover scenarios')
+    parser.add_argument('--latency', type=float, default=0.2, help='simulated BigQuery job latency, seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of failing BigQuery jobs')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    args = parser.parse_args()
+
+    # Simulated failures are expected, do not flood the output
+    logging.disable(logging.ERROR)
+    benchmark = Benchmark(clients=args.clients, requests=args.requests, keys=args.keys,
+                          latency=args.latency, failure_rate=args.failure_rate)
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    columns = ('scenario', 'requests', 'throughput_rps', 'p50_ms', 'p99_ms', 'bq_jobs', 'contents', 'rss_mb')
+    if not args.json:
+        print(' '.join('{:>18}'.format(c) for c in columns))
+    for scenario in scenarios:
+        result = benchmark.run(scenario)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(' '.join('{:>18}'.format(result[c]) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from gbq_content_manager import BigQueryContent
+from gbq_content_manager.cache import content_size
+from gbq_content_manager.columnar import compact_rows
+from gbq_content_manager.encoding import encode_json
+
+# Content cache memory benchmark
+# Caches the same contents as dict rows in __dict__ objects (previous format), and as compact rows in slotted objects,
+# and reports memory allocated (tracemalloc), cache size estimate, time to build the contents (JSON decoding included),
+# to read their dict rows and to encode their JSON bodies
+# Rows are decoded from JSON, as rows from BigQuery: every row has its own copies of keys and strings
+# Usage, from src folder:
+#   python -m bench.memory --countries 200 --dates 30
+
+FORMATS = ('dict', 'compact')
+
+
+class DictContent:
+    # Previous BigQueryContent layout: instance dictionary, data kept as a list of dict rows
+    def __init__(self, key):
+        self.encodings = {}
+        self.data_etag = None
+        self.data = None
+        self.last_run = None
+        self.source_version = None
+        self.loaded_at = None
+        self.hits = 0
+        self.failures = 0
+        self.retry_at = None
+        self.key = key
+        self.title = None
+        self.sql_query = None
+        self.query_parameters = None
+
+
+def content_payloads(countries, dates, territories, seed=0):
+    # JSON payloads of per-country, per-country and date, and list contents
+    rng = random.Random(seed)
+    names = ['Country {:04d}'.format(i) for i in range(countries)]
+    payloads = [('get_countries', json.dumps([{'country_region': name} for name in names]))]
+    for name in names:
+        territory_names = ['{} territory {:02d}'.format(name, t) for t in range(territories)]
+        payloads.append(('get_country_summary', json.dumps([
+            {'country_region': name, 'latest': '2023-03-09', 'total_confirmed': rng.randrange(10 ** 7),
+             'total_dead': rng.randrange(10 ** 5), 'drate': rng.random()}])))
+        payloads.append(('get_country_territories', json.dumps([{'territory': t} for t in territory_names])))
+        for day in range(dates):
+            date = '2023-02-{:02d}'.format(day % 28 + 1)
+            payloads.append(('get_country_closest_date_total_by_territory', json.dumps([
+                {'latest_date': date, 'territory': t, 'total_confirmed': rng.randrange(10 ** 6),
+                 'total_dead': rng.randrange(10 ** 4), 'drate': rng.random() if rng.random() > 0.05 else None}
+                for t in territory_names])))
+    return payloads
+
+
+def build(content_format, payloads):
+    contents = []
+    for key, payload in payloads:
+        rows = json.loads(payload)
+        if content_format == 'dict':
+            content = DictContent(key)
+            content.data = rows
+        else:
+            content = BigQueryContent(key=key)
+            content.data = compact_rows(rows)
+        contents.append(content)
+    return contents
+
+
+def run(content_format, payloads):
+    # Timings without tracemalloc, it slows allocations down
+    start = time.perf_counter()
+    build(content_format, payloads)
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    contents = build(content_format, payloads)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    rows = sum(len(content.data) for content in contents)
+    read_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for content in contents:
+        encode_json(content.data)
+    encode_seconds = time.perf_counter() - start
+    return {'format': content_format, 'contents': len(contents), 'rows': rows,
+            'allocated_mb': round(allocated / 2 ** 20, 2),
+            'size_estimate_mb': round(sum(content_size(c) for c in contents) / 2 ** 20, 2),
+            'build_ms': round(build_seconds * 1000, 1), 'read_rows_ms': round(read_seconds * 1000, 1),
+            'encode_ms': round(encode_seconds * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.memory', description='Content cache memory benchmark')
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--dates', type=int, default=30, help='per-country and date contents per country')
+    parser.add_argument('--territories', type=int, default=10, help='rows of territory contents')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    args = parser.parse_args()
+
+    payloads = content_payloads(args.countries, args.dates, args.territories)
+    results = [run(content_format, payloads) for content_format in FORMATS]
+    columns = ('format', 'contents', 'rows', 'allocated_mb', 'size_estimate_mb', 'build_ms', 'read_rows_ms',
+               'encode_ms')
+    if not args.json:
+        print(' '.join('{:>16}'.format(c) for c in columns))
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(' '.join('{:>16}'.format(result[c]) for c in columns))
+    if not args.json:
+        print('compact / dict allocated: {:.2f}'.format(results[1]['allocated_mb'] / results[0]['allocated_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Import time and startup benchmark
+# Every run is a new python process: imports the app, creates it, runs the ASGI lifespan startup
+# and measures time to the first /healthcheck response and to /readiness reporting ready
+# eager: BigQuery client built in create_app. lazy: built in the startup background task (BQ_LAZY_CLIENT)
+# Usage, from src folder:
+#   python -m bench.startup --runs 5 --connect-latency 0.5
+
+MODES = ('eager', 'lazy')
+# Modules slow to import, reported when loaded before the app is created
+HEAVY_MODULES = ('google.cloud.bigquery', 'pyarrow', 'numpy')
+# Child process: the app import is timed before anything else is imported
+CHILD = ('import time; start = time.perf_counter(); import app; imported = time.perf_counter(); '
+         'from bench.startup import child; child({!r}, {!r}, {!r}, start, imported)')
+
+
+async def lifespan_startup(app):
+    # Minimal ASGI lifespan driver: returns once startup is complete, with the shutdown callable
+    messages = asyncio.Queue()
+    started = asyncio.Event()
+    messages.put_nowait({'type': 'lifespan.startup'})
+
+    async def receive():
+        return await messages.get()
+
+    async def send(message):
+        if message['type'] == 'lifespan.startup.complete':
+            started.set()
+
+    task = asyncio.create_task(app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, receive, send))
+    await started.wait()
+
+    async def shutdown():
+        messages.put_nowait({'type': 'lifespan.shutdown'})
+        await task
+    return shutdown
+
+
+def child(mode, connect_latency, latency, start, imported):
+    # Runs in the benchmarked process, prints results as JSON
+    from bench import BenchConfig, asgi_get, country_rows
+    from app import create_app
+    from gbq_manager.fake import FakeBQManager
+    heavy_modules = [m for m in HEAVY_MODULES if m in sys.modules]
+    imported_all = time.perf_counter()
+
+    class StartupConfig(BenchConfig):
+        BQ_LAZY_CLIENT = mode == 'lazy'
+
+    bq = FakeBQManager(rows=country_rows, latency=latency, connect_latency=connect_latency)
+    app = create_app(configclass=StartupConfig, bq=bq)
+    created = time.perf_counter()
+
+    async def serve():
+        shutdown = await lifespan_startup(app)
+        started = time.perf_counter()
+        status, size = await asgi_get(app, '/healthcheck')
+        healthcheck = time.perf_counter()
+        while (await asgi_get(app, '/readiness'))[0] != 200:
+            await asyncio.sleep(0.005)
+        ready = time.perf_counter()
+        await shutdown()
+        return started, healthcheck, ready
+
+    started, healthcheck, ready = asyncio.run(serve())
+    print(json.dumps({'mode': mode,
+                      'import_ms': round((imported - start) * 1000, 1),
+                      'create_app_ms': round((created - imported_all) * 1000, 1),
+                      'startup_ms': round((started - start) * 1000, 1),
+                      'first_healthcheck_ms': round((healthcheck - start) * 1000, 1),
+                      'ready_ms': round((ready - start) * 1000, 1),
+                      'heavy_modules': heavy_modules}))
+
+
+def run(mode, runs, connect_latency, latency):
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD.format(mode, connect_latency, latency)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        results.append(result)
+    # Median of every timing
+    summary = dict(results[0])
+    for name, value in results[0].items():
+        if name.endswith('_ms'):
+            summary[name] = round(statistics.median(r[name] for r in results), 1)
+    summary['runs'] = runs
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.startup', description='Import time and startup benchmark')
+    parser.add_argument('--mode', choices=MODES + ('all',), default='all')
+    parser.add_argument('--runs', type=int, default=3, help='processes per mode, median reported')
+    parser.add_argument('--connect-latency', type=float, default=0.5,
+                        help='simulated BigQuery client construction time, seconds')
+    parser.add_argument('--latency', type=float, default=0.2, help='simulated BigQuery job latency, seconds')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    args = parser.parse_args()
+
+    columns = ('mode', 'import_ms', 'create_app_ms', 'first_healthcheck_ms', 'ready_ms', 'process_ms')
+    if not args.json:
+        print(' '.join('{:>20}'.format(c) for c in columns))
+    for mode in (MODES if args.mode == 'all' else (args.mode,)):
+        result = run(mode, args.runs, args.connect_latency, args.latency)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(' '.join('{:>20}'.format(result[c]) for c in columns) + '  heavy modules: {}'.format(
+                ', '.join(result['heavy_modules']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+# Pre-fork workers benchmark
+# Runs the server (python start.py equivalent, FakeBQManager backend) with 1 then N pre-fork workers, sends
+# HTTP requests for warm per-country contents from client processes over keep-alive connections,
+# and reports throughput, latency, time to the first response, and memory of the server processes:
+# RSS counts shared pages once per process, PSS splits them between the processes sharing them,
+# private is memory not shared with the parent or other workers (copy-on-write pages written, own allocations)
+# Usage, from src folder:
+#   python -m bench.workers --workers 1 4 --countries 200 --duration 10
+
+SERVE = 'from bench.workers import serve; serve({workers!r}, {port!r}, {countries!r}, {days!r})'
+
+
+def bulk_rows(countries, days):
+    # Rows of bulk per-country queries, days rows per country, and the list of countries
+    names = ['Country {:04d}'.format(i) for i in range(countries)]
+
+    def rows(sql_query, query_parameters):
+        if 'bulk_country' not in sql_query:
+            return [{'country_region': name} for name in names]
+        return [{'bulk_country': name, 'country_region': name, 'date': '2023-02-{:02d}'.format(day % 28 + 1),
+                 'total_confirmed': 1000 * i + day, 'total_dead': 10 * i + day, 'drate': (day + 1) / (i + 7.0)}
+                for i, name in enumerate(names) for day in range(days)]
+    return rows
+
+
+def serve(workers, port, countries, days):
+    # Server process: contents loaded by the parent, then workers forked
+    from bench import BenchConfig
+    from app import create_app
+    from gbq_manager.fake import FakeBQManager
+    from prefork import PreforkServer
+
+    class WorkersConfig(BenchConfig):
+        WEB_CONCURRENCY = workers
+        CONTENT_SOURCE_CHECK_INTERVAL = 0
+
+    app = create_app(configclass=WorkersConfig, bq=FakeBQManager(rows=bulk_rows(countries, days)))
+    PreforkServer(app, host='127.0.0.1', port=port, workers=workers, log_level='warning').run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, timeout=120.0):
+    # Seconds until the server answers
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+                sock.sendall(b'GET /healthcheck HTTP/1.1\r\nHost: bench\r\n\r\n')
+                if sock.recv(16).startswith(b'HTTP/1.1 200'):
+                    return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError('Server not ready')
+
+
+def process_memory(pid) -> dict:
+    # RSS, PSS and private memory of a process, in bytes
+    memory = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                memory[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    return {'rss': memory.get('Rss', 0), 'pss': memory.get('Pss', 0),
+            'private': memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)}
+
+
+def server_memory(pid) -> dict:
+    # Parent and worker processes of the server
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+        children = [int(child) for child in f.read().split()]
+    parent = process_memory(pid)
+    workers = [process_memory(child) for child in children]
+    total = {name: parent[name] + sum(worker[name] for worker in workers) for name in parent}
+    return {'processes': 1 + len(workers),
+            'rss_mb': round(total['rss'] / 2 ** 20, 1),
+            'pss_mb': round(total['pss'] / 2 ** 20, 1),
+            'worker_private_mb': round(sum(w['private'] for w in workers) / max(len(workers), 1) / 2 ** 20, 1)}
+
+
+async def http_client(port, paths, deadline, latencies, statuses):
+    # One keep-alive connection, requests sent one after the other until the deadline
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            path = random.choice(paths)
+            start = time.perf_counter()
+            writer.write('GET {} HTTP/1.1\r\nHost: bench\r\n\r\n'.format(path).encode('latin-1'))
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = int(head[9:12])
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+def client_process(port, paths, connections, duration, seed, results):
+    random.seed(seed)
+    latencies = []
+    statuses = {}
+
+    async def run():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[http_client(port, paths, deadline, latencies, statuses) for _ in range(connections)])
+    try:
+        asyncio.run(run())
+    finally:
+        results.put((latencies, statuses))
+
+
+def load(port, paths, clients, connections, duration):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client_process, args=(port, paths, connections, duration, i, results))
+                 for i in range(clients)]
+    for process in processes:
+        process.start()
+    latencies = []
+    statuses = {}
+    for _ in processes:
+        client_latencies, client_statuses = results.get()
+        latencies.extend(client_latencies)
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    for process in processes:
+        process.join()
+    return latencies, statuses
+
+
+def run(workers, args):
+    from bench import percentile
+    port = free_port()
+    code = SERVE.format(workers=workers, port=port, countries=args.countries, days=args.days)
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+    try:
+        ready = wait_ready(port)
+        paths = [quote('/countries/Country {:04d}/evolution/'.format(i)) for i in range(args.countries)]
+        paths.append('/countries/')
+        latencies, statuses = load(port, paths, args.clients, args.connections, args.duration)
+        memory = server_memory(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return dict({'workers': workers, 'ready_s': round(ready, 2), 'requests': len(latencies),
+                 'throughput_rps': round(len(latencies) / args.duration, 1),
+                 'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                 'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                 'statuses': statuses}, **memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench.workers', description='Pre-fork workers benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60, help='rows per country content')
+    parser.add_argument('--clients', type=int, default=2, help='client processes')
+    parser.add_argument('--connections', type=int, default=16, help='keep-alive connections per client process')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per run')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    args = parser.parse_args()
+
+    columns = ('workers', 'ready_s', 'requests', 'throughput_rps', 'p50_ms', 'p99_ms', 'processes', 'rss_mb',
+               'pss_mb', 'worker_private_mb')
+    if not args.json:
+        print(' '.join('{:>17}'.format(c) for c in columns))
+    for workers in args.workers:
+        result = run(workers, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(' '.join('{:>17}'.format(result[c]) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
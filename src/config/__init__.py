@@ -3,11 +3,114 @@ import os
 
 
 class Config(object):
-    settings = ['BQ_SA_KEY_JSON_FILE', 'API_NAME', 'API_VER', 'VIEW_APP_NAME']
+    settings = ['BQ_SA_KEY_JSON_FILE', 'API_NAME', 'API_VER', 'VIEW_APP_NAME',
+                'BQ_LAZY_CLIENT', 'BQ_MAX_CONCURRENT_JOBS', 'BQ_JOB_PRIORITIES', 'BQ_HTTP_POOL_SIZE',
+                'BQ_JOB_TIMEOUT', 'BQ_POLL_INITIAL_DELAY', 'BQ_POLL_MAX_DELAY', 'BQ_POLL_MULTIPLIER',
+                'BQ_BREAKER_FAILURES', 'BQ_BREAKER_RESET_TIMEOUT', 'CONTENT_RETRY_BACKOFF', 'CONTENT_RETRY_MAX_BACKOFF',
+                'BQ_VALIDATE_QUERIES', 'BQ_BYTES_BUDGET', 'BQ_BUDGET_POLICY', 'BQ_BYTES_BILLED_FACTOR',
+                'BQ_DEFAULT_BYTES_BILLED',
+                'CONTENT_SWR', 'CONTENT_SOFT_TTL', 'CONTENT_HARD_TTL', 'CONTENT_SOURCE_CHECK_INTERVAL',
+                'CONTENT_PREFRESH_INTERVAL', 'CONTENT_PREFRESH_LEAD', 'CONTENT_PREFRESH_MIN_HITS',
+                'CONTENT_CACHE_MAX_ENTRIES', 'CONTENT_CACHE_MAX_BYTES', 'CONTENT_CACHE_POLICY', 'CONTENT_CACHE_TTL',
+                'CONTENT_SHARED_CACHE_URL', 'CONTENT_PREFETCH', 'CONTENT_SNAPSHOT_PATH', 'CONTENT_TRACING',
+                'CONTENT_AGGREGATE_TABLE', 'CONTENT_AGGREGATE_INTERVAL', 'CONTENT_BATCH_MAX_ITEMS',
+                'CONTENT_STREAM_PAGE_SIZE', 'CONTENT_STREAM_MAX_CACHED_ROWS', 'CONTENT_COMPACT_ROWS',
+                'CONTENT_MAX_CONCURRENT_MISSES', 'CONTENT_MISS_QUEUE', 'CONTENT_MISS_DEADLINE', 'CONTENT_WARM_KEYS',
+                'WEB_CONCURRENCY', 'CONTENT_GENERATION_PATH', 'CONTENT_GENERATION_CHECK_INTERVAL',
+                'CONTENT_GENERATION_REFRESH_INTERVAL']
     BQ_SA_KEY_JSON_FILE = os.environ.get('BQ_SA_KEY_JSON_FILE') or '/etc/secrets/sa_key_bq.json'
     API_NAME = os.environ.get('API_NAME') or 'gfs-bq-fastapi'
     API_VER = os.environ.get('API_VER') or 'alpha'
     VIEW_APP_NAME = os.environ.get('VIEW_APP_NAME') or 'fastapi_demo_app'
+    # Fast startup: BigQuery client built in a startup background task or on first use, not in create_app
+    BQ_LAZY_CLIENT = (os.environ.get('BQ_LAZY_CLIENT') or 'false').lower() == 'true'
+    # Max BigQuery jobs in flight per process, jobs waiting for a slot start by priority (lower first)
+    # Per content key priorities, e.g. 'get_countries:0,bulk:get_country_summary:20', default 10
+    BQ_MAX_CONCURRENT_JOBS = int(os.environ.get('BQ_MAX_CONCURRENT_JOBS') or 8)
+    BQ_JOB_PRIORITIES = os.environ.get('BQ_JOB_PRIORITIES') or ''
+    # Keep-alive HTTP connections per host, 0: BQ_MAX_CONCURRENT_JOBS + 4
+    BQ_HTTP_POOL_SIZE = int(os.environ.get('BQ_HTTP_POOL_SIZE') or 0)
+    # BigQuery job wait policy (seconds)
+    # Job timeout and exponential backoff used when polling job state
+    BQ_JOB_TIMEOUT = float(os.environ.get('BQ_JOB_TIMEOUT') or 60)
+    BQ_POLL_INITIAL_DELAY = float(os.environ.get('BQ_POLL_INITIAL_DELAY') or 0.1)
+    BQ_POLL_MAX_DELAY = float(os.environ.get('BQ_POLL_MAX_DELAY') or 2)
+    BQ_POLL_MULTIPLIER = float(os.environ.get('BQ_POLL_MULTIPLIER') or 1.5)
+    # Circuit breaker: after BQ_BREAKER_FAILURES consecutive job failures no job runs for BQ_BREAKER_RESET_TIMEOUT
+    # seconds, then one probe job. Contents are served from cache or fail fast meanwhile
+    BQ_BREAKER_FAILURES = int(os.environ.get('BQ_BREAKER_FAILURES') or 5)
+    BQ_BREAKER_RESET_TIMEOUT = float(os.environ.get('BQ_BREAKER_RESET_TIMEOUT') or 30)
+    # Failed content loads are not retried before a backoff (seconds), doubled on each failure up to the max
+    CONTENT_RETRY_BACKOFF = float(os.environ.get('CONTENT_RETRY_BACKOFF') or 5)
+    CONTENT_RETRY_MAX_BACKOFF = float(os.environ.get('CONTENT_RETRY_MAX_BACKOFF') or 300)
+    # Query cost guardrails
+    # Dry-run every registered query at startup, recording its estimated bytes processed
+    BQ_VALIDATE_QUERIES = (os.environ.get('BQ_VALIDATE_QUERIES') or 'false').lower() == 'true'
+    # Max estimated bytes processed per query, 0: no budget. Policy for queries over budget: reject or flag
+    BQ_BYTES_BUDGET = int(os.environ.get('BQ_BYTES_BUDGET') or 0)
+    BQ_BUDGET_POLICY = os.environ.get('BQ_BUDGET_POLICY') or 'reject'
+    # Jobs run with maximum_bytes_billed: dry run estimate times this factor, capped by the budget
+    BQ_BYTES_BILLED_FACTOR = float(os.environ.get('BQ_BYTES_BILLED_FACTOR') or 2)
+    # maximum_bytes_billed of jobs of queries not validated when there is no budget, 0: no limit
+    BQ_DEFAULT_BYTES_BILLED = int(os.environ.get('BQ_DEFAULT_BYTES_BILLED') or 10 * 1024 ** 3)
+    # Content freshness
+    # Stale-while-revalidate: serve stale content while refreshing it in background
+    CONTENT_SWR = (os.environ.get('CONTENT_SWR') or 'false').lower() == 'true'
+    # Default soft and hard TTL (seconds), 0: stale when the source table changes, never expired
+    CONTENT_SOFT_TTL = float(os.environ.get('CONTENT_SOFT_TTL') or 0)
+    CONTENT_HARD_TTL = float(os.environ.get('CONTENT_HARD_TTL') or 0)
+    # Source table last modification time checked every CONTENT_SOURCE_CHECK_INTERVAL seconds, one metadata call
+    # shared by all contents. 0: no checks, contents without soft TTL go stale when the date rolls over
+    CONTENT_SOURCE_CHECK_INTERVAL = float(os.environ.get('CONTENT_SOURCE_CHECK_INTERVAL') or 600)
+    # Hot contents pre-refresh scheduler (seconds), interval 0: disabled
+    CONTENT_PREFRESH_INTERVAL = float(os.environ.get('CONTENT_PREFRESH_INTERVAL') or 0)
+    CONTENT_PREFRESH_LEAD = float(os.environ.get('CONTENT_PREFRESH_LEAD') or 60)
+    CONTENT_PREFRESH_MIN_HITS = int(os.environ.get('CONTENT_PREFRESH_MIN_HITS') or 10)
+    # In memory content cache limits, 0: no limit
+    # Max number of contents, max approximate size in bytes of contents data, max seconds a content is kept
+    # Eviction policy: lru (least recently used) or lfu (least frequently used)
+    CONTENT_CACHE_MAX_ENTRIES = int(os.environ.get('CONTENT_CACHE_MAX_ENTRIES') or 0)
+    CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES') or 0)
+    CONTENT_CACHE_POLICY = os.environ.get('CONTENT_CACHE_POLICY') or 'lru'
+    CONTENT_CACHE_TTL = float(os.environ.get('CONTENT_CACHE_TTL') or 0)
+    # Shared content cache tier for all workers and instances, empty: disabled
+    # sqlite:///path/to/contents.db or redis://[:password@]host[:port][/db]
+    CONTENT_SHARED_CACHE_URL = os.environ.get('CONTENT_SHARED_CACHE_URL') or ''
+    # Load per-country contents for all countries with one query per content, at startup and date rollover
+    CONTENT_PREFETCH = (os.environ.get('CONTENT_PREFETCH') or 'false').lower() == 'true'
+    # Local columnar snapshot of the source table, contents computed without BigQuery (requires numpy)
+    # Directory pulled from BigQuery once a day, or static CSV file. Empty: disabled
+    CONTENT_SNAPSHOT_PATH = os.environ.get('CONTENT_SNAPSHOT_PATH') or ''
+    # Daily aggregate table in our own dataset (project.dataset.table), read by registered queries once built
+    # Rebuilt when the source table changes, checked every CONTENT_AGGREGATE_INTERVAL seconds. Empty: disabled
+    CONTENT_AGGREGATE_TABLE = os.environ.get('CONTENT_AGGREGATE_TABLE') or ''
+    CONTENT_AGGREGATE_INTERVAL = float(os.environ.get('CONTENT_AGGREGATE_INTERVAL') or 3600)
+    # Max contents requested in one batch request
+    CONTENT_BATCH_MAX_ITEMS = int(os.environ.get('CONTENT_BATCH_MAX_ITEMS') or 50)
+    # Streamed contents (NDJSON): rows per page, max rows of a streamed content kept in the content cache
+    CONTENT_STREAM_PAGE_SIZE = int(os.environ.get('CONTENT_STREAM_PAGE_SIZE') or 1000)
+    CONTENT_STREAM_MAX_CACHED_ROWS = int(os.environ.get('CONTENT_STREAM_MAX_CACHED_ROWS') or 100000)
+    # Cache miss admission: max misses loaded at once, max misses waiting, max seconds waiting (0: no limit)
+    # Misses over the limits get a 503 response with Retry-After. Cache hits are never queued. 0 concurrent: disabled
+    CONTENT_MAX_CONCURRENT_MISSES = int(os.environ.get('CONTENT_MAX_CONCURRENT_MISSES') or 32)
+    CONTENT_MISS_QUEUE = int(os.environ.get('CONTENT_MISS_QUEUE') or 128)
+    CONTENT_MISS_DEADLINE = float(os.environ.get('CONTENT_MISS_DEADLINE') or 10)
+    # Cached content rows stored column-wise (typed arrays, interned strings): less memory, rebuilt on every read
+    CONTENT_COMPACT_ROWS = (os.environ.get('CONTENT_COMPACT_ROWS') or 'false').lower() == 'true'
+    # Contents loaded in background after startup, comma separated keys. App ready once loaded, see /readiness
+    CONTENT_WARM_KEYS = [k.strip() for k in (os.environ.get('CONTENT_WARM_KEYS') or 'get_countries').split(',')
+                         if k.strip()]
+    # Pre-fork workers (python start.py): the parent process loads every registered content, then forks the workers
+    # Workers share its warm cache, the parent loads again stale contents every CONTENT_GENERATION_REFRESH_INTERVAL
+    # seconds and publishes them in a generation file (CONTENT_GENERATION_PATH directory, a new one in /dev/shm by
+    # default), checked by workers every CONTENT_GENERATION_CHECK_INTERVAL seconds. 1 worker: single process
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    CONTENT_GENERATION_PATH = os.environ.get('CONTENT_GENERATION_PATH') or ''
+    CONTENT_GENERATION_CHECK_INTERVAL = float(os.environ.get('CONTENT_GENERATION_CHECK_INTERVAL') or 1)
+    CONTENT_GENERATION_REFRESH_INTERVAL = float(os.environ.get('CONTENT_GENERATION_REFRESH_INTERVAL') or 60)
+    # OpenTelemetry spans for content loads and BigQuery jobs (requires opentelemetry-api, SDK set up by the app)
+    # Metrics are always collected and exposed in /metrics
+    CONTENT_TRACING = (os.environ.get('CONTENT_TRACING') or 'false').lower() == 'true'
 
     def to_dict(self):
         r = {}
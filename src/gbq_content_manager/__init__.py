@@ -1,22 +1,144 @@
+import asyncio
 import base64
+import collections
 import datetime
+import hashlib
 import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gbq_content_manager.admission import MissAdmission, AdmissionRejected
+from gbq_content_manager.aggregate import AGGREGATE_QUERY_KEY, aggregate_sql, country_table_id, rewrite_templates
+from gbq_content_manager.cache import ContentCache, BoundedContentCache
+from gbq_content_manager.columnar import compact_rows, expand_rows, after_fork as columnar_after_fork
+from gbq_content_manager.encoding import IDENTITY, encode_json, compress
+from gbq_content_manager.metrics import ContentMetrics, span, trace_job, trace_error
+from gbq_content_manager.pagination import data_page
+from gbq_content_manager.query_costs import QueryCostRegistry, SAMPLE_PARAMETERS, DEFAULT_BYTES_BILLED
+from gbq_content_manager.query_templates import QueryTemplate, SOURCE_TABLE
+from gbq_content_manager.shared_cache import shared_store_from_url
+from gbq_content_manager.single_flight import SingleFlight
+from gbq_content_manager.source_versions import SourceVersions
+from gbq_manager.circuit_breaker import BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+from gbq_manager.executor import PRIORITY_LOW
+
+# Content states
+# missing: never loaded or no valid data
+# fresh: served from memory
+# stale: served from memory while refreshed in background (stale-while-revalidate)
+# expired: refreshed inline
+# failed: last load failed, served as is (last good data or none) until its retry time
+CONTENT_MISSING = 'missing'
+CONTENT_FRESH = 'fresh'
+CONTENT_STALE = 'stale'
+CONTENT_EXPIRED = 'expired'
+CONTENT_FAILED = 'failed'
+
+# Readiness states: app started, BigQuery client being built and contents warmed up, warm
+READINESS_STARTING = 'starting'
+READINESS_WARMING = 'warming'
+READINESS_READY = 'ready'
+
+# Query keys of bulk prefetch queries: prefix and content registry key
+BULK_QUERY_PREFIX = 'bulk:'
+SNAPSHOT_QUERY_KEY = 'snapshot'
+
+# Shared cache tier expiry of contents current with their source table: they are checked against it when read
+SOURCE_CONTENT_SHARED_TTL = 7 * 24 * 3600
+
+# Content to load: content key, registry key, title, SQL query and its canonical query parameters
+ContentRequest = collections.namedtuple('ContentRequest', ['content_key', 'key', 'title', 'sql_query',
+                                                           'query_parameters'])
+
+# Circuit breaker states as metric values
+BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_OPEN: 1, BREAKER_HALF_OPEN: 2}
+
+
+class ContentUnavailable(Exception):
+    # Content could not be loaded and no previous data is available, retry_after: seconds before the next load
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class BigQueryContent:
+    # Slots: no per instance dictionary, thousands of contents can be cached
+    __slots__ = ('encodings', 'data_etag', 'rows', 'last_run', 'source_version', 'loaded_at', 'hits', 'failures',
+                 'retry_at', 'key', 'title', 'sql_query', 'query_parameters')
 
     def __init__(self, *args, **kwargs):
+        # Response bodies for data, by content encoding, built once on first use
+        self.encodings = {}
+        self.data_etag = None
         self.data = None
         self.last_run = None
+        # Version (last modification time) of the source table the data was loaded from, None if unknown
+        self.source_version = None
+        # Timestamp of last successful data load
+        self.loaded_at = None
+        # Requests served since last load, used to find hot contents
+        self.hits = 0
+        # Consecutive failed loads, and time before which the content is not loaded again (negative caching)
+        self.failures = 0
+        self.retry_at = None
+        self.key = None
         self.title = None
         self.sql_query = None
+        self.query_parameters = None
+
+        if 'key' in kwargs:
+            self.key = kwargs.get('key')
 
         if 'sql_query' in kwargs:
             self.sql_query = kwargs.get('sql_query')
 
+        if 'query_parameters' in kwargs:
+            self.query_parameters = kwargs.get('query_parameters')
+
         if 'title' in kwargs:
             self.title = kwargs.get('title')
 
+    @property
+    def data(self):
+        # Dict rows as stored, or rebuilt from compact rows on each read (CONTENT_COMPACT_ROWS):
+        # read rows or encoded bodies on hot paths
+        return expand_rows(self.rows)
+
+    @data.setter
+    def data(self, data):
+        # data: dict rows, or compact rows (see columnar module)
+        # New data invalidates encoded bodies and entity tag
+        self.rows = data
+        self.data_etag = None
+        self.encodings = {}
+
+    def encoded(self, encoding=IDENTITY) -> bytes:
+        # JSON body for data, compressed with encoding (identity, gzip, br)
+        # Encodings dictionary read before data: a body is never cached for data it was not built from
+        encodings = self.encodings
+        body = encodings.get(encoding)
+        if body is None:
+            if encoding == IDENTITY:
+                body = encode_json(expand_rows(self.rows))
+            else:
+                body = compress(self.encoded(IDENTITY), encoding)
+            encodings[encoding] = body
+        return body
+
+    def etag(self, encoding=IDENTITY) -> str:
+        # Strong entity tag: hash of the JSON body, one tag per content encoding
+        data_etag = self.data_etag
+        if data_etag is None:
+            data_etag = hashlib.blake2b(self.encoded(IDENTITY), digest_size=16).hexdigest()
+            self.data_etag = data_etag
+        if encoding == IDENTITY:
+            return '"{}"'.format(data_etag)
+        return '"{}-{}"'.format(data_etag, encoding)
+
 
 def singleton(cls):
     obj = cls()
@@ -40,91 +162,1292 @@ class AppBQContentManager:
         self.app_id = None
         self.titles = None
         self.sql_queries = None
+        self.bulk_sql_queries = None
+        self.ttls = None
+        # BigQuery job wait policy, overridden by app config in init_app
+        self.job_timeout = 60.0
+        self.poll_initial_delay = 0.1
+        self.poll_max_delay = 2.0
+        self.poll_multiplier = 1.5
+        # Dry run estimates and bytes billed guardrails, see query_costs module
+        self.query_costs = QueryCostRegistry()
+        self.validate_on_startup = False
+        # Content freshness policy, overridden by app config in init_app
+        # Soft TTL None: content goes stale when its source table changes, see source_versions module,
+        # or when the date rolls over if source table versions are not checked
+        # Hard TTL None: stale content is never refreshed inline
+        self.swr = False
+        self.soft_ttl = None
+        self.hard_ttl = None
+        # Hot contents pre-refresh scheduler
+        self.prefresh_interval = 0
+        self.prefresh_lead = 60.0
+        self.prefresh_min_hits = 10
+        self.prefresh_stop = None
+        self.refresh_executor = None
+        # Bulk prefetch of per-country contents at startup, and source table change or date rollover
+        self.prefetch = False
+        self.prefetch_stop = None
+        # Optional daily aggregate table read by registered queries once built, see aggregate module
+        self.aggregate_table = None
+        self.aggregate_interval = 3600.0
+        self.aggregate_ready = False
+        self.aggregate_built_at = None
+        self.aggregate_sql_queries = {}
+        self.aggregate_bulk_sql_queries = {}
+        self.aggregate_stop = None
+        # Source table versions, checked every CONTENT_SOURCE_CHECK_INTERVAL seconds (0: not checked)
+        # source_tables: registry key -> table its query reads, if not the source summary table
+        self.sources = SourceVersions()
+        self.source_tables = {}
+        self.source_stop = None
+        # Running scheduler threads, joined by stop_schedulers
+        self.scheduler_threads = []
+        # Pre-fork workers: contents published by the parent process, see generations module
+        self.generations = None
         self.load_titles()
         self.load_sql_queries()
+        self.load_bulk_sql_queries()
+        self.load_ttls()
 
-        # content: In memory BiqQueryContent objects dictionary
-        self.contents = {}
+        # content: In memory BiqQueryContent objects cache, unbounded unless configured in init_app
+        self.contents = ContentCache()
+        # Optional shared content cache tier, see shared_cache module
+        self.shared_contents = None
+        # Optional local snapshot engine, see snapshot module
+        self.snapshot_path = None
+        self.snapshot = None
+        # Concurrent misses for the same content key share a single BigQuery job
+        self.single_flight = SingleFlight()
+        # Bounded concurrency of cache miss loads, excess misses shed, see admission module
+        self.admission = MissAdmission()
+        # Startup warm-up: contents loaded in background after startup, see warm_up
+        self.warm_keys = ['get_countries']
+        self.readiness = READINESS_STARTING
+        # Failed loads: content not loaded again for a backoff, doubled on each failure up to the max
+        self.retry_backoff = 5.0
+        self.retry_max_backoff = 300.0
+        # Streaming of large contents, page by page
+        self.stream_page_size = 1000
+        self.stream_max_cached_rows = 100000
+        # Data rows of cached contents stored column-wise, see columnar module
+        self.compact_rows = False
+        # Pipeline metrics, always collected. OpenTelemetry spans when CONTENT_TRACING is set
+        self.metrics = ContentMetrics()
+        self.metrics.gauge('content_cache', 'Content cache and single flight counters', ('stat',),
+                           function=self.cache_metrics)
+        self.metrics.gauge('bigquery_query_estimated_bytes', 'Dry run estimated bytes processed per query',
+                           ('key', 'status'), function=self.query_cost_metrics)
+        self.metrics.gauge('bigquery_job_executor', 'BigQuery job executor slots and counters', ('stat',),
+                           function=self.executor_metrics)
+        self.metrics.gauge('bigquery_circuit_breaker', 'BigQuery circuit breaker state (0 closed, 1 open, 2 half open)'
+                           ' and counters', ('stat',), function=self.breaker_metrics)
+        self.metrics.gauge('content_admission', 'Cache miss admission: loads active and queued, shed misses', ('stat',),
+                           function=self.admission_metrics)
+        self.metrics.gauge('content_failing', 'Contents not loaded again before their retry time',
+                           function=lambda: len(self.failing_contents()))
+        self.tracing = False
 
-    def init_app(self, app, bq):
+    def init_app(self, app, bq, contents=None, shared_contents=None):
+        # contents: optional content cache backend, implementing ContentCache interface
+        # shared_contents: optional shared cache tier, implementing SharedContentStore interface
         self.app = app
         self.app_id = app.config.get('VIEW_APP_NAME')
+        # BigQuery job wait policy
+        self.job_timeout = app.config.get('BQ_JOB_TIMEOUT', self.job_timeout)
+        self.poll_initial_delay = app.config.get('BQ_POLL_INITIAL_DELAY', self.poll_initial_delay)
+        self.poll_max_delay = app.config.get('BQ_POLL_MAX_DELAY', self.poll_max_delay)
+        self.poll_multiplier = app.config.get('BQ_POLL_MULTIPLIER', self.poll_multiplier)
+        # Query cost guardrails
+        self.query_costs = QueryCostRegistry(budget=app.config.get('BQ_BYTES_BUDGET', 0),
+                                             policy=app.config.get('BQ_BUDGET_POLICY', 'reject'),
+                                             factor=app.config.get('BQ_BYTES_BILLED_FACTOR', 2.0),
+                                             default_limit=app.config.get('BQ_DEFAULT_BYTES_BILLED',
+                                                                          DEFAULT_BYTES_BILLED))
+        self.validate_on_startup = app.config.get('BQ_VALIDATE_QUERIES', self.validate_on_startup)
+        # Content freshness policy
+        self.swr = app.config.get('CONTENT_SWR', self.swr)
+        self.soft_ttl = app.config.get('CONTENT_SOFT_TTL') or self.soft_ttl
+        self.hard_ttl = app.config.get('CONTENT_HARD_TTL') or self.hard_ttl
+        self.prefresh_interval = app.config.get('CONTENT_PREFRESH_INTERVAL', self.prefresh_interval)
+        self.prefresh_lead = app.config.get('CONTENT_PREFRESH_LEAD', self.prefresh_lead)
+        self.prefresh_min_hits = app.config.get('CONTENT_PREFRESH_MIN_HITS', self.prefresh_min_hits)
+        self.sources.interval = app.config.get('CONTENT_SOURCE_CHECK_INTERVAL', self.sources.interval)
+        self.retry_backoff = app.config.get('CONTENT_RETRY_BACKOFF', self.retry_backoff)
+        self.retry_max_backoff = app.config.get('CONTENT_RETRY_MAX_BACKOFF', self.retry_max_backoff)
+        self.admission = MissAdmission(max_concurrent=app.config.get('CONTENT_MAX_CONCURRENT_MISSES', 32),
+                                       max_queue=app.config.get('CONTENT_MISS_QUEUE', 128),
+                                       deadline=app.config.get('CONTENT_MISS_DEADLINE', 10.0))
+        # Content cache backend
+        if contents is not None:
+            self.contents = contents
+        elif app.config.get('CONTENT_CACHE_MAX_ENTRIES') or app.config.get('CONTENT_CACHE_MAX_BYTES') \
+                or app.config.get('CONTENT_CACHE_TTL'):
+            self.contents = BoundedContentCache(max_entries=app.config.get('CONTENT_CACHE_MAX_ENTRIES', 0),
+                                                max_bytes=app.config.get('CONTENT_CACHE_MAX_BYTES', 0),
+                                                policy=app.config.get('CONTENT_CACHE_POLICY', 'lru'),
+                                                ttl=app.config.get('CONTENT_CACHE_TTL', 0))
+        # Shared content cache tier
+        if shared_contents is not None:
+            self.shared_contents = shared_contents
+        elif app.config.get('CONTENT_SHARED_CACHE_URL'):
+            self.shared_contents = shared_store_from_url(app.config.get('CONTENT_SHARED_CACHE_URL'))
+        # Local snapshot engine
+        self.snapshot_path = app.config.get('CONTENT_SNAPSHOT_PATH') or None
+        self.snapshot = None
+        self.tracing = app.config.get('CONTENT_TRACING', self.tracing)
+        self.stream_page_size = app.config.get('CONTENT_STREAM_PAGE_SIZE', self.stream_page_size)
+        self.warm_keys = app.config.get('CONTENT_WARM_KEYS', self.warm_keys)
+        self.readiness = READINESS_STARTING
+        self.stream_max_cached_rows = app.config.get('CONTENT_STREAM_MAX_CACHED_ROWS', self.stream_max_cached_rows)
+        self.compact_rows = app.config.get('CONTENT_COMPACT_ROWS', False)
+        # Daily aggregate table
+        self.aggregate_table = app.config.get('CONTENT_AGGREGATE_TABLE') or None
+        self.aggregate_interval = app.config.get('CONTENT_AGGREGATE_INTERVAL', self.aggregate_interval)
+        self.aggregate_ready = False
+        if self.aggregate_table is not None:
+            self.aggregate_sql_queries = rewrite_templates(self.sql_queries, self.aggregate_table)
+            self.aggregate_bulk_sql_queries = rewrite_templates(self.bulk_sql_queries, self.aggregate_table, bulk=True)
         self.__class__.bq = bq
+        if self.prefresh_interval:
+            self.start_refresh_scheduler()
+        if self.aggregate_table is not None:
+            self.start_aggregate_scheduler()
+        if self.sources.interval:
+            self.start_source_scheduler()
+        if self.validate_on_startup:
+            threading.Thread(target=self.validate_queries, name='query-validation', daemon=True).start()
+        self.prefetch = app.config.get('CONTENT_PREFETCH', self.prefetch)
+        if self.prefetch:
+            self.start_prefetch_scheduler()
 
-    def bq_run(self, sql_query):
+    def bq_run(self, sql_query, query_parameters=None, key='query', priority=None):
         # Only run in BQ  if not run already today or empty data
+        # key: content registry key the job is run for, used as metrics label and for its priority
+        # The job waits for a slot of the backend job executor: at most BQ_MAX_CONCURRENT_JOBS jobs in flight
+        # No job is run while the backend circuit breaker is open
+        bq = self.__class__.bq
+        data = None
+        if sql_query is not None and bq.initialized() and self.query_allowed(key) and self.backend_allows(key):
+            with bq.get_executor().slot(key, priority):
+                data = self.run_job(sql_query, query_parameters, key)
+        return data
+
+    def bq_submit(self, sql_query, query_parameters=None, key='query', priority=None):
+        # Same as bq_run, run in a backend executor thread: returns a concurrent.futures.Future of the rows
+        # Many jobs can be submitted at once, they run within the job concurrency limit
         bq = self.__class__.bq
+        if sql_query is None or not bq.initialized() or not self.query_allowed(key) or not self.backend_allows(key):
+            future = Future()
+            future.set_result(None)
+            return future
+        return bq.get_executor().submit_call(self.run_job, (sql_query, query_parameters, key),
+                                             key=key, priority=priority)
+
+    def run_job(self, sql_query, query_parameters, key):
+        # Runs a query job, with a job slot held by the caller. Returns rows, None on errors
         data = None
-        if sql_query is not None and bq.initialized():
+        start = time.perf_counter()
+        self.metrics.bq_in_flight.inc()
+        with span('bigquery.job', self.tracing, key=key) as job_span:
             try:
-                query_job = self.bq.client.query(query=sql_query)
-                # Wait for job with default timeout and retry policy
-                while query_job.done() is False:
-                    pass
-                # Format job results
-                # Result is a group of rows
-                output = []
-                for row in query_job.result():
-                    # Row values can be accessed by field name or index.
-                    output.append(row)
-                data = [dict(row) for row in output]
+                query_job = self.bq.query(sql_query, query_parameters, **self.job_options(key))
+                # Block the calling thread until the job finishes or times out
+                # The client library polls the job with its own backoff, no busy waiting
+                # Format job results: list of dictionaries, one per row
+                data = self.bq.fetch_rows(query_job, timeout=self.job_timeout)
+                self.bq.get_breaker().record_success()
+                self.metrics.job_finished(key, query_job, len(data), time.perf_counter() - start)
+                trace_job(job_span, query_job, len(data))
             except Exception as e:
                 logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
                                                                                          self.bq_run.__name__))
+                self.bq.get_breaker().record_failure(e)
+                self.metrics.job_failed(key, time.perf_counter() - start)
+                trace_error(job_span, e)
                 data = None
+            finally:
+                self.metrics.bq_in_flight.dec()
         return data
 
-    def load_content(self, key, *args, **kwargs):
-        content_manager = self
-        content_key = key
+    async def bq_run_async(self, sql_query, query_parameters=None, key='query', priority=None):
+        # Same as bq_run, but never blocks the event loop
+        # Blocking client calls run in worker threads, waiting for the job is done with asyncio.sleep
+        bq = self.__class__.bq
+        data = None
+        if sql_query is not None and bq.initialized() and self.query_allowed(key) and self.backend_allows(key):
+            query_job = None
+            executor = bq.get_executor()
+            await executor.acquire_async(key, priority)
+            start = time.perf_counter()
+            self.metrics.bq_in_flight.inc()
+            with span('bigquery.job', self.tracing, key=key) as job_span:
+                # Job started in a worker thread, shielded: a job started after the caller is cancelled is cancelled too
+                query_start = asyncio.ensure_future(asyncio.to_thread(self.bq.query, sql_query, query_parameters,
+                                                                      **self.job_options(key)))
+                try:
+                    query_job = await asyncio.shield(query_start)
+                    await self.wait_job(query_job)
+                    # Result pages are downloaded while decoding, keep it off the event loop
+                    data = await asyncio.to_thread(self.bq.fetch_rows, query_job)
+                    bq.get_breaker().record_success()
+                    self.metrics.job_finished(key, query_job, len(data), time.perf_counter() - start)
+                    trace_job(job_span, query_job, len(data))
+                except asyncio.CancelledError:
+                    # Caller cancelled (client gone, caller timeout): the job is cancelled in a worker thread,
+                    # without delaying the cancellation, and not counted as a backend failure
+                    self.metrics.job_cancelled(key, time.perf_counter() - start)
+                    if query_job is not None:
+                        self.cancel_job_later(query_job)
+                    else:
+                        query_start.add_done_callback(self.cancel_started_job)
+                    raise
+                except Exception as e:
+                    logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                        e.__class__, e, self.bq_run_async.__name__))
+                    bq.get_breaker().record_failure(e)
+                    self.metrics.job_failed(key, time.perf_counter() - start)
+                    trace_error(job_span, e)
+                    if query_job is not None:
+                        await self.cancel_job(query_job)
+                    data = None
+                finally:
+                    self.metrics.bq_in_flight.dec()
+                    executor.release()
+        return data
 
-        # Title and query provided by Content Manager
-        title = content_manager.titles.get(key)
-        sql_query = content_manager.sql_queries.get(key)
+    async def bq_stream_async(self, sql_query, query_parameters=None, key='query', page_size=None):
+        # Async generator of the result pages of a BigQuery job, read page by page
+        # Errors are logged and raised: a stream cannot report them once started
+        bq = self.__class__.bq
+        if sql_query is None or not bq.initialized() or not self.query_allowed(key):
+            raise RuntimeError("Query {} not run".format(key))
+        if not self.backend_allows(key):
+            raise ContentUnavailable("BigQuery unavailable", retry_after=bq.get_breaker().retry_after())
+        row_count = 0
+        # Job slot held until the job is done, not while its pages are read by the client
+        executor = bq.get_executor()
+        await executor.acquire_async(key)
+        slot_held = True
+        start = time.perf_counter()
+        self.metrics.bq_in_flight.inc()
+        try:
+            query_job = await asyncio.to_thread(self.bq.query, sql_query, query_parameters, **self.job_options(key))
+            await self.wait_job(query_job)
+            bq.get_breaker().record_success()
+            executor.release()
+            slot_held = False
+            pages = self.bq.iter_pages(query_job, timeout=self.job_timeout, page_size=page_size)
+            while True:
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
+                row_count += len(page)
+                yield page
+            self.metrics.job_finished(key, query_job, row_count, time.perf_counter() - start)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                e.__class__, e, self.bq_stream_async.__name__))
+            if slot_held:
+                # Job failed before it was done, page read errors are not counted by the breaker
+                bq.get_breaker().record_failure(e)
+            self.metrics.job_failed(key, time.perf_counter() - start)
+            raise
+        finally:
+            self.metrics.bq_in_flight.dec()
+            if slot_held:
+                executor.release()
 
-        if 'country' in kwargs:
-            country = kwargs.get('country')
-            if country is not None:
-                sql_query = sql_query.replace('<country>', country)
-                # Key includes method name and country
-                content_key = content_key + '@' + country.lower()
-        if 'country_list' in kwargs:
-            country_list = kwargs.get('country_list')
-            if country_list is not None:
-                inline_country_list = country_list.__str__().strip('[').strip(']')
-                sql_query = sql_query.replace('<country_list>', inline_country_list)
-                # Key includes method name and country
-                content_key = content_key + '@' + inline_country_list.lower()
-        if 'start_date' in kwargs:
-            # Validate start-date format
-            start_date = kwargs.get('start_date')
-            if start_date is not None:
-                sql_query = sql_query.replace('<start_date>', start_date)
-                # Key includes method name, country and date
-                content_key = content_key + '@' + start_date
-
-        # See if a local BigQueryContent exists in local content_manager
-        local_content = content_manager.contents.get(content_key)
+    def query_allowed(self, key) -> bool:
+        # Invalid queries, and over budget queries with reject policy, are never run
+        if self.query_costs.allowed(key):
+            return True
+        logging.log(level=logging.ERROR, msg="Query {} rejected: {} Method: {}".format(
+            key, self.query_costs.status(key), self.query_allowed.__name__))
+        self.metrics.bq_jobs.inc(key, 'rejected')
+        return False
+
+    def backend_allows(self, key) -> bool:
+        # Jobs fail fast while the backend circuit breaker is open, see gbq_manager/circuit_breaker.py
+        if self.bq.get_breaker().allow():
+            return True
+        self.metrics.bq_jobs.inc(key, 'short_circuited')
+        return False
+
+    def job_options(self, key) -> dict:
+        # Every job billed at most maximum_bytes_billed, derived from its dry run estimate
+        # Queries not validated: capped by the budget, or by BQ_DEFAULT_BYTES_BILLED
+        maximum_bytes_billed = self.query_costs.maximum_bytes_billed(key)
+        return {'maximum_bytes_billed': maximum_bytes_billed} if maximum_bytes_billed is not None else {}
+
+    def registered_queries(self):
+        # (query key, SQL query, representative query parameters) for every query the manager can run
+        queries = [(key, template.sql, template.bind(**SAMPLE_PARAMETERS))
+                   for key, template in self.query_templates().items()]
+        queries.extend((BULK_QUERY_PREFIX + key, template.sql, {})
+                       for key, template in self.query_templates(bulk=True).items())
+        if self.snapshot_path is not None:
+            # Snapshot module (and numpy) imported only when a snapshot is configured
+            from gbq_content_manager.snapshot import SNAPSHOT_SQL
+            queries.append((SNAPSHOT_QUERY_KEY, SNAPSHOT_SQL, {}))
+        if self.aggregate_table is not None:
+            queries.append((AGGREGATE_QUERY_KEY, aggregate_sql(self.aggregate_table), {}))
+        return queries
+
+    def query_templates(self, bulk=False) -> dict:
+        # Registered queries reading the aggregate table when built and current, the source table otherwise
+        if self.aggregate_ready:
+            return self.aggregate_bulk_sql_queries if bulk else self.aggregate_sql_queries
+        return self.bulk_sql_queries if bulk else self.sql_queries
+
+    def refresh_aggregate(self):
+        # Rebuilds the aggregate table when the source table was modified after it was built
+        # Other workers see the rebuilt table through its modification time and do not rebuild it
+        # Returns True if the aggregate is ready
+        if self.bq is None or not self.bq.initialized():
+            return False
+        source_modified = self.bq.table_modified(SOURCE_TABLE)
+        # Both tables built by the same script: the older one dates the aggregate, missing if either is
+        modified = [self.bq.table_modified(self.aggregate_table),
+                    self.bq.table_modified(country_table_id(self.aggregate_table))]
+        aggregate_modified = None if None in modified else min(modified)
+        if aggregate_modified is not None and (source_modified is None or aggregate_modified >= source_modified):
+            self.aggregate_ready = True
+            self.aggregate_built_at = aggregate_modified
+            return True
+        # Outdated aggregate: queries read the source table until it is rebuilt
+        self.aggregate_ready = False
+        if self.bq_run(sql_query=aggregate_sql(self.aggregate_table), key=AGGREGATE_QUERY_KEY,
+                       priority=PRIORITY_LOW) is not None:
+            self.aggregate_ready = True
+            self.aggregate_built_at = time.time()
+            logging.log(level=logging.INFO, msg="Aggregate table {} built".format(self.aggregate_table))
+            # Queries validated against the source table: estimates and bytes billed limits of the aggregate ones
+            if self.query_costs.estimates:
+                self.validate_queries()
+        return self.aggregate_ready
+
+    def start_aggregate_scheduler(self):
+        # Background thread checking source table changes every CONTENT_AGGREGATE_INTERVAL seconds
+        if self.aggregate_stop is not None:
+            return
+        self.aggregate_stop = threading.Event()
+        thread = threading.Thread(target=self.run_aggregate_scheduler, args=(self.aggregate_stop,),
+                                  name='content-aggregate', daemon=True)
+        thread.start()
+        self.scheduler_threads.append(thread)
+
+    def stop_aggregate_scheduler(self):
+        if self.aggregate_stop is not None:
+            self.aggregate_stop.set()
+            self.aggregate_stop = None
+
+    def run_aggregate_scheduler(self, stop):
+        while not stop.is_set():
+            try:
+                self.refresh_aggregate()
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                    e.__class__, e, self.run_aggregate_scheduler.__name__))
+            stop.wait(self.aggregate_interval)
+
+    def content_source_table(self, key):
+        return self.source_tables.get(key, SOURCE_TABLE)
+
+    def source_version(self, key):
+        # Current version of the source table of a registry key, None if unknown or not checked
+        if not self.sources.interval:
+            return None
+        return self.sources.version(self.content_source_table(key))
+
+    def content_source_current(self, local_content):
+        # True if content was loaded from the current version of its source table
+        # None if the version is unknown: content freshness falls back to the date rollover
+        version = self.source_version(local_content.key)
+        if version is None:
+            return None
+        if local_content.source_version is not None:
+            return local_content.source_version >= version
+        # Loaded before the source version was known: current if loaded after the last change
+        return local_content.loaded_at is not None and local_content.loaded_at >= version
+
+    def check_sources(self):
+        # One table metadata call per source table, shared by all contents reading it
+        # Returns the tables changed since the last check
+        if self.bq is None or not self.bq.initialized():
+            return []
+        table_ids = sorted(set(self.content_source_table(key) for key in self.sql_queries))
+        changed = self.sources.check(self.bq, table_ids)
+        for table_id in changed:
+            logging.log(level=logging.INFO, msg="Source table {} changed".format(table_id))
+            self.metrics.source_changes.inc(table_id)
+        if SOURCE_TABLE in changed and self.aggregate_table is not None:
+            # Aggregate built from the previous version: queries read the source table until it is rebuilt
+            self.aggregate_ready = False
+        return changed
+
+    def start_source_scheduler(self):
+        # Background thread checking source table versions every CONTENT_SOURCE_CHECK_INTERVAL seconds
+        if self.source_stop is not None:
+            return
+        self.source_stop = threading.Event()
+        thread = threading.Thread(target=self.run_source_scheduler, args=(self.source_stop,),
+                                  name='content-sources', daemon=True)
+        thread.start()
+        self.scheduler_threads.append(thread)
+
+    def stop_source_scheduler(self):
+        if self.source_stop is not None:
+            self.source_stop.set()
+            self.source_stop = None
+
+    def run_source_scheduler(self, stop):
+        while not stop.is_set():
+            try:
+                # Contents of changed tables go stale: refreshed on next request, or by the hot contents scheduler
+                if self.check_sources():
+                    if self.aggregate_table is not None:
+                        self.refresh_aggregate()
+                    if self.prefetch:
+                        self.prefetch_contents()
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                    e.__class__, e, self.run_source_scheduler.__name__))
+            stop.wait(self.sources.interval)
+
+    def validate_queries(self, keys=None):
+        # Dry-runs registered queries, records their estimated bytes processed and status
+        # Run at startup with BQ_VALIDATE_QUERIES, or on demand. Returns status per query key
+        results = {}
+        if self.bq is None or not self.bq.initialized():
+            return results
+        for key, sql_query, query_parameters in self.registered_queries():
+            if keys is not None and key not in keys:
+                continue
+            try:
+                bytes_processed = self.bq.dry_run(sql_query, query_parameters)
+                results[key] = self.query_costs.record(key, bytes_processed=bytes_processed)
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Query {} dry run exception {}:{} Method: {}".format(
+                    key, e.__class__, e, self.validate_queries.__name__))
+                results[key] = self.query_costs.record(key, error=e)
+        return results
+
+    def query_cost_metrics(self):
+        return {(key, estimate['status']): estimate['bytes_processed'] or 0
+                for key, estimate in self.query_costs.results().items()}
+
+    def snapshot_is_current(self) -> bool:
+        return self.snapshot is not None and self.snapshot.built_on == datetime.date.today()
+
+    def current_snapshot(self):
+        # Local snapshot, rebuilt once a day by a single caller
+        if self.snapshot_path is None:
+            return None
+        if not self.snapshot_is_current():
+            self.single_flight.run('snapshot@' + self.snapshot_path, self.refresh_snapshot)
+        return self.snapshot
+
+    def refresh_snapshot(self):
+        # CSV file: static snapshot, loaded as is
+        # Directory: loaded if built today (by this or another worker), else pulled from BigQuery and saved
+        if self.snapshot_is_current():
+            return self.snapshot
+        path = self.snapshot_path
+        try:
+            from gbq_content_manager.snapshot import ContentSnapshot, SNAPSHOT_SQL
+            if os.path.isfile(path):
+                self.snapshot = ContentSnapshot.load(path)
+                self.snapshot.built_on = datetime.date.today()
+                return self.snapshot
+            if os.path.isdir(path):
+                snapshot = ContentSnapshot.load(path)
+                if snapshot.built_on == datetime.date.today():
+                    self.snapshot = snapshot
+                    return self.snapshot
+            rows = self.bq_run(sql_query=SNAPSHOT_SQL, key=SNAPSHOT_QUERY_KEY, priority=PRIORITY_LOW)
+            if rows is not None:
+                ContentSnapshot.from_rows(rows).save(path)
+                self.snapshot = ContentSnapshot.load(path)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.refresh_snapshot.__name__))
+        return self.snapshot
+
+    def compute_content(self, snapshot, request):
+        try:
+            return snapshot.compute(request.key, **request.query_parameters)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.compute_content.__name__))
+            return None
+
+    def run_content(self, request):
+        # Content data from the local snapshot when configured, else from BigQuery
+        snapshot = self.current_snapshot()
+        if snapshot is not None and snapshot.supports(request.key):
+            return self.count_refresh(request, 'snapshot', self.compute_content(snapshot, request))
+        return self.count_refresh(request, 'bigquery', self.bq_run(sql_query=request.sql_query,
+                                                                   query_parameters=request.query_parameters,
+                                                                   key=request.key))
+
+    async def run_content_async(self, request):
+        if self.snapshot_path is not None:
+            snapshot = self.snapshot if self.snapshot_is_current() else await asyncio.to_thread(self.current_snapshot)
+            if snapshot is not None and snapshot.supports(request.key):
+                return self.count_refresh(request, 'snapshot', self.compute_content(snapshot, request))
+        data = await self.bq_run_async(sql_query=request.sql_query, query_parameters=request.query_parameters,
+                                       key=request.key)
+        return self.count_refresh(request, 'bigquery', data)
+
+    def count_refresh(self, request, source, data):
+        self.metrics.content_refreshes.inc(request.key, source, 'ok' if data is not None else 'error')
+        return data
+
+    async def wait_job(self, query_job):
+        # Poll job state with exponential backoff until done or BQ_JOB_TIMEOUT seconds have passed
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.job_timeout
+        delay = self.poll_initial_delay
+        while not await asyncio.to_thread(query_job.done):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError("BigQuery job {} not done after {}s".format(query_job.job_id, self.job_timeout))
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * self.poll_multiplier, self.poll_max_delay)
+
+    def cancel_job_sync(self, query_job):
+        # Best effort: do not keep paying for a job nobody is waiting for
+        try:
+            query_job.cancel()
+        except Exception as e:
+            logging.log(level=logging.WARNING, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                       self.cancel_job_sync.__name__))
+
+    async def cancel_job(self, query_job):
+        await asyncio.to_thread(self.cancel_job_sync, query_job)
+
+    def cancel_job_later(self, query_job):
+        # Cancels the job in a worker thread without waiting for it, for cancelled callers
+        threading.Thread(target=self.cancel_job_sync, args=(query_job,), name='bigquery-job-cancel', daemon=True).start()
+
+    def cancel_started_job(self, query_start):
+        # Done callback of a job start whose caller was cancelled meanwhile
+        if not query_start.cancelled() and query_start.exception() is None:
+            self.cancel_job_later(query_start.result())
+
+    def build_content_request(self, key, **kwargs):
+        # Content request for a registered content and its parameters
+        # Parameters are validated and made canonical, so equivalent requests share one content key
+        title = self.titles.get(key)
+        template = self.query_templates().get(key)
+        if template is None:
+            return ContentRequest(key, key, title, None, {})
+        query_parameters = template.bind(**kwargs)
+        content_key = QueryTemplate.content_key(key, query_parameters)
+        return ContentRequest(content_key, key, title, template.sql, query_parameters)
+
+    def stored_content_request(self, content_key, local_content):
+        # Content request to refresh a content already in memory, with the current query of its key
+        template = self.query_templates().get(local_content.key)
+        sql_query = template.sql if template is not None else local_content.sql_query
+        return ContentRequest(content_key, local_content.key, local_content.title, sql_query,
+                              local_content.query_parameters or {})
+
+    def content_ttls(self, key):
+        # Soft and hard TTL for a content, registry values override app defaults
+        soft_ttl, hard_ttl = self.ttls.get(key) or (None, None)
+        return soft_ttl or self.soft_ttl, hard_ttl or self.hard_ttl
+
+    def content_expires_at(self, local_content):
+        # Timestamp when content goes stale
+        soft_ttl, hard_ttl = self.content_ttls(local_content.key)
+        if soft_ttl:
+            return local_content.loaded_at + soft_ttl
+        current = self.content_source_current(local_content)
+        if current is not None:
+            # Change driven freshness: current contents are fresh until the next source table check,
+            # outdated ones since the check that saw the change
+            table_id = self.content_source_table(local_content.key)
+            if current:
+                return self.sources.next_check_at(table_id)
+            return self.sources.checked_at.get(table_id, time.time())
+        # Daily freshness: stale from midnight after last run
+        next_day = datetime.datetime.combine(local_content.last_run + datetime.timedelta(days=1), datetime.time())
+        return next_day.timestamp()
+
+    def content_max_age(self, local_content) -> int:
+        # Seconds clients and caches can reuse the content, until it goes stale
+        if local_content.loaded_at is None:
+            return 0
+        return max(0, int(self.content_expires_at(local_content) - time.time()))
+
+    def content_state(self, local_content):
+        if not isinstance(local_content, BigQueryContent):
+            return CONTENT_MISSING
+        now = time.time()
+        if local_content.rows is not None and now < self.content_expires_at(local_content):
+            return CONTENT_FRESH
+        if local_content.retry_at is not None and now < local_content.retry_at:
+            return CONTENT_FAILED
+        if local_content.rows is None:
+            return CONTENT_MISSING
+        soft_ttl, hard_ttl = self.content_ttls(local_content.key)
+        if self.swr and not (hard_ttl and now - local_content.loaded_at >= hard_ttl):
+            return CONTENT_STALE
+        return CONTENT_EXPIRED
+
+    def content_is_fresh(self, local_content) -> bool:
+        return self.content_state(local_content) == CONTENT_FRESH
+
+    def content_failed(self, local_content):
+        # Negative caching: a content whose load failed is not loaded again before retry_at
+        # Backoff doubled on each consecutive failure, with jitter so contents do not retry all at once,
+        # and at least until the backend circuit breaker lets a job run again
+        local_content.failures += 1
+        backoff = min(self.retry_max_backoff, self.retry_backoff * 2 ** (local_content.failures - 1))
+        backoff = max(backoff * random.uniform(0.8, 1.2), self.bq.get_breaker().retry_after())
+        local_content.retry_at = time.time() + backoff
+        return local_content
+
+    @staticmethod
+    def content_retry_after(local_content) -> int:
+        # Seconds before a failed content is loaded again
+        if local_content is None or local_content.retry_at is None:
+            return 0
+        return max(0, int(local_content.retry_at - time.time() + 0.999))
+
+    def failing_contents(self) -> dict:
+        # Contents in backoff after failed loads, by content key
+        now = time.time()
+        return {content_key: local_content for content_key, local_content in self.contents.items()
+                if local_content.retry_at is not None and now < local_content.retry_at}
+
+    def store_content(self, request, data, last_run=None, loaded_at=None, source_version=None):
+        # last_run, loaded_at: when data was loaded, defaults to now
+        # source_version: version of the source table when the query was run, defaults to the current one
+        content_key = request.content_key
+        last_run = last_run or datetime.date.today()
+        loaded_at = loaded_at or time.time()
+        if source_version is None:
+            source_version = self.source_version(request.key)
+        local_content = self.contents.peek(content_key)
+        # Compact rows kept as read with the BigQuery Storage Read API when CONTENT_COMPACT_ROWS is set,
+        # expanded once here otherwise: reads return dict rows as stored
+        data = compact_rows(data) if self.compact_rows else expand_rows(data)
         if local_content is None:
             # Create object in local runner memory
-            local_content = BigQueryContent(sql_query=sql_query, title=title)
-            # Effectively run BiqQuery call with SQL query
-            local_content.data = self.bq_run(sql_query=sql_query)
-            local_content.last_run = datetime.date.today()
+            local_content = BigQueryContent(key=request.key, sql_query=request.sql_query,
+                                            query_parameters=request.query_parameters, title=request.title)
+            local_content.data = data
+            local_content.last_run = last_run
+            local_content.loaded_at = loaded_at
+            local_content.source_version = source_version
+            local_content.etag()
             # Register local_content  in content_manager
-            content_manager.contents.update({content_key: local_content})
+            self.contents.update({content_key: local_content})
+        elif data is not None:
+            # bq_run could return None in case of BQ error, keep previous data then
+            local_content.data = data
+            local_content.last_run = last_run
+            local_content.loaded_at = loaded_at
+            local_content.source_version = source_version
+            local_content.hits = 0
+            local_content.failures = 0
+            local_content.retry_at = None
+            # Entity tag computed once when data is loaded
+            local_content.etag()
+            # Store again so the cache accounts for the new data size
+            self.contents.update({content_key: local_content})
+        return local_content
+
+    def load_shared_content(self, content_key, local_content=None):
+        # Returns a fresh entry from the shared cache tier, newer than the local content, or None
+        if self.shared_contents is None:
+            return None
+        try:
+            entry = self.shared_contents.get(content_key)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.load_shared_content.__name__))
+            return None
+        if entry is None or entry['data'] is None:
+            return None
+        if local_content is not None and local_content.loaded_at is not None \
+                and entry['loaded_at'] <= local_content.loaded_at:
+            return None
+        # Shared entries follow the same freshness rules as local contents
+        shared_content = BigQueryContent(key=content_key.split('@')[0])
+        # Read for its freshness only: rows not compacted
+        shared_content.rows = entry['data']
+        shared_content.last_run = entry['last_run']
+        shared_content.loaded_at = entry['loaded_at']
+        shared_content.source_version = entry['source_version']
+        if not self.content_is_fresh(shared_content):
+            return None
+        return entry
+
+    def share_content(self, content_key, local_content):
+        # Publish content to the shared cache tier until it goes stale
+        if self.shared_contents is None or local_content.rows is None:
+            return
+        expires_at = self.content_expires_at(local_content)
+        if self.content_source_current(local_content):
+            expires_at = max(expires_at, local_content.loaded_at + SOURCE_CONTENT_SHARED_TTL)
+        try:
+            self.shared_contents.set(content_key, local_content.data, local_content.last_run,
+                                     local_content.loaded_at, expires_at, local_content.source_version)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.share_content.__name__))
+
+    def refresh_content(self, request, force=False):
+        # Another caller may have refreshed the content while this one was waiting to lead
+        local_content = self.contents.peek(request.content_key)
+        if force or not self.content_is_fresh(local_content):
+            # Another worker may have loaded the content already
+            entry = self.load_shared_content(request.content_key, local_content)
+            if entry is not None:
+                self.count_refresh(request, 'shared', entry['data'])
+                local_content = self.store_content(request, entry['data'], last_run=entry['last_run'],
+                                                   loaded_at=entry['loaded_at'], source_version=entry['source_version'])
+            else:
+                # Effectively run BiqQuery call with SQL query, or compute content from local snapshot
+                source_version = self.source_version(request.key)
+                data = self.run_content(request)
+                local_content = self.store_content(request, data, source_version=source_version)
+                if data is not None:
+                    self.share_content(request.content_key, local_content)
+                else:
+                    # Previous data, if any, kept and served until the retry time
+                    self.content_failed(local_content)
+        return local_content
+
+    async def refresh_content_async(self, request):
+        local_content = self.contents.peek(request.content_key)
+        if not self.content_is_fresh(local_content):
+            entry = None
+            if self.shared_contents is not None:
+                entry = await asyncio.to_thread(self.load_shared_content, request.content_key, local_content)
+            if entry is not None:
+                self.count_refresh(request, 'shared', entry['data'])
+                local_content = self.store_content(request, entry['data'], last_run=entry['last_run'],
+                                                   loaded_at=entry['loaded_at'], source_version=entry['source_version'])
+            else:
+                source_version = self.source_version(request.key)
+                data = await self.run_content_async(request)
+                local_content = self.store_content(request, data, source_version=source_version)
+                if data is None:
+                    self.content_failed(local_content)
+                elif self.shared_contents is not None:
+                    await asyncio.to_thread(self.share_content, request.content_key, local_content)
+        return local_content
+
+    def admitted_refresh(self, request):
+        # Cache miss load within the miss admission budget, AdmissionRejected if shed
+        with self.admission.admit():
+            return self.refresh_content(request)
+
+    async def admitted_refresh_async(self, request):
+        async with self.admission.admit_async():
+            return await self.refresh_content_async(request)
+
+    def schedule_refresh(self, request, force=False):
+        # Refresh content in a background thread, unless a refresh is already in flight
+        if self.single_flight.is_in_flight(request.content_key):
+            return None
+        if self.refresh_executor is None:
+            self.refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='content-refresh')
+        return self.refresh_executor.submit(self.single_flight.run, request.content_key, self.refresh_content,
+                                            request, force)
+
+    def load_content(self, key, *args, **kwargs):
+        return self.get_content(key, **kwargs).data
+
+    async def load_content_async(self, key, *args, **kwargs):
+        content = await self.get_content_async(key, **kwargs)
+        return content.data
+
+    def get_content(self, key, **kwargs):
+        # BigQueryContent for a content and its parameters, loaded if needed
+        # Failed contents are served as is until their retry time: data None if never loaded
+        # Misses are loaded within the miss admission budget: AdmissionRejected when shed
+        request = self.build_content_request(key, **kwargs)
+
+        # See if a fresh BigQueryContent exists in local content_manager
+        local_content = self.contents.get(request.content_key)
+        state = self.content_state(local_content)
+        self.count_request(request, state)
+        if state == CONTENT_STALE:
+            # Serve stale data now, refresh in background
+            self.schedule_refresh(request)
+        elif state != CONTENT_FRESH and state != CONTENT_FAILED:
+            # Concurrent callers for the same content key wait on a single refresh
+            with span('content.load', self.tracing, key=request.key, content_key=request.content_key, state=state):
+                local_content = self.single_flight.run(request.content_key, self.admitted_refresh, request)
+        local_content.hits += 1
+        return local_content
+
+    async def get_content_async(self, key, **kwargs):
+        # Cache hits are served straight from the event loop
+        # Cache misses wait for BigQuery without blocking other requests
+        request = self.build_content_request(key, **kwargs)
+
+        local_content = self.contents.get(request.content_key)
+        state = self.content_state(local_content)
+        self.count_request(request, state)
+        if state == CONTENT_STALE:
+            self.schedule_refresh(request)
+        elif state != CONTENT_FRESH and state != CONTENT_FAILED:
+            with span('content.load', self.tracing, key=request.key, content_key=request.content_key, state=state):
+                local_content = await self.single_flight.run_async(request.content_key,
+                                                                   self.admitted_refresh_async, request)
+        local_content.hits += 1
+        return local_content
+
+    async def stream_content_async(self, key, page_size=None, **kwargs):
+        # Async generator of content data rows, page by page
+        # Contents in memory, being loaded or computed from the local snapshot are served from memory in pages
+        # Missing contents are streamed from the query job, the first page sent before the last one is read.
+        # Streamed rows are cached when the job completes, unless more than CONTENT_STREAM_MAX_CACHED_ROWS
+        # ContentUnavailable raised, before any page, for contents failed and without previous data
+        page_size = page_size or self.stream_page_size
+        request = self.build_content_request(key, **kwargs)
+        local_content = self.contents.get(request.content_key)
+        state = self.content_state(local_content)
+        if state in (CONTENT_FRESH, CONTENT_STALE, CONTENT_FAILED) or self.snapshot_path is not None \
+                or self.single_flight.is_in_flight(request.content_key):
+            local_content = await self.get_content_async(key, **kwargs)
+            rows = local_content.rows
+            if rows is None:
+                raise ContentUnavailable("Content {} not available".format(request.content_key),
+                                         retry_after=self.content_retry_after(local_content))
+            # Dict rows rebuilt page by page
+            for start in range(0, len(rows), page_size):
+                yield rows[start:start + page_size]
+            return
+        self.count_request(request, state)
+        source_version = self.source_version(request.key)
+        rows = []
+        # Miss admission slot held until the query job is done, not while pages are read by the client
+        admitted = False
+        if self.admission.max_concurrent:
+            await self.admission.acquire_async()
+            admitted = True
+        try:
+            async for page in self.bq_stream_async(request.sql_query, request.query_parameters, key=request.key,
+                                                   page_size=page_size):
+                if admitted:
+                    self.admission.release()
+                    admitted = False
+                if rows is not None:
+                    rows.extend(page)
+                    if len(rows) > self.stream_max_cached_rows:
+                        rows = None
+                yield page
+        except Exception:
+            self.count_refresh(request, 'bigquery', None)
+            self.content_failed(self.store_content(request, None))
+            raise
+        finally:
+            if admitted:
+                self.admission.release()
+        self.count_refresh(request, 'bigquery', rows if rows is not None else [])
+        if rows is not None:
+            local_content = self.store_content(request, rows, source_version=source_version)
+            if self.shared_contents is not None:
+                await asyncio.to_thread(self.share_content, request.content_key, local_content)
+
+    @staticmethod
+    def content_page(local_content, limit, page_token=None):
+        # Page of content data rows and next page token (None on last page), see pagination module
+        local_content.etag()
+        return data_page(local_content.rows, local_content.data_etag, limit, page_token)
+
+    def count_request(self, request, state):
+        if state == CONTENT_FRESH:
+            result = 'hit'
+        elif state == CONTENT_STALE:
+            result = 'stale'
+        elif state == CONTENT_FAILED:
+            result = 'failed'
         else:
-            # Already in local runner memory
-            # Here check freshness and see whether it needs re-running
-            if isinstance(local_content, BigQueryContent):
-                if local_content.last_run != datetime.date.today() or local_content.data is None:
-                    # bq_run could return None in case of BQ error
-                    new_data = self.bq_run(sql_query=sql_query)
-                    if new_data is not None:
-                        local_content.data = new_data
-                        local_content.last_run = datetime.date.today()
-        payload = local_content.data
-        return payload
+            result = 'miss'
+        self.metrics.content_requests.inc(request.key, result)
+
+    def start_refresh_scheduler(self):
+        # Background thread pre-refreshing hot contents shortly before they go stale
+        if self.prefresh_stop is not None:
+            return
+        self.prefresh_stop = threading.Event()
+        thread = threading.Thread(target=self.run_refresh_scheduler, args=(self.prefresh_stop,),
+                                  name='content-prefresh', daemon=True)
+        thread.start()
+        self.scheduler_threads.append(thread)
+
+    def stop_refresh_scheduler(self):
+        if self.prefresh_stop is not None:
+            self.prefresh_stop.set()
+            self.prefresh_stop = None
+
+    def run_refresh_scheduler(self, stop):
+        while not stop.wait(self.prefresh_interval):
+            try:
+                self.prefresh_hot_contents()
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                    e.__class__, e, self.run_refresh_scheduler.__name__))
+
+    def prefresh_hot_contents(self):
+        # Refresh contents with at least CONTENT_PREFRESH_MIN_HITS hits since last load
+        # that are stale or go stale within the next CONTENT_PREFRESH_LEAD seconds
+        # Contents with daily freshness can only be refreshed once the date has rolled over
+        now = time.time()
+        scheduled = []
+        for content_key, local_content in self.contents.items():
+            if local_content.rows is None or local_content.hits < self.prefresh_min_hits:
+                continue
+            if local_content.retry_at is not None and now < local_content.retry_at:
+                # Last load failed: retried on request after its backoff
+                continue
+            soft_ttl, hard_ttl = self.content_ttls(local_content.key)
+            refresh_before = now + self.prefresh_lead if soft_ttl else now
+            if self.content_expires_at(local_content) <= refresh_before:
+                if self.schedule_refresh(self.stored_content_request(content_key, local_content), force=True):
+                    scheduled.append(content_key)
+        return scheduled
+
+    def prefetch_contents(self, keys=None):
+        # Loads per-country contents for all countries with one grouped query per content type
+        # Bulk query rows carry the country in column bulk_country, removed before storing the rows
+        # Returns number of countries loaded per content key
+        bulk_sql_queries = self.query_templates(bulk=True)
+        keys = keys or list(bulk_sql_queries)
+        results = {}
+        countries = {}
+        source_versions = {key: self.source_version(key) for key in keys}
+        # Bulk queries run in parallel, within the job concurrency limit, after jobs for requests
+        jobs = {key: self.bq_submit(sql_query=bulk_sql_queries[key].sql, key=BULK_QUERY_PREFIX + key,
+                                    priority=PRIORITY_LOW)
+                for key in keys if key in bulk_sql_queries}
+        for key, job in jobs.items():
+            data = job.result()
+            if data is None:
+                continue
+            by_country = self.split_bulk_rows(data)
+            countries.update(dict.fromkeys(by_country))
+            results[key] = by_country
+        loaded = {}
+        last_run = datetime.date.today()
+        loaded_at = time.time()
+        for key, by_country in results.items():
+            # Countries without rows for a content get an empty result, as their per-country query would
+            for country in countries:
+                request = self.build_content_request(key, country=country)
+                local_content = self.store_content(request, by_country.get(country, []), last_run=last_run,
+                                                   loaded_at=loaded_at, source_version=source_versions[key])
+                self.share_content(request.content_key, local_content)
+            loaded[key] = len(countries)
+        return loaded
+
+    @staticmethod
+    def split_bulk_rows(data) -> dict:
+        # Bulk query rows by country, without their bulk_country column
+        by_country = {}
+        for row in data:
+            country = row.pop('bulk_country')
+            if country is not None:
+                by_country.setdefault(country, []).append(row)
+        return by_country
+
+    def store_bulk_rows(self, key, data, source_version=None):
+        # Stores the per-country contents of a bulk query result, returns number of countries stored
+        by_country = self.split_bulk_rows(data)
+        last_run = datetime.date.today()
+        loaded_at = time.time()
+        for country, rows in by_country.items():
+            request = self.build_content_request(key, country=country)
+            local_content = self.store_content(request, rows, last_run=last_run, loaded_at=loaded_at,
+                                               source_version=source_version)
+            self.share_content(request.content_key, local_content)
+        return len(by_country)
+
+    async def refresh_bulk_async(self, key):
+        # One bulk query job for all countries of a per-country content
+        template = self.query_templates(bulk=True).get(key)
+        source_version = self.source_version(key)
+        data = await self.bq_run_async(sql_query=template.sql, key=BULK_QUERY_PREFIX + key)
+        if data is None:
+            return 0
+        self.metrics.content_refreshes.inc(key, 'bigquery', 'ok')
+        # Encoding and sharing hundreds of contents, keep it off the event loop
+        return await asyncio.to_thread(self.store_bulk_rows, key, data, source_version)
+
+    async def admitted_refresh_bulk_async(self, key):
+        async with self.admission.admit_async():
+            return await self.refresh_bulk_async(key)
+
+    async def get_contents_async(self, items):
+        # Batch of contents: items is a list of (key, parameters dictionary)
+        # Returns, in items order, (content key, BigQueryContent) for each item, (None, ValueError) for invalid items,
+        # (content key, AdmissionRejected) for misses shed by the miss admission
+        # Cached contents are served directly. Missing contents are loaded concurrently:
+        # several countries of a per-country content share one bulk query job, any other content
+        # is loaded on its own (coalesced with concurrent loads of the same content key)
+        results = [None] * len(items)
+        requests = {}
+        for index, (key, parameters) in enumerate(items):
+            try:
+                if key not in self.sql_queries:
+                    raise ValueError("Unknown content {!r}".format(key))
+                request = self.build_content_request(key, **(parameters or {}))
+            except (TypeError, ValueError) as e:
+                results[index] = (None, e if isinstance(e, ValueError) else ValueError(str(e)))
+                continue
+            requests.setdefault(request.content_key, (request, []))[1].append(index)
+
+        misses = {}
+        for content_key, (request, indexes) in requests.items():
+            local_content = self.contents.get(content_key)
+            state = self.content_state(local_content)
+            if state in (CONTENT_FRESH, CONTENT_STALE, CONTENT_FAILED):
+                self.count_request(request, state)
+                if state == CONTENT_STALE:
+                    self.schedule_refresh(request)
+                local_content.hits += 1
+                for index in indexes:
+                    results[index] = (content_key, local_content)
+            else:
+                misses.setdefault(request.key, []).append(request)
+
+        async def load(request):
+            try:
+                return request, await self.get_content_async(request.key, **request.query_parameters)
+            except AdmissionRejected as e:
+                return request, e
+
+        async def load_bulk(key, key_requests):
+            try:
+                await self.single_flight.run_async(BULK_QUERY_PREFIX + key, self.admitted_refresh_bulk_async, key)
+            except AdmissionRejected:
+                # Contents loaded one by one, each within the admission budget
+                pass
+            loaded = []
+            for request in key_requests:
+                local_content = self.contents.get(request.content_key)
+                if self.content_is_fresh(local_content):
+                    self.count_request(request, CONTENT_MISSING)
+                    local_content.hits += 1
+                    loaded.append((request, local_content))
+                else:
+                    # Not in the bulk query results, or the bulk query failed
+                    loaded.append(await load(request))
+            return loaded
+
+        bulk_keys = self.query_templates(bulk=True)
+        loads = []
+        for key, key_requests in misses.items():
+            if len(key_requests) > 1 and key in bulk_keys and self.snapshot_path is None:
+                loads.append(load_bulk(key, key_requests))
+            else:
+                loads.extend(load(request) for request in key_requests)
+        for loaded in await asyncio.gather(*loads):
+            for request, local_content in (loaded if isinstance(loaded, list) else [loaded]):
+                for index in requests[request.content_key][1]:
+                    results[index] = (request.content_key, local_content)
+        return results
+
+    def start_prefetch_scheduler(self):
+        # Background thread running prefetch_contents at startup and after every date rollover
+        # With source table checks, prefetch_contents runs again when the source table changes instead
+        if self.prefetch_stop is not None:
+            return
+        self.prefetch_stop = threading.Event()
+        thread = threading.Thread(target=self.run_prefetch_scheduler, args=(self.prefetch_stop,),
+                                  name='content-prefetch', daemon=True)
+        thread.start()
+        self.scheduler_threads.append(thread)
+
+    def stop_prefetch_scheduler(self):
+        if self.prefetch_stop is not None:
+            self.prefetch_stop.set()
+            self.prefetch_stop = None
+
+    def run_prefetch_scheduler(self, stop):
+        while not stop.is_set():
+            try:
+                loaded = self.prefetch_contents()
+                logging.log(level=logging.INFO, msg="Prefetched contents {}".format(loaded))
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(
+                    e.__class__, e, self.run_prefetch_scheduler.__name__))
+            if self.sources.interval:
+                # Change driven freshness: next prefetch when the source table changes, see run_source_scheduler
+                return
+            # Next run just after midnight
+            tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+            stop.wait(max(tomorrow.timestamp() - time.time(), 0) + 1)
+
+    def stop_schedulers(self, timeout=None):
+        # Stops every background scheduler, waiting for runs in progress to finish
+        self.stop_refresh_scheduler()
+        self.stop_prefetch_scheduler()
+        self.stop_aggregate_scheduler()
+        self.stop_source_scheduler()
+        for thread in self.scheduler_threads:
+            thread.join(timeout)
+        self.scheduler_threads = []
+        if self.refresh_executor is not None:
+            self.refresh_executor.shutdown(wait=True)
+            self.refresh_executor = None
+
+    def preload(self):
+        # Pre-fork parent: loads every registered content once, before workers are forked
+        # Contents without parameters one by one, per-country contents of all countries with bulk queries
+        # Returns number of contents loaded
+        self.stop_schedulers()
+        for key, template in self.query_templates().items():
+            if not template.parameters:
+                self.get_content(key)
+        self.prefetch_contents()
+        return sum(1 for _, local_content in self.contents.items() if local_content.rows is not None)
+
+    def refresh_stale_contents(self, check_sources=True):
+        # Pre-fork parent: loads again the contents gone stale, for its workers. Returns content keys loaded
+        # Per-country contents of a changed source table are loaded again with bulk queries
+        loaded_at = {content_key: local_content.loaded_at for content_key, local_content in self.contents.items()}
+        if check_sources and self.sources.interval and self.check_sources():
+            if self.aggregate_table is not None:
+                self.refresh_aggregate()
+            self.prefetch_contents()
+        now = time.time()
+        for content_key, local_content in self.contents.items():
+            if self.content_is_fresh(local_content) or (local_content.retry_at is not None
+                                                        and now < local_content.retry_at):
+                continue
+            self.refresh_content(self.stored_content_request(content_key, local_content), force=True)
+        return [content_key for content_key, local_content in self.contents.items()
+                if local_content.loaded_at != loaded_at.get(content_key)]
+
+    def publish_generation(self, generations):
+        # Pre-fork parent: publishes every loaded content to the workers, returns the generation number
+        entries = [(content_key, local_content.loaded_at,
+                    (local_content.key, local_content.title, local_content.sql_query, local_content.query_parameters,
+                     local_content.rows, local_content.last_run, local_content.source_version))
+                   for content_key, local_content in self.contents.items() if local_content.rows is not None]
+        return generations.publish(entries, sources=self.sources.export())
+
+    def load_generation(self, payload):
+        # Pre-fork worker: stores the contents of a generation newer than the ones in memory
+        # Source table versions merged last: contents of a changed table are replaced before they go stale
+        # Returns number of contents stored
+        stored = 0
+        for content_key, loaded_at, entry in payload['contents']:
+            local_content = self.contents.peek(content_key)
+            if local_content is not None and local_content.loaded_at is not None \
+                    and local_content.loaded_at >= loaded_at:
+                continue
+            key, title, sql_query, query_parameters, rows, last_run, source_version = \
+                self.generations.entry_fields(entry)
+            self.store_content(ContentRequest(content_key, key, title, sql_query, query_parameters), rows,
+                               last_run=last_run, loaded_at=loaded_at, source_version=source_version)
+            stored += 1
+        self.sources.merge(payload['sources'])
+        return stored
+
+    def after_fork(self, generations):
+        # Pre-fork worker: threads of the parent are not running in the worker, and their locks may be held
+        # Schedulers are not started again: the parent loads contents and publishes them, see generations module
+        self.prefresh_stop = None
+        self.prefetch_stop = None
+        self.aggregate_stop = None
+        self.source_stop = None
+        self.scheduler_threads = []
+        self.refresh_executor = None
+        self.single_flight = SingleFlight()
+        self.admission = MissAdmission(max_concurrent=self.admission.max_concurrent,
+                                       max_queue=self.admission.max_queue, deadline=self.admission.deadline)
+        # Locks of shared state, held by the parent refresh thread if the worker was forked during a refresh
+        self.contents.after_fork()
+        self.metrics.after_fork()
+        self.sources.after_fork()
+        self.query_costs.after_fork()
+        columnar_after_fork()
+        if self.bq is not None:
+            self.bq.after_fork()
+        generations.after_fork()
+        self.generations = generations
+        generations.start_watcher(self.load_generation)
+
+    async def warm_up(self):
+        # Startup background task: builds the BigQuery client of lazy backends, then loads CONTENT_WARM_KEYS contents
+        # Requests are served meanwhile, readiness goes from starting to warming to ready
+        self.readiness = READINESS_WARMING
+        try:
+            await asyncio.to_thread(self.bq.connect)
+            await asyncio.gather(*[self.get_content_async(key) for key in self.warm_keys if key in self.sql_queries],
+                                 return_exceptions=True)
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.warm_up.__name__))
+        finally:
+            # Ready even if BigQuery failed: contents are loaded on demand then, warm contents show what failed
+            self.readiness = READINESS_READY
+
+    def readiness_state(self):
+        warm_contents = {}
+        for key in self.warm_keys:
+            local_content = self.contents.peek(key)
+            warm_contents[key] = local_content is not None and local_content.rows is not None
+        return {'status': self.readiness, 'backend': self.bq is not None and self.bq.initialized(),
+                'warm_contents': warm_contents}
+
+    def stats(self):
+        # Content manager counters
+        return {'contents': len(self.contents), 'cache': self.contents.stats(),
+                'single_flight': self.single_flight.stats(), 'queries': self.query_costs.results(),
+                'aggregate': {'table': self.aggregate_table, 'ready': self.aggregate_ready,
+                              'built_at': self.aggregate_built_at},
+                'sources': self.sources.stats(),
+                'jobs': self.bq.get_executor().stats() if self.bq is not None else {},
+                'breaker': self.bq.get_breaker().stats() if self.bq is not None else {},
+                'failing_contents': len(self.failing_contents()),
+                'admission': self.admission.stats(),
+                'generations': self.generations.stats() if self.generations is not None else {}}
+
+    def backend_status(self):
+        # Circuit breaker state and contents in backoff after failed loads
+        return {'breaker': self.bq.get_breaker().stats() if self.bq is not None else {},
+                'failing_contents': [{'content_key': content_key, 'failures': local_content.failures,
+                                      'retry_at': local_content.retry_at,
+                                      'has_data': local_content.rows is not None}
+                                     for content_key, local_content in self.failing_contents().items()]}
+
+    def cache_metrics(self):
+        # Numeric cache and single flight counters, collected when metrics are rendered
+        values = {}
+        for prefix, stats in (('cache', self.contents.stats()), ('single_flight', self.single_flight.stats())):
+            for name, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[('{}_{}'.format(prefix, name),)] = value
+        return values
+
+    def executor_metrics(self):
+        # Jobs in flight and waiting for a slot, submitted job counters
+        if self.bq is None:
+            return {}
+        return {(name,): value for name, value in self.bq.get_executor().stats().items()}
+
+    def admission_metrics(self):
+        return {(name,): value for name, value in self.admission.stats().items()}
+
+    def breaker_metrics(self):
+        if self.bq is None:
+            return {}
+        stats = self.bq.get_breaker().stats()
+        return {('state',): BREAKER_STATE_VALUES[stats['state']],
+                ('consecutive_failures',): stats['consecutive_failures'], ('failures',): stats['failures'],
+                ('rejected',): stats['rejected'], ('trips',): stats['trips']}
 
     def load_titles(self):
         titles = {}
@@ -141,6 +1464,103 @@ class AppBQContentManager:
         titles.update({"get_country_list_summary": "Country list summary"})
         self.titles = titles
 
+    def load_ttls(self):
+        # Per content (soft TTL, hard TTL) in seconds
+        # None values use app defaults CONTENT_SOFT_TTL and CONTENT_HARD_TTL
+        # Empty by default: contents go stale when the source table changes, a soft TTL would override it
+        # Example: ttls.update({"get_countries": (3600, None)})
+        ttls = {}
+        self.ttls = ttls
+
+    def load_bulk_sql_queries(self):
+        # Grouped versions of per-country queries, all countries in one scan
+        # Same columns as the per-country query plus bulk_country to split rows by country
+        bulk_sql_queries = {}
+        bulk_sql_queries.update({"get_country_summary": """WITH available  AS
+            (
+            SELECT country_region as bulk_country, MAX(date) as latest_date_published
+            FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+            GROUP BY country_region
+            )
+        SELECT bulk_country, country_region, CAST(MAX(date) AS STRING) as latest, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead,  100*SAFE_DIVIDE(SUM(deaths),SUM(confirmed)) as drate
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` JOIN available
+        ON country_region=bulk_country AND date=latest_date_published
+        GROUP BY bulk_country, country_region"""})
+        bulk_sql_queries.update({"get_country_evolution": """
+               WITH
+               available  AS
+                       (
+                       SELECT country_region as bulk_country, MAX(date) as latest_date_published, date_sub(MAX(date),INTERVAL 1 MONTH) as month_before, date_sub(MAX(date),INTERVAL 2 MONTH) as month_2_before
+                       FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+                       GROUP BY country_region
+                       ),
+               daily_data AS
+                      (
+                       SELECT country_region as bulk_country, date, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
+                       FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+                       GROUP BY country_region, date
+                      ),
+               stats AS
+                     (
+                        SELECT available.bulk_country, latest_date_published, latest_data.total_confirmed, latest_data.total_dead,
+                        100*SAFE_DIVIDE(latest_data.total_dead, latest_data.total_confirmed) as drate,
+                        latest_data.total_confirmed-month_before_data.total_confirmed as inc_m_confirmed,
+                        latest_data.total_dead-month_before_data.total_dead as inc_m_dead,
+                        month_before_data.total_confirmed-month_2_before_data.total_confirmed as inc_m2_confirmed,
+                        month_before_data.total_dead-month_2_before_data.total_dead as inc_m2_dead
+                        FROM available
+                        JOIN daily_data latest_data
+                        ON latest_data.bulk_country=available.bulk_country AND latest_data.date=latest_date_published
+                        JOIN daily_data month_before_data
+                        ON month_before_data.bulk_country=available.bulk_country AND month_before_data.date=month_before
+                        JOIN daily_data month_2_before_data
+                        ON month_2_before_data.bulk_country=available.bulk_country AND month_2_before_data.date=month_2_before
+                     )
+
+               SELECT bulk_country, bulk_country as country_region, CAST (latest_date_published AS STRING) as latest_date, total_confirmed, total_dead, drate,  inc_m_confirmed, inc_m_dead,
+               SAFE_DIVIDE(inc_m_confirmed - inc_m2_confirmed, inc_m_confirmed+inc_m2_confirmed) as rate_inc_c_m2,
+               SAFE_DIVIDE(inc_m_dead - inc_m2_dead ,inc_m_dead + inc_m2_dead) as rate_inc_d_m2
+               FROM stats
+           """})
+        bulk_sql_queries.update({"get_country_latest_date": """SELECT country_region as bulk_country, CAST (MAX(date) AS STRING)  as latest_date
+                FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+                GROUP BY country_region"""})
+        bulk_sql_queries.update({"get_country_latest_date_total_confirmed": """WITH available  AS
+            (
+            SELECT country_region as bulk_country, MAX(date) as latest_date_published
+            FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+            GROUP BY country_region
+            )
+        SELECT bulk_country, CAST(MAX(date) AS STRING) as latest, SUM(confirmed)  as total_confirmed
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` JOIN available
+        ON country_region=bulk_country AND date=latest_date_published
+        GROUP BY bulk_country"""})
+        bulk_sql_queries.update({"get_country_latest_date_total_dead": """WITH available  AS
+            (
+            SELECT country_region as bulk_country, MAX(date) as latest_date_published
+            FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+            GROUP BY country_region
+            )
+        SELECT bulk_country, CAST(MAX(date) AS STRING) as latest, SUM(deaths)  as total_dead
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` JOIN available
+        ON country_region=bulk_country AND date=latest_date_published
+        GROUP BY bulk_country"""})
+        bulk_sql_queries.update({"get_country_latest_date_total_by_territory": """WITH available  AS
+            (
+            SELECT country_region as bulk_country, MAX(date) as latest_date_published
+            FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+            GROUP BY country_region
+            )
+        SELECT bulk_country, province_state as territory, CAST(MAX(date) AS STRING) as latest, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` JOIN available
+        ON country_region=bulk_country AND date=latest_date_published
+        GROUP BY bulk_country, territory
+        ORDER BY bulk_country, territory"""})
+        bulk_sql_queries.update({"get_country_territories": """SELECT DISTINCT country_region as bulk_country, province_state  as territory
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+        WHERE province_state  is  not NULL"""})
+        self.bulk_sql_queries = {key: QueryTemplate(sql) for key, sql in bulk_sql_queries.items()}
+
     def load_sql_queries(self):
         sql_queries = {}
         sql_queries.update({"get_countries_ranking": """WITH available  AS
@@ -158,11 +1578,11 @@ class AppBQContentManager:
             (
             SELECT MAX(date) as latest_date_published
             FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-            WHERE country_region='<country>'
+            WHERE country_region=@country
             )
         SELECT country_region, CAST(MAX(date) AS STRING) as latest, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead,  100*SAFE_DIVIDE(SUM(deaths),SUM(confirmed)) as drate
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-        WHERE country_region='<country>' AND date=latest_date_published
+        WHERE country_region=@country AND date=latest_date_published
         GROUP BY country_region"""})
         sql_queries.update({"get_country_evolution": """
                WITH 
@@ -170,27 +1590,27 @@ class AppBQContentManager:
                        (
                        SELECT  MAX(date) as latest_date_published, date_sub(MAX(date),INTERVAL 1 MONTH) as month_before, date_sub(MAX(date),INTERVAL 2 MONTH) as month_2_before
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-                       WHERE country_region='<country>'
+                       WHERE country_region=@country
                        ),
                latest_data AS
                       (
                        SELECT country_region, date, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=latest_date_published
+                       WHERE country_region=@country AND date=latest_date_published
                        GROUP BY date, country_region
                       ),
                month_before_data AS
                       (
                        SELECT date, SUM(confirmed) as mb_total_confirmed, SUM(deaths)  as mb_total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=month_before
+                       WHERE country_region=@country AND date=month_before
                        GROUP BY date, country_region
                       ),
                month_2_before_data AS
                       (
                        SELECT date, SUM(confirmed) as m2b_total_confirmed, SUM(deaths)  as m2b_total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=month_2_before
+                       WHERE country_region=@country AND date=month_2_before
                        GROUP BY date, country_region
                       ),
                stats AS 
@@ -220,84 +1640,84 @@ class AppBQContentManager:
                  ORDER BY country_region ASC"""})
         sql_queries.update({"get_country_latest_date": """SELECT CAST (MAX(date) AS STRING)  as latest_date
                 FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-                WHERE country_region='<country>'"""})
+                WHERE country_region=@country"""})
         sql_queries.update({"get_country_latest_date_total_confirmed": """WITH available  AS
             (
             SELECT MAX(date) as latest_date_published
             FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-            WHERE country_region='<country>'
+            WHERE country_region=@country
             )
         SELECT CAST(MAX(date) AS STRING) as latest, SUM(confirmed)  as total_confirmed
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-        WHERE country_region='<country>' AND date=latest_date_published"""})
+        WHERE country_region=@country AND date=latest_date_published"""})
         sql_queries.update({"get_country_latest_date_total_dead": """WITH available  AS
             (
             SELECT MAX(date) as latest_date_published
             FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-            WHERE country_region='<country>'
+            WHERE country_region=@country
             )
         SELECT CAST(MAX(date) AS STRING) as latest, SUM(deaths)  as total_dead
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-        WHERE country_region='<country>' AND date=latest_date_published"""})
+        WHERE country_region=@country AND date=latest_date_published"""})
         sql_queries.update({"get_country_latest_date_total": """WITH available  AS
             (
             SELECT MAX(date) as latest_date_published
             FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-            WHERE country_region='<country>'
+            WHERE country_region=@country
             )
-        SELECT CAST(MAX(date) as latest_date AS STRING), SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
+        SELECT CAST(MAX(date) AS STRING) as latest_date, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-        WHERE country_region='<country>' AND date=latest_date_published
+        WHERE country_region=@country AND date=latest_date_published
         GROUP BY country_region"""})
         sql_queries.update({"get_country_latest_date_total_by_territory": """WITH available  AS
             (
             SELECT MAX(date) as latest_date_published
             FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-            WHERE country_region='<country>'
+            WHERE country_region=@country
             )
         SELECT province_state as territory, CAST(MAX(date) AS STRING) as latest, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-        WHERE country_region='<country>' AND date=latest_date_published
+        WHERE country_region=@country AND date=latest_date_published
         GROUP BY territory
         ORDER BY territory"""})
         sql_queries.update({"get_country_territories": """SELECT DISTINCT(province_state)  as territory
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
-        WHERE country_region='<country>' AND province_state  is  not NULL"""})
+        WHERE country_region=@country AND province_state  is  not NULL"""})
         sql_queries.update({"get_country_closest_date": """SELECT CAST(MAX(date) AS STRING)  as closest_available_date
                 FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-                WHERE country_region='<country>' AND DATE_DIFF(DATE(DATETIME "<input-date>"), date, DAY)>=0"""})
+                WHERE country_region=@country AND DATE_DIFF(@start_date, date, DAY)>=0"""})
         sql_queries.update({"get_country_closest_date_total": """
                 WITH closest AS
                 (SELECT MAX(date)  as published_date
                         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-                        WHERE country_region='<country>' AND DATE_DIFF(DATE(DATETIME "<start_date>"), date, DAY)>=0
+                        WHERE country_region=@country AND DATE_DIFF(@start_date, date, DAY)>=0
                 ),                
                available  AS
                        (
                        SELECT  published_date as latest_date_published, date_sub(MAX(date),INTERVAL 1 MONTH) as month_before, date_sub(MAX(date),INTERVAL 2 MONTH) as month_2_before
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`, closest
-                       WHERE country_region='<country>'
+                       WHERE country_region=@country
                         GROUP BY latest_date_published
                        ),
                latest_data AS
                       (
                        SELECT country_region, date, SUM(confirmed) as total_confirmed, SUM(deaths)  as total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=latest_date_published
+                       WHERE country_region=@country AND date=latest_date_published
                        GROUP BY date, country_region
                       ),
                month_before_data AS
                       (
                        SELECT date, SUM(confirmed) as mb_total_confirmed, SUM(deaths)  as mb_total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=month_before
+                       WHERE country_region=@country AND date=month_before
                        GROUP BY date, country_region
                       ),
                month_2_before_data AS
                       (
                        SELECT date, SUM(confirmed) as m2b_total_confirmed, SUM(deaths)  as m2b_total_dead
                        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`,  available
-                       WHERE country_region='<country>' AND date=month_2_before
+                       WHERE country_region=@country AND date=month_2_before
                        GROUP BY date, country_region
                       ),
                stats AS 
@@ -324,11 +1744,11 @@ class AppBQContentManager:
         WITH closest AS
         (SELECT MAX(date)  as published_date
                 FROM `bigquery-public-data.covid19_jhu_csse_eu.summary` 
-                WHERE country_region='<country>' AND DATE_DIFF(DATE(DATETIME "<start_date>"), date, DAY)>=0
+                WHERE country_region=@country AND DATE_DIFF(@start_date, date, DAY)>=0
         )
         SELECT CAST(closest.published_date AS STRING) as latest_date, province_state as territory, SUM(confirmed) as total_confirmed, SUM(deaths) as total_dead, 100*SAFE_DIVIDE(SUM(deaths),SUM(confirmed)) as drate
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`, closest
-        WHERE country_region='<country>' and date=closest.published_date
+        WHERE country_region=@country and date=closest.published_date
         GROUP BY  closest.published_date, territory
         ORDER BY closest.published_date DESC, territory ASC
         """})
@@ -337,7 +1757,7 @@ class AppBQContentManager:
         (
         SELECT  MAX(date) as latest, country_region as country
         FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
-        WHERE country_region in (<country_list>)
+        WHERE country_region IN UNNEST(@country_list)
         GROUP BY country_region
         )
 
@@ -346,4 +1766,5 @@ class AppBQContentManager:
         WHERE date=latest and country_region=country
         GROUP BY country, latest
         """})
-        self.sql_queries = sql_queries
+        # Compile templates once: parameters known before any request
+        self.sql_queries = {key: QueryTemplate(sql) for key, sql in sql_queries.items()}
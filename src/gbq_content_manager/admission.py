@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import contextlib
+import math
+import threading
+
+from gbq_manager.executor import SlotWaiter
+
+# Admission control of content cache misses
+# Cache hits never go through it: they are served at once, whatever the number of misses being loaded
+# At most max_concurrent misses are loaded at the same time, up to max_queue more wait for their turn in arrival order
+# A miss arriving with a full queue, or not admitted within deadline seconds, is shed: AdmissionRejected,
+# served as a fast 503 response with Retry-After by the routes, instead of waiting in an unbounded queue
+# max_concurrent 0: no admission control
+
+SHED_QUEUE_FULL = 'queue_full'
+SHED_DEADLINE = 'deadline'
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, reason, retry_after):
+        super().__init__("Content load not admitted: {}".format(reason))
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class MissAdmission:
+
+    def __init__(self, max_concurrent=32, max_queue=128, deadline=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.waiting = collections.deque()
+        self.active = 0
+        self.max_waiting = 0
+        self.counters = {'admitted': 0, 'queued': 0, 'shed_' + SHED_QUEUE_FULL: 0, 'shed_' + SHED_DEADLINE: 0}
+
+    def retry_after(self) -> int:
+        # Seconds before shed clients should try again: a full queue drains within a deadline
+        return max(1, math.ceil(self.deadline or 1))
+
+    def shed(self, reason):
+        with self.lock:
+            self.counters['shed_' + reason] += 1
+        return AdmissionRejected(reason, self.retry_after())
+
+    def request(self, waiter):
+        # True if admitted at once, None if queued (waiter granted later), raises AdmissionRejected if the queue is full
+        with self.lock:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                self.counters['admitted'] += 1
+                return True
+            if len(self.waiting) < self.max_queue:
+                self.waiting.append(waiter)
+                self.counters['queued'] += 1
+                self.max_waiting = max(self.max_waiting, len(self.waiting))
+                return None
+        raise self.shed(SHED_QUEUE_FULL)
+
+    def release(self):
+        # Hands the slot over to the next waiter, frees it if nobody waits
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    self.active -= 1
+                    return
+                waiter = self.waiting.popleft()
+            if waiter.grant():
+                with self.lock:
+                    self.counters['admitted'] += 1
+                return
+
+    def leave_queue(self, waiter) -> bool:
+        # Returns True if admitted meanwhile, the slot is then held by the caller
+        if waiter.abandon():
+            return True
+        with self.lock:
+            try:
+                self.waiting.remove(waiter)
+            except ValueError:
+                pass
+        return False
+
+    def give_up(self, waiter):
+        # Deadline passed: shed, unless admitted meanwhile
+        if not self.leave_queue(waiter):
+            raise self.shed(SHED_DEADLINE)
+
+    def acquire(self):
+        event = threading.Event()
+        waiter = SlotWaiter(event.set)
+        if self.request(waiter) is None and not event.wait(self.deadline or None):
+            self.give_up(waiter)
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        waiter = SlotWaiter(wake)
+        if self.request(waiter) is not None:
+            return
+        try:
+            await asyncio.wait_for(future, self.deadline or None)
+        except asyncio.TimeoutError:
+            self.give_up(waiter)
+        except asyncio.CancelledError:
+            if self.leave_queue(waiter):
+                self.release()
+            raise
+
+    @contextlib.contextmanager
+    def admit(self):
+        if not self.max_concurrent:
+            yield
+            return
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self):
+        if not self.max_concurrent:
+            yield
+            return
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, max_concurrent=self.max_concurrent, max_queue=self.max_queue,
+                        deadline=self.deadline, active=self.active, waiting=len(self.waiting),
+                        max_waiting=self.max_waiting)
@@ -0,0 +1,139 @@
+import re
+
+from gbq_content_manager.query_templates import QueryTemplate, SOURCE_TABLE
+
+# Compact aggregates of the source table, maintained by the content manager in our own dataset
+# Territory table (CONTENT_AGGREGATE_TABLE): one row per country, territory and date, with the source table
+# column names, read unchanged except for the table name by territory and country list queries
+# Country table (CONTENT_AGGREGATE_TABLE + '_by_country'): one row per country and date with precomputed totals,
+# death rate, increments since one month before and their change against the month before that.
+# Hot per-country queries are rewritten to select a row or two of it, no aggregation at run time
+# Both clustered by country and date: per-country queries only scan the blocks of their country
+
+AGGREGATE_QUERY_KEY = 'aggregate'
+TABLE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+(:[A-Za-z0-9_-]+)?\.\w+\.\w+$')
+COUNTRY_TABLE_SUFFIX = '_by_country'
+
+# Per-country queries reading the country table, {table}: country table id
+# Same columns and rows as the registered queries. Evolution rows need data one and two months before their date
+COUNTRY_QUERIES = {
+    "get_country_summary": """SELECT country_region, CAST(date AS STRING) as latest, total_confirmed, total_dead, drate
+        FROM `{table}`
+        WHERE country_region=@country AND is_latest""",
+    "get_country_evolution": """SELECT country_region, CAST(date AS STRING) as latest_date, total_confirmed, total_dead,
+        drate, inc_m_confirmed, inc_m_dead, rate_inc_c_m2, rate_inc_d_m2
+        FROM `{table}`
+        WHERE country_region=@country AND is_latest AND month_windows""",
+    "get_country_latest_date": """SELECT CAST(MAX(date) AS STRING) as latest_date
+        FROM `{table}`
+        WHERE country_region=@country""",
+    "get_country_latest_date_total_confirmed": """SELECT CAST(MAX(date) AS STRING) as latest,
+        SUM(total_confirmed) as total_confirmed
+        FROM `{table}`
+        WHERE country_region=@country AND is_latest""",
+    "get_country_latest_date_total_dead": """SELECT CAST(MAX(date) AS STRING) as latest, SUM(total_dead) as total_dead
+        FROM `{table}`
+        WHERE country_region=@country AND is_latest""",
+    "get_country_latest_date_total": """SELECT CAST(date AS STRING) as latest_date, total_confirmed, total_dead
+        FROM `{table}`
+        WHERE country_region=@country AND is_latest""",
+    "get_country_closest_date": """SELECT CAST(MAX(date) AS STRING) as closest_available_date
+        FROM `{table}`
+        WHERE country_region=@country AND date<=@start_date""",
+    "get_country_closest_date_total": """SELECT country_region, CAST(date AS STRING) as latest_date, total_confirmed,
+        total_dead, drate, inc_m_confirmed, inc_m_dead, rate_inc_c_m2, rate_inc_d_m2
+        FROM `{table}`
+        WHERE country_region=@country AND month_windows AND date=
+            (SELECT MAX(date) FROM `{table}` WHERE country_region=@country AND date<=@start_date)""",
+}
+
+# Bulk versions, all countries in one scan of the latest rows
+BULK_COUNTRY_QUERIES = {
+    "get_country_summary": """SELECT country_region as bulk_country, country_region, CAST(date AS STRING) as latest,
+        total_confirmed, total_dead, drate
+        FROM `{table}`
+        WHERE is_latest""",
+    "get_country_evolution": """SELECT country_region as bulk_country, country_region,
+        CAST(date AS STRING) as latest_date, total_confirmed, total_dead, drate, inc_m_confirmed, inc_m_dead,
+        rate_inc_c_m2, rate_inc_d_m2
+        FROM `{table}`
+        WHERE is_latest AND month_windows""",
+    "get_country_latest_date": """SELECT country_region as bulk_country, CAST(date AS STRING) as latest_date
+        FROM `{table}`
+        WHERE is_latest""",
+    "get_country_latest_date_total_confirmed": """SELECT country_region as bulk_country, CAST(date AS STRING) as latest,
+        total_confirmed
+        FROM `{table}`
+        WHERE is_latest""",
+    "get_country_latest_date_total_dead": """SELECT country_region as bulk_country, CAST(date AS STRING) as latest,
+        total_dead
+        FROM `{table}`
+        WHERE is_latest""",
+}
+
+
+def validate_table_id(table_id) -> str:
+    # project.dataset.table, never inlined in SQL unless valid
+    if not isinstance(table_id, str) or not TABLE_ID_PATTERN.match(table_id):
+        raise ValueError("Invalid aggregate table {!r}, expected project.dataset.table".format(table_id))
+    return table_id
+
+
+def country_table_id(table_id) -> str:
+    return validate_table_id(table_id) + COUNTRY_TABLE_SUFFIX
+
+
+def aggregate_sql(table_id) -> str:
+    # Script creating or replacing both tables with the current source table data, the country table from the
+    # territory one. Months before a date: same day of month, or last day of a shorter month, as DATE_SUB
+    return """CREATE OR REPLACE TABLE `{table}`
+        CLUSTER BY country_region, date
+        AS
+        SELECT country_region, province_state, date, SUM(confirmed) as confirmed, SUM(deaths) as deaths
+        FROM `{source}`
+        GROUP BY country_region, province_state, date;
+
+        CREATE OR REPLACE TABLE `{country_table}`
+        CLUSTER BY country_region, date
+        AS
+        WITH daily AS
+            (
+            SELECT country_region, date, SUM(confirmed) as total_confirmed, SUM(deaths) as total_dead
+            FROM `{table}`
+            GROUP BY country_region, date
+            ),
+        windows AS
+            (
+            SELECT daily.country_region, daily.date, daily.total_confirmed, daily.total_dead,
+            daily.total_confirmed-mb.total_confirmed as inc_m_confirmed,
+            daily.total_dead-mb.total_dead as inc_m_dead,
+            mb.total_confirmed-m2b.total_confirmed as inc_m2_confirmed,
+            mb.total_dead-m2b.total_dead as inc_m2_dead,
+            mb.date IS NOT NULL AND m2b.date IS NOT NULL as month_windows
+            FROM daily
+            LEFT JOIN daily mb
+            ON mb.country_region=daily.country_region AND mb.date=DATE_SUB(daily.date, INTERVAL 1 MONTH)
+            LEFT JOIN daily m2b
+            ON m2b.country_region=daily.country_region AND m2b.date=DATE_SUB(daily.date, INTERVAL 2 MONTH)
+            )
+        SELECT country_region, date, total_confirmed, total_dead, 100*SAFE_DIVIDE(total_dead, total_confirmed) as drate,
+        inc_m_confirmed, inc_m_dead,
+        SAFE_DIVIDE(inc_m_confirmed - inc_m2_confirmed, inc_m_confirmed + inc_m2_confirmed) as rate_inc_c_m2,
+        SAFE_DIVIDE(inc_m_dead - inc_m2_dead, inc_m_dead + inc_m2_dead) as rate_inc_d_m2,
+        month_windows, date=MAX(date) OVER (PARTITION BY country_region) as is_latest
+        FROM windows""".format(table=validate_table_id(table_id), country_table=country_table_id(table_id),
+                               source=SOURCE_TABLE)
+
+
+def rewrite_templates(templates, table_id, bulk=False) -> dict:
+    # Same queries reading the aggregate tables instead of the source table
+    # Hot per-country queries select precomputed rows of the country table, others read the territory table
+    table_id = validate_table_id(table_id)
+    country_queries = BULK_COUNTRY_QUERIES if bulk else COUNTRY_QUERIES
+    rewritten = {}
+    for key, template in templates.items():
+        if key in country_queries:
+            rewritten[key] = QueryTemplate(country_queries[key].format(table=country_table_id(table_id)))
+        else:
+            rewritten[key] = QueryTemplate(template.sql.replace(SOURCE_TABLE, table_id))
+    return rewritten
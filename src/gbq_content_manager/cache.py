@@ -0,0 +1,240 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from gbq_content_manager.columnar import ColumnarRows
+
+# Eviction policies for BoundedContentCache
+LRU = 'lru'
+LFU = 'lfu'
+
+
+def content_size(content) -> int:
+    # Approximate memory used by a BigQueryContent, measured from its data rows
+    # Row keys come from the query schema and are shared by all rows, not counted
+    size = sys.getsizeof(content)
+    data = content.rows if hasattr(content, 'rows') else getattr(content, 'data', None)
+    if isinstance(data, ColumnarRows):
+        size += data.nbytes()
+    elif isinstance(data, list):
+        size += sys.getsizeof(data)
+        for row in data:
+            size += sys.getsizeof(row)
+            if isinstance(row, dict):
+                for value in row.values():
+                    size += sys.getsizeof(value)
+    return size
+
+
+class ContentCache:
+    # Unbounded in-memory content cache
+    # Content manager cache backends implement this interface:
+    # get (counted as hit/miss), peek (not counted), update, pop, items, clear, stats, after_fork
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def after_fork(self):
+        # Pre-fork worker: the lock may have been held by a thread of the parent
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def update(self, contents):
+        with self.lock:
+            self.entries.update(contents)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def items(self):
+        return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class BoundedContentCache(ContentCache):
+    # In-memory content cache bounded by number of entries and approximate size in bytes
+    # max_entries, max_bytes: 0 for no limit
+    # policy: LRU (least recently used) or LFU (least frequently used) eviction
+    # ttl: seconds an entry is kept after being stored, 0 for no limit
+
+    def __init__(self, max_entries=0, max_bytes=0, policy=LRU, ttl=0, sizeof=content_size):
+        super().__init__()
+        if policy not in (LRU, LFU):
+            raise ValueError("Unknown cache eviction policy {}".format(policy))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.ttl = ttl
+        self.sizeof = sizeof
+        # key: content, ordered from least to most recently used
+        self.entries = OrderedDict()
+        # key: (size, stored_at, uses)
+        self.meta = {}
+        # Keys ordered from least to most recently stored: the first one expires first
+        self.stored = OrderedDict()
+        # LFU: uses -> keys used that many times, ordered from least to most recently used
+        # min_uses is not greater than the uses of any entry, bucket removed when empty
+        self.frequencies = {}
+        self.min_uses = 0
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def expired(self, key, now) -> bool:
+        return bool(self.ttl) and now - self.meta[key][1] >= self.ttl
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            if self.expired(key, time.time()):
+                self.remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            size, stored_at, uses = self.meta[key]
+            self.meta[key] = (size, stored_at, uses + 1)
+            self.entries.move_to_end(key)
+            if self.policy == LFU:
+                self.used(key, uses)
+            self.hits += 1
+            return self.entries[key]
+
+    def used(self, key, uses):
+        # LFU: key moved to the bucket of the next use count
+        bucket = self.frequencies[uses]
+        del bucket[key]
+        if not bucket:
+            del self.frequencies[uses]
+            if self.min_uses == uses:
+                self.min_uses = uses + 1
+        self.frequencies.setdefault(uses + 1, OrderedDict())[key] = None
+
+    def peek(self, key, default=None):
+        with self.lock:
+            if key not in self.entries or self.expired(key, time.time()):
+                return default
+            return self.entries[key]
+
+    def update(self, contents):
+        with self.lock:
+            for key, value in contents.items():
+                self.put(key, value)
+
+    def put(self, key, value):
+        # Storing a key again refreshes its size and TTL
+        with self.lock:
+            uses = 0
+            if key in self.entries:
+                uses = self.meta[key][2]
+                self.remove(key)
+            size = self.sizeof(value)
+            # Room made before storing: the entry stored is kept even if alone it exceeds max_bytes
+            self.evict(size)
+            stored_at = time.time()
+            self.entries[key] = value
+            self.meta[key] = (size, stored_at, uses)
+            self.stored[key] = stored_at
+            self.bytes += size
+            if self.policy == LFU:
+                self.frequencies.setdefault(uses, OrderedDict())[key] = None
+                if len(self.entries) == 1 or uses < self.min_uses:
+                    self.min_uses = uses
+
+    def remove(self, key):
+        value = self.entries.pop(key)
+        size, stored_at, uses = self.meta.pop(key)
+        del self.stored[key]
+        self.bytes -= size
+        if self.policy == LFU:
+            bucket = self.frequencies[uses]
+            del bucket[key]
+            if not bucket:
+                del self.frequencies[uses]
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            return self.remove(key)
+
+    def over_limits(self, size=None) -> bool:
+        # size: size of an entry about to be stored, None if none
+        entries, total_bytes = len(self.entries), self.bytes
+        if size is not None:
+            entries += 1
+            total_bytes += size
+        return (self.max_entries and entries > self.max_entries) \
+            or (self.max_bytes and total_bytes > self.max_bytes)
+
+    def victim(self):
+        # Oldest stored entry if expired, then by eviction policy, without scanning the entries
+        if not self.entries:
+            return None
+        oldest = next(iter(self.stored))
+        if self.expired(oldest, time.time()):
+            return oldest
+        if self.policy == LFU:
+            # Min bucket emptied by a removal: next smallest use count
+            if self.min_uses not in self.frequencies:
+                self.min_uses = min(self.frequencies)
+            # Ties broken by least recent use
+            return next(iter(self.frequencies[self.min_uses]))
+        return next(iter(self.entries))
+
+    def evict(self, size=None):
+        while self.over_limits(size):
+            key = self.victim()
+            if key is None:
+                break
+            self.remove(key)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.meta.clear()
+            self.stored.clear()
+            self.frequencies.clear()
+            self.min_uses = 0
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes,
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes, 'policy': self.policy,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations}
@@ -0,0 +1,157 @@
+import sys
+import threading
+from array import array
+
+# Compact column-wise storage of content data rows
+# Rows of a content share their keys: stored once as a schema tuple, shared by every content with the same columns
+# Integer and float columns are stored as typed arrays (8 bytes per value), with a null mask when they have nulls
+# String columns store interned strings: repeated names (countries, territories, dates) are stored once per process
+# Other columns (booleans, nested values) keep their Python objects
+# Dict rows are rebuilt when needed: whole content, a slice of rows, or a single row
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+schemas = {}
+schemas_lock = threading.Lock()
+
+
+def after_fork():
+    # Pre-fork worker: the lock may have been held by a thread of the parent
+    global schemas_lock
+    schemas_lock = threading.Lock()
+
+
+def shared_schema(names) -> tuple:
+    # One schema tuple per set of column names, column names interned
+    names = tuple(names)
+    schema = schemas.get(names)
+    if schema is None:
+        with schemas_lock:
+            schema = schemas.setdefault(names, tuple(sys.intern(name) for name in names))
+    return schema
+
+
+def compact_column(values):
+    # Typed array, with null mask (bytearray, 1 for null) when needed, or tuple of Python objects
+    present = [value for value in values if value is not None]
+    nulls = bytearray(value is None for value in values) if len(present) < len(values) else None
+    types = set(map(type, present))
+    if types == {int} and INT64_MIN <= min(present) and max(present) <= INT64_MAX:
+        return array('q', (0 if value is None else value for value in values)), nulls
+    if types == {float}:
+        return array('d', (0.0 if value is None else value for value in values)), nulls
+    if types == {str}:
+        return tuple(value if value is None else sys.intern(value) for value in values), None
+    return tuple(values), None
+
+
+class ColumnarRows:
+    __slots__ = ('schema', 'columns', 'nulls', 'length')
+
+    def __init__(self, schema, columns, nulls, length):
+        self.schema = schema
+        self.columns = columns
+        self.nulls = nulls
+        self.length = length
+
+    @classmethod
+    def from_rows(cls, rows):
+        # None if rows are not dictionaries with the same keys in the same order, kept as they are then
+        if not rows or not isinstance(rows[0], dict):
+            return None
+        names = tuple(rows[0])
+        for row in rows:
+            if not isinstance(row, dict) or len(row) != len(names) or tuple(row) != names:
+                return None
+        columns = []
+        nulls = []
+        for name in names:
+            column, column_nulls = compact_column([row[name] for row in rows])
+            columns.append(column)
+            nulls.append(column_nulls)
+        return cls(shared_schema(names), tuple(columns), tuple(nulls), len(rows))
+
+    @classmethod
+    def from_record_batches(cls, record_batches):
+        # Arrow record batches of the same schema, converted column by column. None if there are no rows
+        names = None
+        values = []
+        for record_batch in record_batches:
+            if names is None:
+                names = tuple(record_batch.schema.names)
+                values = [[] for _ in names]
+            for column_values, column in zip(values, record_batch.columns):
+                column_values.extend(column.to_pylist())
+        if not names or not values[0]:
+            return None
+        columns = []
+        nulls = []
+        for column_values in values:
+            column, column_nulls = compact_column(column_values)
+            columns.append(column)
+            nulls.append(column_nulls)
+        return cls(shared_schema(names), tuple(columns), tuple(nulls), len(values[0]))
+
+    def __len__(self):
+        return self.length
+
+    def column_values(self, index, start, stop) -> list:
+        values = list(self.columns[index][start:stop])
+        nulls = self.nulls[index]
+        if nulls is not None:
+            for offset, null in enumerate(nulls[start:stop]):
+                if null:
+                    values[offset] = None
+        return values
+
+    def to_rows(self, start=0, stop=None) -> list:
+        # Dict rows, for rows start to stop
+        start, stop, _ = slice(start, stop).indices(self.length)
+        if start >= stop:
+            return []
+        schema = self.schema
+        columns = [self.column_values(index, start, stop) for index in range(len(schema))]
+        return [dict(zip(schema, values)) for values in zip(*columns)]
+
+    def __getitem__(self, item):
+        # Slices return dict rows, as list slicing would
+        if isinstance(item, slice):
+            if item.step not in (None, 1):
+                return self.to_rows()[item]
+            return self.to_rows(item.start, item.stop)
+        index = range(self.length)[item]
+        return self.to_rows(index, index + 1)[0]
+
+    def __iter__(self):
+        return iter(self.to_rows())
+
+    def nbytes(self) -> int:
+        # Approximate memory used by columns, schema excluded: shared
+        # Interned strings counted once per column, they may be shared with other contents
+        size = sys.getsizeof(self) + sys.getsizeof(self.columns) + sys.getsizeof(self.nulls)
+        for column, nulls in zip(self.columns, self.nulls):
+            size += sys.getsizeof(column)
+            if nulls is not None:
+                size += sys.getsizeof(nulls)
+            if isinstance(column, tuple):
+                strings = {value for value in column if isinstance(value, str)}
+                size += sum(map(sys.getsizeof, strings))
+                size += sum(sys.getsizeof(value) for value in column
+                            if value is not None and not isinstance(value, (str, bool)))
+        return size
+
+
+def compact_rows(rows):
+    # Columnar storage of rows, rows as they are if they cannot be stored column-wise (or are empty)
+    if not isinstance(rows, list):
+        return rows
+    columnar = ColumnarRows.from_rows(rows)
+    return rows if columnar is None else columnar
+
+
+def expand_rows(rows):
+    # Dict rows of stored rows
+    if isinstance(rows, ColumnarRows):
+        return rows.to_rows()
+    return rows
@@ -0,0 +1,100 @@
+import datetime
+import decimal
+import gzip
+import json
+import math
+
+# Optional dependencies: faster JSON serialization and brotli compression when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content encodings
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+# Smaller bodies are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+
+def json_default(value):
+    if isinstance(value, decimal.Decimal):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    raise TypeError("Type {} not serializable".format(value.__class__))
+
+
+def finite_floats(data):
+    # Copy of data with NaN and infinite floats replaced by None, the json module would write them as NaN/Infinity
+    if isinstance(data, float):
+        return data if math.isfinite(data) else None
+    if isinstance(data, dict):
+        return {key: finite_floats(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [finite_floats(value) for value in data]
+    return data
+
+
+def encode_json(data) -> bytes:
+    # Compact JSON, NaN and infinite floats as null
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default)
+    try:
+        body = json.dumps(data, separators=(',', ':'), default=json_default, allow_nan=False)
+    except ValueError:
+        # Rare: only data with non finite floats is walked again
+        body = json.dumps(finite_floats(data), separators=(',', ':'), default=json_default, allow_nan=False)
+    return body.encode('utf-8')
+
+
+def compress(body, encoding) -> bytes:
+    if encoding == GZIP:
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == BROTLI:
+        return brotli.compress(body)
+    return body
+
+
+def accepted_weights(accept_encoding) -> dict:
+    # Accept-Encoding header as content coding -> quality weight, from 0 (not acceptable) to 1
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, *params = part.split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            param_name, _, value = param.partition('=')
+            if param_name.strip().lower() == 'q':
+                try:
+                    weight = float(value.strip())
+                except ValueError:
+                    weight = 0.0
+                # Out of range or NaN weights are not acceptable
+                if not 0.0 <= weight <= 1.0:
+                    weight = 0.0
+        weights[name] = weight
+    return weights
+
+
+def choose_encoding(accept_encoding, size=MIN_COMPRESS_SIZE) -> str:
+    # Best content encoding accepted by the client for a body of size bytes
+    # Codings not listed take the weight of *, identity is used when no compression is preferred to it
+    if not accept_encoding or size < MIN_COMPRESS_SIZE:
+        return IDENTITY
+    weights = accepted_weights(accept_encoding)
+    encoding, best = IDENTITY, weights.get(IDENTITY, 0.0)
+    # Brotli first: same weight, smaller body
+    for candidate in ((BROTLI, GZIP) if brotli is not None else (GZIP,)):
+        weight = weights.get(candidate, weights.get('*', 0.0))
+        if weight > 0.0 and (weight > best or weight == best and encoding == IDENTITY):
+            encoding, best = candidate, weight
+    return encoding
@@ -0,0 +1,123 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+# Content generations shared by a pre-fork parent process with its workers, see prefork module
+# Workers inherit the contents loaded before they are forked (copy-on-write pages)
+# Contents the parent loads afterwards are published as a new generation: every content of its cache,
+# written to a file in a shared memory directory (tmpfs, /dev/shm) then renamed over the current one
+# Workers check the file every interval seconds and store the contents newer than theirs, without BigQuery jobs.
+# Contents are pickled one by one: a worker only unpickles the ones it stores, the others keep their shared pages
+# Files are only written by the parent process, in a directory only readable by its user
+
+SHARED_MEMORY_DIR = '/dev/shm'
+GENERATION_FILE = 'contents.generation'
+
+
+class ContentGenerations:
+
+    def __init__(self, path=None, interval=1.0):
+        # path: directory of the generation file, a new private directory in shared memory by default
+        if not path:
+            path = tempfile.mkdtemp(prefix='gfs-bq-contents-',
+                                    dir=SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None)
+        self.path = path
+        self.file_path = os.path.join(path, GENERATION_FILE)
+        self.interval = interval
+        # Last generation published (parent) or loaded (worker), and signature of the last file read
+        self.generation = 0
+        self.signature = None
+        self.stop_event = None
+        self.lock = threading.Lock()
+        # Counters
+        self.published = 0
+        self.loaded = 0
+        self.contents_loaded = 0
+
+    def publish(self, entries, sources=None) -> int:
+        # entries: (content_key, loaded_at, fields) of every content, sources: source table versions and check times
+        # Returns the generation number
+        with self.lock:
+            generation = self.generation + 1
+            payload = {'generation': generation, 'published_at': time.time(), 'sources': sources or {},
+                       'contents': [(content_key, loaded_at, pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL))
+                                    for content_key, loaded_at, fields in entries]}
+            fd, temp_path = tempfile.mkstemp(prefix='.generation-', dir=self.path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.file_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self.generation = generation
+            self.published += 1
+            return generation
+
+    def read(self):
+        # Generation newer than the last one read, None if there is none
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return None
+        with open(self.file_path, 'rb') as f:
+            payload = pickle.load(f)
+        self.signature = signature
+        if payload['generation'] <= self.generation:
+            return None
+        return payload
+
+    def after_fork(self):
+        # Worker: the lock may have been held by the parent publishing a generation
+        self.lock = threading.Lock()
+
+    def loaded_generation(self, payload, contents_loaded):
+        with self.lock:
+            self.generation = payload['generation']
+            self.loaded += 1
+            self.contents_loaded += contents_loaded
+
+    @staticmethod
+    def entry_fields(entry):
+        return pickle.loads(entry)
+
+    def start_watcher(self, load):
+        # Background thread calling load(payload) for every new generation, load returns contents stored
+        if self.stop_event is not None:
+            return
+        self.stop_event = threading.Event()
+        thread = threading.Thread(target=self.run_watcher, args=(self.stop_event, load), name='content-generations',
+                                  daemon=True)
+        thread.start()
+
+    def stop_watcher(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.stop_event = None
+
+    def run_watcher(self, stop, load):
+        while not stop.is_set():
+            try:
+                payload = self.read()
+                if payload is not None:
+                    self.loaded_generation(payload, load(payload))
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                         self.run_watcher.__name__))
+            stop.wait(self.interval)
+
+    def remove(self):
+        # Parent process exit: generation files removed from shared memory
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'generation': self.generation, 'published': self.published, 'loaded': self.loaded,
+                    'contents_loaded': self.contents_loaded, 'path': self.file_path}
@@ -0,0 +1,256 @@
+import bisect
+import contextlib
+import math
+import threading
+
+# Optional dependency: OpenTelemetry spans around content loads and BigQuery jobs
+# Without an SDK configured by the app, the OpenTelemetry API tracer does nothing
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# In process metrics in Prometheus text exposition format, no dependencies
+# Recording a value is a dictionary lookup and an addition under a lock, cheap enough to leave on
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()) -> str:
+    pairs = ['{}="{}"'.format(name, escape_label(value)) for name, value in zip(names, values)]
+    pairs.extend('{}="{}"'.format(name, value) for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+class Metric:
+    # Metric family: values per tuple of label values, in label_names order
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        # (suffix, label values, extra labels, value) tuples
+        with self.lock:
+            return [('', labels, (), value) for labels, value in sorted(self.values.items())]
+
+    def render(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for suffix, labels, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, format_labels(self.label_names, labels, extra),
+                                            format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self.values.get(labels, 0)
+
+
+class Gauge(Metric):
+    # Gauge set by the application, or read from function at collection time
+    # function returns a value, or a dictionary of values by tuple of label values
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names=(), function=None):
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def value(self, *labels):
+        return self.values.get(labels, 0)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        if isinstance(values, dict):
+            return [('', labels, (), value) for labels, value in sorted(values.items())]
+        return [('', (), (), values)]
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # Per bucket counts (last one: +Inf), sum
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        series = self.values.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, (list(series[0]), series[1])) for labels, series in self.values.items())
+        samples = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', labels, (('le', format_value(float(bound))),), cumulative))
+            samples.append(('_sum', labels, (), total))
+            samples.append(('_count', labels, (), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=(), function=None) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names, function=function))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets=buckets))
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def after_fork(self):
+        # Pre-fork worker: metric locks may have been held by threads of the parent
+        for metric in self.metrics:
+            metric.lock = threading.Lock()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class ContentMetrics(MetricsRegistry):
+    # Metrics of the BigQuery content pipeline
+    # Labels use the content registry key (e.g. get_country_evolution), not the content key with its
+    # parameters, so the number of series is bounded by the number of registered contents
+
+    def __init__(self):
+        super().__init__()
+        # Content manager
+        self.content_requests = self.counter('content_requests_total',
+                                             'Content requests by content state when requested (hit, stale, failed, miss)',
+                                             ('key', 'result'))
+        self.content_refreshes = self.counter('content_refreshes_total',
+                                              'Content loads by data source (bigquery, snapshot, shared) and outcome',
+                                              ('key', 'source', 'outcome'))
+        self.source_changes = self.counter('content_source_changes_total',
+                                           'Source table changes seen by table metadata checks', ('table',))
+        # BigQuery jobs
+        self.bq_jobs = self.counter('bigquery_jobs_total', 'BigQuery jobs run by outcome', ('key', 'outcome'))
+        self.bq_job_duration = self.histogram('bigquery_job_duration_seconds',
+                                              'BigQuery job duration, from submission to decoded rows', ('key',))
+        self.bq_bytes_processed = self.counter('bigquery_bytes_processed_total',
+                                               'Bytes processed reported by BigQuery job statistics', ('key',))
+        self.bq_bytes_billed = self.counter('bigquery_bytes_billed_total',
+                                            'Bytes billed reported by BigQuery job statistics', ('key',))
+        self.bq_rows = self.counter('bigquery_rows_returned_total', 'Rows returned by BigQuery jobs', ('key',))
+        self.bq_in_flight = self.gauge('bigquery_jobs_in_flight', 'BigQuery jobs running')
+        # HTTP routes
+        self.http_duration = self.histogram('http_request_duration_seconds',
+                                            'HTTP request duration by route template', ('route', 'method', 'status'))
+
+    def job_finished(self, key, query_job, row_count, seconds):
+        # Records a successful BigQuery job with its statistics, when the backend reports them
+        self.bq_jobs.inc(key, 'ok')
+        self.bq_job_duration.observe(seconds, key)
+        self.bq_bytes_processed.inc(key, amount=getattr(query_job, 'total_bytes_processed', None) or 0)
+        self.bq_bytes_billed.inc(key, amount=getattr(query_job, 'total_bytes_billed', None) or 0)
+        self.bq_rows.inc(key, amount=row_count)
+
+    def job_failed(self, key, seconds):
+        self.bq_jobs.inc(key, 'error')
+        self.bq_job_duration.observe(seconds, key)
+
+    def job_cancelled(self, key, seconds):
+        # Caller cancelled while the job was running
+        self.bq_jobs.inc(key, 'cancelled')
+        self.bq_job_duration.observe(seconds, key)
+
+
+@contextlib.contextmanager
+def no_span():
+    yield None
+
+
+def span(name, enabled=True, **attributes):
+    # OpenTelemetry span context manager when tracing is enabled and available, a no-op otherwise
+    if trace is None or not enabled:
+        return no_span()
+    return trace.get_tracer('gbq_content_manager').start_as_current_span(
+        name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+
+def trace_job(job_span, query_job, row_count):
+    # BigQuery job statistics as span attributes
+    if job_span is None:
+        return
+    job_span.set_attribute('bigquery.job_id', str(getattr(query_job, 'job_id', '')))
+    job_span.set_attribute('bigquery.bytes_processed', getattr(query_job, 'total_bytes_processed', None) or 0)
+    job_span.set_attribute('bigquery.bytes_billed', getattr(query_job, 'total_bytes_billed', None) or 0)
+    job_span.set_attribute('bigquery.rows', row_count)
+
+
+def trace_error(job_span, exception):
+    if job_span is not None:
+        job_span.record_exception(exception)
+        job_span.set_status(trace.Status(trace.StatusCode.ERROR, str(exception)))
@@ -0,0 +1,34 @@
+import base64
+import binascii
+
+# Cursor based pagination of content data rows
+# A page token carries the offset of the next row and the entity tag of the content data it was issued for,
+# so a token issued before the content was refreshed is rejected instead of returning shifted rows
+
+
+def encode_page_token(offset, data_etag) -> str:
+    return base64.urlsafe_b64encode('{}:{}'.format(offset, data_etag).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(page_token, data_etag) -> int:
+    # Offset of the next row, ValueError for invalid tokens or tokens of other content data
+    try:
+        padded = page_token + '=' * (-len(page_token) % 4)
+        offset, token_etag = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split(':', 1)
+        offset = int(offset)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid page token")
+    if token_etag != data_etag or offset < 0:
+        raise ValueError("Page token expired, content data changed")
+    return offset
+
+
+def data_page(data, data_etag, limit, page_token=None):
+    # Rows of a page and the token of the next page, None for the last page
+    if limit < 1:
+        raise ValueError("Invalid page limit {}".format(limit))
+    data = data or []
+    offset = decode_page_token(page_token, data_etag) if page_token else 0
+    next_offset = offset + limit
+    next_page_token = encode_page_token(next_offset, data_etag) if next_offset < len(data) else None
+    return data[offset:next_offset], next_page_token
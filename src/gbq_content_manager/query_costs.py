@@ -0,0 +1,105 @@
+import threading
+import time
+
+# Dry run cost estimation and bytes billed guardrails for registered queries
+# Every registered query is dry-run with representative parameters, its estimated bytes processed recorded
+# and checked against a budget. Jobs run with a maximum_bytes_billed limit derived from the estimate,
+# so BigQuery fails a job instead of billing far more than expected
+
+# Query validation states
+# unchecked: not dry-run yet
+# ok: estimate within budget
+# over_budget: estimate over budget, rejected or only flagged depending on the budget policy
+# invalid: rejected by BigQuery (SQL or parameter errors), never run
+# error: dry run failed for another reason (network, permissions), not enforced
+QUERY_UNCHECKED = 'unchecked'
+QUERY_OK = 'ok'
+QUERY_OVER_BUDGET = 'over_budget'
+QUERY_INVALID = 'invalid'
+QUERY_ERROR = 'error'
+
+# Budget policies
+POLICY_REJECT = 'reject'
+POLICY_FLAG = 'flag'
+
+# BigQuery bills at least 10 MB per query, lower limits would fail every job
+MIN_BYTES_BILLED = 10 * 1024 * 1024
+# Limit of jobs without estimate nor budget (queries not validated): a few times a full scan of the source table
+DEFAULT_BYTES_BILLED = 10 * 1024 ** 3
+
+# Representative parameter values used to dry-run parameterized queries
+SAMPLE_PARAMETERS = {'country': 'Spain', 'country_list': ['France', 'Italy', 'Spain'], 'start_date': '2021-01-01'}
+
+
+def is_invalid_query_error(exception) -> bool:
+    # BigQuery rejects invalid SQL with a 400 Bad Request error
+    return getattr(exception, 'code', None) == 400
+
+
+class QueryCostRegistry:
+    # Dry run results per query key
+    # budget: max estimated bytes processed per query, 0 for no budget
+    # policy: reject (over budget queries never run) or flag (only reported)
+    # factor: maximum_bytes_billed of a job is its estimate times factor, capped by the budget
+    # default_limit: maximum_bytes_billed of jobs without estimate nor budget, 0 for no limit
+
+    def __init__(self, budget=0, policy=POLICY_REJECT, factor=2.0, default_limit=DEFAULT_BYTES_BILLED):
+        if policy not in (POLICY_REJECT, POLICY_FLAG):
+            raise ValueError("Unknown query budget policy {!r}".format(policy))
+        self.budget = int(budget or 0)
+        self.policy = policy
+        self.factor = float(factor or 1.0)
+        self.default_limit = int(default_limit or 0)
+        self.lock = threading.Lock()
+        self.estimates = {}
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+
+    def record(self, key, bytes_processed=None, error=None) -> str:
+        # Records a dry run estimate or error, returns the query status
+        if error is not None:
+            status = QUERY_INVALID if is_invalid_query_error(error) else QUERY_ERROR
+        elif self.budget and bytes_processed > self.budget:
+            status = QUERY_OVER_BUDGET
+        else:
+            status = QUERY_OK
+        with self.lock:
+            self.estimates[key] = {'status': status, 'bytes_processed': bytes_processed,
+                                   'error': str(error) if error is not None else None,
+                                   'checked_at': time.time()}
+        return status
+
+    def status(self, key) -> str:
+        estimate = self.estimates.get(key)
+        return estimate['status'] if estimate is not None else QUERY_UNCHECKED
+
+    def allowed(self, key) -> bool:
+        status = self.status(key)
+        if status == QUERY_INVALID:
+            return False
+        return not (status == QUERY_OVER_BUDGET and self.policy == POLICY_REJECT)
+
+    def maximum_bytes_billed(self, key):
+        # Per job limit, None for no limit
+        # Without estimate: the budget, or the default limit
+        estimate = self.estimates.get(key)
+        if estimate is None or estimate['bytes_processed'] is None:
+            limit = self.budget or self.default_limit
+            return max(limit, MIN_BYTES_BILLED) if limit else None
+        limit = max(int(estimate['bytes_processed'] * self.factor), MIN_BYTES_BILLED)
+        if self.budget and self.policy == POLICY_REJECT:
+            limit = min(limit, max(self.budget, MIN_BYTES_BILLED))
+        return limit
+
+    def results(self) -> dict:
+        with self.lock:
+            estimates = {key: dict(estimate) for key, estimate in self.estimates.items()}
+        for key, estimate in estimates.items():
+            estimate['allowed'] = self.allowed(key)
+            estimate['maximum_bytes_billed'] = self.maximum_bytes_billed(key)
+        return estimates
+
+    def clear(self):
+        with self.lock:
+            self.estimates.clear()
@@ -0,0 +1,86 @@
+import datetime
+import re
+
+# Source table of all registered queries
+SOURCE_TABLE = 'bigquery-public-data.covid19_jhu_csse_eu.summary'
+
+# Named query parameters used by registered SQL queries: @country, @country_list, @start_date
+# Values are bound through the BigQuery job configuration, never inlined in SQL text
+PARAMETER_PATTERN = re.compile(r'@(\w+)')
+# Order in which parameters are added to content keys
+CONTENT_KEY_PARAMETERS = ('country', 'country_list', 'start_date')
+
+
+def canonical_country(country):
+    if not isinstance(country, str) or not country.strip():
+        raise ValueError("Invalid country {!r}".format(country))
+    return country.strip()
+
+
+def canonical_country_list(country_list):
+    # Same countries in any order or repeated give the same list
+    if isinstance(country_list, str) or not isinstance(country_list, (list, tuple, set)):
+        raise ValueError("Invalid country list {!r}".format(country_list))
+    countries = {canonical_country(country) for country in country_list}
+    if not countries:
+        raise ValueError("Empty country list")
+    return sorted(countries)
+
+
+def canonical_start_date(start_date):
+    # ISO format date: YYYY-MM-DD
+    if isinstance(start_date, datetime.datetime):
+        return start_date.date()
+    if isinstance(start_date, datetime.date):
+        return start_date
+    try:
+        return datetime.date.fromisoformat(str(start_date).strip())
+    except ValueError:
+        raise ValueError("Invalid start date {!r}, expected YYYY-MM-DD".format(start_date))
+
+
+CANONICAL_PARAMETERS = {'country': canonical_country,
+                        'country_list': canonical_country_list,
+                        'start_date': canonical_start_date}
+
+
+def parameter_key(value):
+    # Content key part for a canonical parameter value
+    # Country names keep their case: queries compare them as bound with country_region, case sensitive,
+    # so values running different queries never share a content key
+    if isinstance(value, list):
+        return ','.join(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+class QueryTemplate:
+    # SQL query with named parameters, compiled once when the query registry is loaded
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.parameters = frozenset(PARAMETER_PATTERN.findall(sql))
+        unknown = self.parameters.difference(CANONICAL_PARAMETERS)
+        if unknown:
+            raise ValueError("Unknown query parameters {}".format(sorted(unknown)))
+
+    def bind(self, **kwargs):
+        # Canonical values for the parameters used by the query, ignoring any other argument
+        query_parameters = {}
+        for name in self.parameters:
+            value = kwargs.get(name)
+            if value is None:
+                raise ValueError("Missing query parameter {}".format(name))
+            query_parameters[name] = CANONICAL_PARAMETERS[name](value)
+        return query_parameters
+
+    @staticmethod
+    def content_key(key, query_parameters):
+        # Content key: key followed by canonical parameter values
+        # Example: get_country_summary@Spain, get_country_list_summary@France,Spain
+        content_key = key
+        for name in CONTENT_KEY_PARAMETERS:
+            if name in query_parameters:
+                content_key = content_key + '@' + parameter_key(query_parameters[name])
+        return content_key
@@ -0,0 +1,191 @@
+import datetime
+import json
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlparse, unquote
+
+from gbq_content_manager.encoding import json_default
+
+# Shared content cache tier
+# Second cache level behind the in-memory contents, shared by workers and instances
+# Entries record the data and when it was loaded, so every tier applies the same freshness rules
+
+
+def encode_entry(data, last_run, loaded_at, source_version=None) -> bytes:
+    # Compact payload: minified JSON, zlib compressed
+    entry = {'data': data, 'last_run': last_run.isoformat(), 'loaded_at': loaded_at, 'source_version': source_version}
+    return zlib.compress(json.dumps(entry, separators=(',', ':'), default=json_default).encode('utf-8'))
+
+
+def decode_entry(payload):
+    entry = json.loads(zlib.decompress(payload).decode('utf-8'))
+    entry['last_run'] = datetime.date.fromisoformat(entry['last_run'])
+    # Entries stored before source versions were recorded
+    entry.setdefault('source_version', None)
+    return entry
+
+
+class SharedContentStore:
+    # Shared content cache interface
+    # get returns a decoded entry dict (data, last_run, loaded_at, source_version) or None
+    # set stores an entry until expires_at timestamp
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, data, last_run, loaded_at, expires_at, source_version=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteContentStore(SharedContentStore):
+    # Local file store, shared by processes on the same host and usable offline
+    # One connection per thread, WAL journal so readers do not block the writer
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute("""CREATE TABLE IF NOT EXISTS contents
+            (key TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at REAL NOT NULL)""")
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute('SELECT payload FROM contents WHERE key=? AND expires_at>?',
+                                        (key, time.time())).fetchone()
+        return decode_entry(row[0]) if row else None
+
+    def set(self, key, data, last_run, loaded_at, expires_at, source_version=None):
+        self.connection().execute('INSERT OR REPLACE INTO contents (key, payload, expires_at) VALUES (?, ?, ?)',
+                                  (key, encode_entry(data, last_run, loaded_at, source_version), expires_at))
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM contents WHERE key=?', (key,))
+
+    def purge(self):
+        # Remove expired entries
+        self.connection().execute('DELETE FROM contents WHERE expires_at<=?', (time.time(),))
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class RedisContentStore(SharedContentStore):
+    # Minimal Redis protocol (RESP) client, enough for GET/SET/DEL
+    # Works with Redis, Memorystore, Valkey, KeyDB and other RESP servers
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=2.0, prefix='gfs-bq:'):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self.execute_raw('AUTH', self.password)
+        if self.db:
+            self.execute_raw('SELECT', self.db)
+
+    def execute(self, *args):
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.connect()
+                return self.execute_raw(*args)
+            except (OSError, ConnectionError):
+                # Drop broken connection, next command reconnects
+                self.close()
+                raise
+
+    def execute_raw(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RuntimeError("Redis error: {}".format(rest.decode('utf-8', 'replace')))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            value = self.reader.read(length + 2)
+            return value[:-2]
+        if kind == b'*':
+            return [self.read_reply() for _ in range(int(rest))]
+        raise ConnectionError("Unknown Redis reply {}".format(line))
+
+    def get(self, key):
+        payload = self.execute('GET', self.prefix + key)
+        return decode_entry(payload) if payload else None
+
+    def set(self, key, data, last_run, loaded_at, expires_at, source_version=None):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms > 0:
+            self.execute('SET', self.prefix + key, encode_entry(data, last_run, loaded_at, source_version),
+                         'PX', ttl_ms)
+
+    def delete(self, key):
+        self.execute('DEL', self.prefix + key)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+
+def shared_store_from_url(url):
+    # sqlite:///path/to/contents.db
+    # redis://[:password@]host[:port][/db]
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteContentStore(parsed.path)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.strip('/') or 0)
+        password = unquote(parsed.password) if parsed.password else None
+        return RedisContentStore(host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+                                 db=db, password=password)
+    raise ValueError("Unsupported shared content cache URL {}".format(url))
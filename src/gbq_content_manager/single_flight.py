@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key into one execution
+    # The first caller (leader) runs the function, later callers wait for the leader's result
+    # In-flight calls are tracked with concurrent.futures.Future objects,
+    # so threads and asyncio tasks can wait on the same execution
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # Counters: real executions vs callers that waited on an execution already in flight
+        self.executions = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        # Returns the in-flight future for key and whether the caller is its leader
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = Future()
+                self.in_flight[key] = future
+                self.executions += 1
+                return future, True
+            self.coalesced += 1
+            return future, False
+
+    def leave(self, key, future, result=None, exception=None):
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if exception is None:
+            future.set_result(result)
+        elif isinstance(exception, Exception):
+            future.set_exception(exception)
+        else:
+            # Leader cancelled or interrupted: waiting callers get a CancelledError
+            future.cancel()
+
+    def run(self, key, fn, *args, **kwargs):
+        future, leader = self.join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.leave(key, future, exception=e)
+            raise
+        self.leave(key, future, result=result)
+        return result
+
+    async def run_async(self, key, coro_fn, *args, **kwargs):
+        future, leader = self.join(key)
+        if not leader:
+            # shield: a cancelled waiter must not cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except BaseException as e:
+            self.leave(key, future, exception=e)
+            raise
+        self.leave(key, future, result=result)
+        return result
+
+    def is_in_flight(self, key) -> bool:
+        with self.lock:
+            return key in self.in_flight
+
+    def stats(self):
+        with self.lock:
+            return {'executions': self.executions, 'coalesced': self.coalesced, 'in_flight': len(self.in_flight)}
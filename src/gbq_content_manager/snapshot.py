@@ -0,0 +1,363 @@
+import csv
+import datetime
+import json
+import os
+import shutil
+
+# Optional dependency, only needed when a content snapshot is configured
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Local columnar snapshot of the summary table
+# Daily country, territory and date totals, enough to compute every registered content without BigQuery
+# Arrays are sorted by country and date, and memory-mapped from disk when loaded from a snapshot directory
+SNAPSHOT_SQL = """SELECT country_region, province_state, date, SUM(confirmed) as confirmed, SUM(deaths) as deaths
+        FROM `bigquery-public-data.covid19_jhu_csse_eu.summary`
+        GROUP BY country_region, province_state, date"""
+SNAPSHOT_ARRAYS = ('country', 'territory', 'date', 'confirmed', 'deaths')
+
+
+def month_sub(day, months):
+    # BigQuery DATE_SUB(day, INTERVAL months MONTH): day clamped to the end of the resulting month
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last_day = (next_month - datetime.timedelta(days=1)).day
+    return datetime.date(year, month, min(day.day, last_day))
+
+
+def safe_divide(a, b):
+    if a is None or b is None or b == 0:
+        return None
+    return a / b
+
+
+def subtract(a, b):
+    if a is None or b is None:
+        return None
+    return a - b
+
+
+def drate(total_dead, total_confirmed):
+    rate = safe_divide(total_dead, total_confirmed)
+    return None if rate is None else 100 * rate
+
+
+class ContentSnapshot:
+    # Registered contents computed locally with vectorized aggregations over the snapshot arrays
+    # Results have the same rows and columns as the registered BigQuery queries
+
+    def __init__(self, countries, territories, country, territory, date, confirmed, deaths, built_on=None):
+        if np is None:
+            raise RuntimeError("Content snapshots require numpy")
+        # countries, territories: names, indexed by codes in country and territory arrays (-1: no territory)
+        self.countries = list(countries)
+        self.territories = list(territories)
+        self.country_codes = {name: code for code, name in enumerate(self.countries)}
+        self.country = country
+        self.territory = territory
+        self.date = date
+        # Daily totals, NaN when not reported
+        self.confirmed = confirmed
+        self.deaths = deaths
+        self.built_on = built_on or datetime.date.today()
+        # Rows for country code c: offsets[c]:offsets[c + 1]
+        self.offsets = np.searchsorted(self.country, np.arange(len(self.countries) + 1))
+        self.computes = {
+            "get_countries_ranking": self.get_countries_ranking,
+            "get_countries": self.get_countries,
+            "get_country_summary": self.get_country_summary,
+            "get_country_evolution": self.get_country_evolution,
+            "get_country_latest_date": self.get_country_latest_date,
+            "get_country_latest_date_total_confirmed": self.get_country_latest_date_total_confirmed,
+            "get_country_latest_date_total_dead": self.get_country_latest_date_total_dead,
+            "get_country_latest_date_total": self.get_country_latest_date_total,
+            "get_country_latest_date_total_by_territory": self.get_country_latest_date_total_by_territory,
+            "get_country_territories": self.get_country_territories,
+            "get_country_closest_date": self.get_country_closest_date,
+            "get_country_closest_date_total": self.get_country_closest_date_total,
+            "get_country_closest_date_total_by_territory": self.get_country_closest_date_total_by_territory,
+            "get_country_list_summary": self.get_country_list_summary,
+        }
+
+    # Building, loading and saving snapshots
+
+    @classmethod
+    def from_rows(cls, rows, built_on=None):
+        # rows: dictionaries with country_region, province_state, date, confirmed, deaths
+        if np is None:
+            raise RuntimeError("Content snapshots require numpy")
+        rows = [row for row in rows if row.get('country_region') is not None and row.get('date') is not None]
+        countries = sorted({row['country_region'] for row in rows})
+        territories = sorted({row['province_state'] for row in rows if row.get('province_state') is not None})
+        country_codes = {name: code for code, name in enumerate(countries)}
+        territory_codes = {name: code for code, name in enumerate(territories)}
+        country = np.array([country_codes[row['country_region']] for row in rows], dtype=np.int32)
+        territory = np.array([territory_codes.get(row.get('province_state'), -1) for row in rows], dtype=np.int32)
+        date = np.array([str(row['date'])[:10] for row in rows], dtype='datetime64[D]')
+        confirmed = np.array([np.nan if row.get('confirmed') in (None, '') else float(row['confirmed'])
+                              for row in rows], dtype=np.float64)
+        deaths = np.array([np.nan if row.get('deaths') in (None, '') else float(row['deaths'])
+                           for row in rows], dtype=np.float64)
+        order = np.lexsort((date, country))
+        return cls(countries, territories, country[order], territory[order], date[order],
+                   confirmed[order], deaths[order], built_on=built_on)
+
+    @classmethod
+    def from_csv(cls, path, built_on=None):
+        # CSV file with header country_region,province_state,date,confirmed,deaths
+        with open(path, newline='') as f:
+            rows = [dict(row, province_state=row.get('province_state') or None) for row in csv.DictReader(f)]
+        return cls.from_rows(rows, built_on=built_on)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # Snapshot directory written by save, or a CSV file
+        if np is None:
+            raise RuntimeError("Content snapshots require numpy")
+        if os.path.isfile(path):
+            return cls.from_csv(path)
+        with open(os.path.join(path, 'names.json')) as f:
+            names = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in SNAPSHOT_ARRAYS}
+        return cls(names['countries'], names['territories'], built_on=datetime.date.fromisoformat(names['built_on']),
+                   **arrays)
+
+    def save(self, path):
+        # Written next to path and moved in place, readers never see a partial snapshot
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in SNAPSHOT_ARRAYS:
+            np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp_path, 'names.json'), 'w') as f:
+            json.dump({'countries': self.countries, 'territories': self.territories,
+                       'built_on': self.built_on.isoformat()}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    # Content computation
+
+    def supports(self, key) -> bool:
+        return key in self.computes
+
+    def compute(self, key, **query_parameters):
+        return self.computes[key](**query_parameters)
+
+    def country_slice(self, country):
+        code = self.country_codes.get(country)
+        if code is None:
+            return None
+        return slice(int(self.offsets[code]), int(self.offsets[code + 1]))
+
+    @staticmethod
+    def total(values):
+        # SUM: NULL when no value reported
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return None
+        return int(values[valid].sum())
+
+    @staticmethod
+    def day(value):
+        return datetime.date.fromisoformat(str(value))
+
+    def date_range(self, rows, day):
+        # Slice of rows (country slice) with date day
+        dates = self.date[rows]
+        day = np.datetime64(day, 'D')
+        lo = int(np.searchsorted(dates, day, side='left'))
+        hi = int(np.searchsorted(dates, day, side='right'))
+        return slice(rows.start + lo, rows.start + hi)
+
+    def latest_day(self, rows):
+        if rows is None or rows.start == rows.stop:
+            return None
+        return self.day(self.date[rows.stop - 1])
+
+    def closest_day(self, rows, start_date):
+        # Latest date on or before start_date
+        if rows is None:
+            return None
+        dates = self.date[rows]
+        index = int(np.searchsorted(dates, np.datetime64(start_date, 'D'), side='right'))
+        return self.day(dates[index - 1]) if index else None
+
+    def day_totals(self, rows, day):
+        # (total confirmed, total dead, number of rows) for rows on day
+        day_rows = self.date_range(rows, day)
+        return self.total(self.confirmed[day_rows]), self.total(self.deaths[day_rows]), day_rows.stop - day_rows.start
+
+    def territory_totals(self, rows, day):
+        # Rows per territory on day, ordered by territory name, no territory first
+        day_rows = self.date_range(rows, day)
+        codes = self.territory[day_rows] + 1
+        confirmed = self.confirmed[day_rows]
+        deaths = self.deaths[day_rows]
+        size = len(self.territories) + 1
+        present = np.bincount(codes, minlength=size)
+        confirmed_sum = np.bincount(codes, weights=np.nan_to_num(confirmed), minlength=size)
+        confirmed_count = np.bincount(codes, weights=~np.isnan(confirmed), minlength=size)
+        deaths_sum = np.bincount(codes, weights=np.nan_to_num(deaths), minlength=size)
+        deaths_count = np.bincount(codes, weights=~np.isnan(deaths), minlength=size)
+        totals = []
+        # Territory codes follow sorted territory names
+        for code in np.nonzero(present)[0]:
+            territory = self.territories[code - 1] if code else None
+            total_confirmed = int(confirmed_sum[code]) if confirmed_count[code] else None
+            total_dead = int(deaths_sum[code]) if deaths_count[code] else None
+            totals.append((territory, total_confirmed, total_dead))
+        return totals
+
+    def get_countries_ranking(self):
+        if len(self.date) == 0:
+            return []
+        latest = self.date.max()
+        on_latest = self.date == latest
+        codes = self.country[on_latest]
+        size = len(self.countries)
+        confirmed = self.confirmed[on_latest]
+        deaths = self.deaths[on_latest]
+        present = np.bincount(codes, minlength=size)
+        confirmed_sum = np.bincount(codes, weights=np.nan_to_num(confirmed), minlength=size)
+        confirmed_count = np.bincount(codes, weights=~np.isnan(confirmed), minlength=size)
+        deaths_sum = np.bincount(codes, weights=np.nan_to_num(deaths), minlength=size)
+        deaths_count = np.bincount(codes, weights=~np.isnan(deaths), minlength=size)
+        rows = []
+        for code in np.nonzero(present)[0]:
+            total_confirmed = int(confirmed_sum[code]) if confirmed_count[code] else None
+            total_dead = int(deaths_sum[code]) if deaths_count[code] else None
+            rows.append({'country_region': self.countries[code], 'latest': str(latest),
+                         'total_confirmed': total_confirmed, 'total_dead': total_dead,
+                         'drate': drate(total_dead, total_confirmed)})
+        # ORDER BY total_confirmed DESC, total_dead DESC: NULLs last
+        rows.sort(key=lambda r: (r['total_confirmed'] is not None, r['total_confirmed'] or 0,
+                                 r['total_dead'] is not None, r['total_dead'] or 0), reverse=True)
+        return rows[:5]
+
+    def get_countries(self):
+        # Countries reporting this year: DATE_DIFF(CURRENT_DATE(), date, YEAR)<1
+        first_day = np.datetime64(datetime.date(datetime.date.today().year, 1, 1), 'D')
+        codes = np.unique(self.country[self.date >= first_day])
+        return [{'country_region': self.countries[code]} for code in codes]
+
+    def get_country_summary(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return []
+        total_confirmed, total_dead, count = self.day_totals(rows, latest)
+        return [{'country_region': country, 'latest': latest.isoformat(), 'total_confirmed': total_confirmed,
+                 'total_dead': total_dead, 'drate': drate(total_dead, total_confirmed)}]
+
+    def get_country_latest_date(self, country):
+        latest = self.latest_day(self.country_slice(country))
+        return [{'latest_date': latest.isoformat() if latest else None}]
+
+    def get_country_latest_date_total_confirmed(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return [{'latest': None, 'total_confirmed': None}]
+        total_confirmed, total_dead, count = self.day_totals(rows, latest)
+        return [{'latest': latest.isoformat(), 'total_confirmed': total_confirmed}]
+
+    def get_country_latest_date_total_dead(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return [{'latest': None, 'total_dead': None}]
+        total_confirmed, total_dead, count = self.day_totals(rows, latest)
+        return [{'latest': latest.isoformat(), 'total_dead': total_dead}]
+
+    def get_country_latest_date_total(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return []
+        total_confirmed, total_dead, count = self.day_totals(rows, latest)
+        return [{'latest_date': latest.isoformat(), 'total_confirmed': total_confirmed, 'total_dead': total_dead}]
+
+    def get_country_latest_date_total_by_territory(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return []
+        return [{'territory': territory, 'latest': latest.isoformat(), 'total_confirmed': total_confirmed,
+                 'total_dead': total_dead}
+                for territory, total_confirmed, total_dead in self.territory_totals(rows, latest)]
+
+    def get_country_territories(self, country):
+        rows = self.country_slice(country)
+        if rows is None:
+            return []
+        codes = np.unique(self.territory[rows])
+        return [{'territory': self.territories[code]} for code in codes if code >= 0]
+
+    def evolution(self, rows, country, published, latest):
+        # published: date of the reported totals
+        # latest: date month before and two months before are computed from, as in the SQL query
+        month_before = month_sub(latest, 1)
+        month_2_before = month_sub(latest, 2)
+        total_confirmed, total_dead, count = self.day_totals(rows, published)
+        mb_total_confirmed, mb_total_dead, mb_count = self.day_totals(rows, month_before)
+        m2b_total_confirmed, m2b_total_dead, m2b_count = self.day_totals(rows, month_2_before)
+        if not (count and mb_count and m2b_count):
+            return []
+        inc_m_confirmed = subtract(total_confirmed, mb_total_confirmed)
+        inc_m_dead = subtract(total_dead, mb_total_dead)
+        inc_m2_confirmed = subtract(mb_total_confirmed, m2b_total_confirmed)
+        inc_m2_dead = subtract(mb_total_dead, m2b_total_dead)
+        sum_confirmed = None if inc_m_confirmed is None or inc_m2_confirmed is None \
+            else inc_m_confirmed + inc_m2_confirmed
+        sum_dead = None if inc_m_dead is None or inc_m2_dead is None else inc_m_dead + inc_m2_dead
+        return [{'country_region': country, 'latest_date': published.isoformat(),
+                 'total_confirmed': total_confirmed, 'total_dead': total_dead,
+                 'drate': drate(total_dead, total_confirmed),
+                 'inc_m_confirmed': inc_m_confirmed, 'inc_m_dead': inc_m_dead,
+                 'rate_inc_c_m2': safe_divide(subtract(inc_m_confirmed, inc_m2_confirmed), sum_confirmed),
+                 'rate_inc_d_m2': safe_divide(subtract(inc_m_dead, inc_m2_dead), sum_dead)}]
+
+    def get_country_evolution(self, country):
+        rows = self.country_slice(country)
+        latest = self.latest_day(rows)
+        if latest is None:
+            return []
+        return self.evolution(rows, country, latest, latest)
+
+    def get_country_closest_date(self, country, start_date):
+        closest = self.closest_day(self.country_slice(country), start_date)
+        return [{'closest_available_date': closest.isoformat() if closest else None}]
+
+    def get_country_closest_date_total(self, country, start_date):
+        rows = self.country_slice(country)
+        closest = self.closest_day(rows, start_date)
+        if closest is None:
+            return []
+        return self.evolution(rows, country, closest, self.latest_day(rows))
+
+    def get_country_closest_date_total_by_territory(self, country, start_date):
+        rows = self.country_slice(country)
+        closest = self.closest_day(rows, start_date)
+        if closest is None:
+            return []
+        return [{'latest_date': closest.isoformat(), 'territory': territory, 'total_confirmed': total_confirmed,
+                 'total_dead': total_dead, 'drate': drate(total_dead, total_confirmed)}
+                for territory, total_confirmed, total_dead in self.territory_totals(rows, closest)]
+
+    def get_country_list_summary(self, country_list):
+        summary = []
+        for country in country_list:
+            rows = self.country_slice(country)
+            latest = self.latest_day(rows)
+            if latest is None:
+                continue
+            total_confirmed, total_dead, count = self.day_totals(rows, latest)
+            # Unnamed CAST column gets BigQuery default name f0_
+            summary.append({'f0_': latest.isoformat(), 'country': country,
+                            'total_confirmed': total_confirmed, 'total_dead': total_dead})
+        return summary
@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+
+# Source table versions: last modification time of the tables registered queries read
+# One metadata call per table every check interval, shared by all contents reading it
+# Contents record the version of their source table when loaded, and are current until the table changes again
+
+
+class SourceVersions:
+
+    def __init__(self, interval=600):
+        # interval: seconds between checks of the same table
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Table id -> last modification time (seconds since epoch), and time of its last successful check
+        self.versions = {}
+        self.checked_at = {}
+        self.changes = 0
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+
+    def version(self, table_id):
+        # Last known version, None if never checked
+        return self.versions.get(table_id)
+
+    def next_check_at(self, table_id) -> float:
+        # Latest time the table version is checked again, a late check is expected at once
+        now = time.time()
+        next_check = self.checked_at.get(table_id, now) + self.interval
+        return next_check if next_check > now else now + self.interval
+
+    def check(self, backend, table_ids) -> list:
+        # Reads the version of each table, returns the tables that changed since their last check
+        changed = []
+        for table_id in table_ids:
+            try:
+                modified = backend.table_modified(table_id)
+            except Exception as e:
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                         self.check.__name__))
+                continue
+            with self.lock:
+                previous = self.versions.get(table_id)
+                if modified is not None:
+                    self.versions[table_id] = modified
+                    if previous is not None and modified > previous:
+                        self.changes += 1
+                        changed.append(table_id)
+                self.checked_at[table_id] = time.time()
+        return changed
+
+    def export(self) -> dict:
+        with self.lock:
+            return {'versions': dict(self.versions), 'checked_at': dict(self.checked_at)}
+
+    def merge(self, exported):
+        # Versions checked by another process (pre-fork parent), kept where newer than the ones known here
+        with self.lock:
+            for table_id, version in exported.get('versions', {}).items():
+                if self.versions.get(table_id) is None or version > self.versions[table_id]:
+                    self.versions[table_id] = version
+            for table_id, checked_at in exported.get('checked_at', {}).items():
+                self.checked_at[table_id] = max(checked_at, self.checked_at.get(table_id, checked_at))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'interval': self.interval, 'changes': self.changes,
+                    'tables': {table_id: {'version': version, 'checked_at': self.checked_at.get(table_id)}
+                               for table_id, version in self.versions.items()}}
@@ -1,45 +1,243 @@
-from google.cloud import bigquery
+import datetime
+import importlib
 import os
 import logging
+import threading
 
+from gbq_manager.backend import BQBackend
 
-class GBQManager:
+# google.cloud.bigquery is imported on first use, not when the app is imported:
+# it takes longer to import than the rest of the app
+_modules = {}
+
+
+def bigquery():
+    return _import('google.cloud.bigquery')
+
+
+def api_exceptions():
+    return _import('google.api_core.exceptions')
+
+
+def requests_adapters():
+    return _import('requests.adapters')
+
+
+def google_auth():
+    return _import('google.auth')
+
+
+def service_account():
+    return _import('google.oauth2.service_account')
+
+
+def auth_requests():
+    return _import('google.auth.transport.requests')
+
+
+# Optional dependencies: query results read as Arrow record batches with the BigQuery Storage Read API
+# when google-cloud-bigquery-storage and pyarrow are installed
+def bigquery_storage():
+    return _import('google.cloud.bigquery_storage', optional=True)
+
+
+def pyarrow():
+    return _import('pyarrow', optional=True)
+
+
+def _import(name, optional=False):
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            if not optional:
+                raise
+            _modules[name] = None
+    return _modules[name]
+
+
+class GBQManager(BQBackend):
 
     def __init__(self):
         self.client = None
         self.app = None
+        # Lazy client: built on first use, or by connect() in a startup background task
+        self.lazy = False
+        self.lock = threading.Lock()
+        # Keep-alive HTTP connections kept per host, 0: one per concurrent job plus room for metadata calls
+        self.http_pool_size = 0
+        # BigQuery Storage Read API client, None when google-cloud-bigquery-storage or pyarrow is not installed
+        self.storage_client = None
 
     # Link BigQueryManager to validated app
+    # With app.config['BQ_LAZY_CLIENT'] the client is not built here, see connect
     def init_app(self, app):
         if self.validate_app(app):
-            sa_creds_json_file = app.config['BQ_SA_KEY_JSON_FILE']
+            self.configure_jobs(app)
+            self.http_pool_size = app.config.get('BQ_HTTP_POOL_SIZE') or self.http_pool_size
+            if app.config.get('BQ_LAZY_CLIENT', False):
+                self.lazy = True
+                self.app = app
+                return
+            self.client = self.create_client(app.config['BQ_SA_KEY_JSON_FILE'])
+            if self.initialized():
+                self.app = app
+
+    def create_client(self, sa_creds_json_file):
+        client = None
+        scopes = bigquery().Client.SCOPE
+        try:
             if sa_creds_json_file == "":
                 # Use default Google Cloud application credentials or running Cloud service identity
-                try:
-                    self.client = bigquery.Client()
-                except Exception as e:
-                    logging.log(level=logging.ERROR,
-                                msg="Exception {}:{} Method: {}".format(e.__class__, e, self.init_app.__name__))
-                    pass
+                credentials, project = google_auth().default(scopes=scopes)
             else:
                 # Credential from file
-                try:
-                    self.client = bigquery.Client.from_service_account_json(sa_creds_json_file)
-                except Exception as e:
-                    logging.log(level=logging.ERROR,
-                                msg="Exception {}:{} Method: {}".format(e.__class__, e, self.init_app.__name__))
-                    pass
-            if self.initialized():
-                self.app = app
+                credentials = service_account().Credentials.from_service_account_file(sa_creds_json_file,
+                                                                                      scopes=scopes)
+                project = credentials.project_id
+            client = bigquery().Client(project=project, credentials=credentials,
+                                       _http=self.http_session(credentials))
+            self.storage_client = self.create_storage_client(credentials)
+        except Exception as e:
+            logging.log(level=logging.ERROR,
+                        msg="Exception {}:{} Method: {}".format(e.__class__, e, self.create_client.__name__))
+        return client
+
+    # Authorized HTTP session given to the client: requests keeps connections alive, but its default pool keeps
+    # 10 per host and opens, then drops, a new connection for every request beyond that
+    # Pool sized for BQ_MAX_CONCURRENT_JOBS jobs polled and read at once, plus metadata and dry run calls
+    def http_session(self, credentials):
+        pool_size = self.http_pool_size or self.max_jobs + 4
+        session = auth_requests().AuthorizedSession(credentials)
+        session.mount('https://', requests_adapters().HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        return session
+
+    @staticmethod
+    def create_storage_client(credentials):
+        if bigquery_storage() is None or pyarrow() is None:
+            return None
+        return bigquery_storage().BigQueryReadClient(credentials=credentials)
+
+    # Builds the client of a lazy manager, once. Returns True if a client is available
+    def connect(self) -> bool:
+        if self.client is None and self.lazy and self.app is not None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.create_client(self.app.config['BQ_SA_KEY_JSON_FILE'])
+        return self.client is not None
+
+    # BigQuery client, built on first use by lazy managers
+    def get_client(self):
+        if not self.connect():
+            raise RuntimeError("BigQuery client not available")
+        return self.client
 
     # Checks a valid bigquery client is stored in attribute client
+    # Lazy managers linked to an app are ready to build their client on first use
     def initialized(self) -> bool:
-        return self.client is not None \
-               and isinstance(self.client, bigquery.Client)
+        if self.client is None:
+            return self.lazy and self.app is not None
+        return isinstance(self.client, bigquery().Client)
+
+    # Runs a query job with named query parameters bound through the job configuration
+    # query_parameters: dictionary name: value, for @name parameters in sql_query
+    def query(self, sql_query, query_parameters=None, **job_options):
+        job_config = self.job_config(query_parameters, **job_options)
+        return self.get_client().query(query=sql_query, job_config=job_config)
+
+    # Dry-runs a query job: validates SQL and parameters, returns estimated bytes processed
+    # Raises google.api_core.exceptions.BadRequest for invalid queries
+    def dry_run(self, sql_query, query_parameters=None) -> int:
+        query_job = self.query(sql_query, query_parameters, dry_run=True, use_query_cache=False)
+        return query_job.total_bytes_processed or 0
+
+    # Last modification time of a table, seconds since epoch, None if it does not exist
+    def table_modified(self, table_id):
+        try:
+            table = self.get_client().get_table(table_id)
+        except Exception as e:
+            if isinstance(e, api_exceptions().NotFound):
+                return None
+            raise
+        return table.modified.timestamp() if table.modified is not None else None
+
+    # Waits for a query job and returns its rows: a list of dictionaries, or compact rows (see columnar module)
+    # when read with the BigQuery Storage Read API
+    def fetch_rows(self, query_job, timeout=None):
+        rows = query_job.result(timeout=timeout)
+        if self.storage_client is not None and hasattr(rows, 'to_arrow_iterable'):
+            return self.decode_arrow(rows, self.storage_client)
+        return self.decode_rows(rows)
+
+    # Waits for a query job and yields its rows page by page, only one page of rows in memory at a time
+    def iter_pages(self, query_job, timeout=None, page_size=None):
+        rows = query_job.result(timeout=timeout, page_size=page_size)
+        for page in rows.pages:
+            yield [dict(row) for row in page]
+
+    # Decodes query results in a single pass, without keeping intermediate Row objects
+    # Used without a BigQuery Storage client: Arrow record batches would be built from the same REST pages,
+    # then converted back to rows, slower than reading the rows directly
+    @staticmethod
+    def decode_rows(rows) -> list:
+        return [dict(row) for row in rows]
+
+    # Decodes query results read as Arrow record batches by the BigQuery Storage Read API, column by column,
+    # straight into compact rows: no dict per row. Results in the first REST page are read from it by the client
+    @staticmethod
+    def decode_arrow(rows, storage_client):
+        from gbq_content_manager.columnar import ColumnarRows
+        compact = ColumnarRows.from_record_batches(rows.to_arrow_iterable(bqstorage_client=storage_client))
+        return compact if compact is not None else []
+
+    @classmethod
+    def job_config(cls, query_parameters=None, **job_options):
+        job_config = bigquery().QueryJobConfig(**job_options)
+        if query_parameters:
+            job_config.query_parameters = [cls.query_parameter(name, value)
+                                           for name, value in sorted(query_parameters.items())]
+        return job_config
+
+    # BigQuery query parameter for a python value
+    # Lists are ARRAY parameters typed after their first element
+    @classmethod
+    def query_parameter(cls, name, value):
+        if isinstance(value, (list, tuple)):
+            item_type = cls.parameter_type(value[0]) if value else 'STRING'
+            return bigquery().ArrayQueryParameter(name, item_type, list(value))
+        return bigquery().ScalarQueryParameter(name, cls.parameter_type(value), value)
+
+    @staticmethod
+    def parameter_type(value) -> str:
+        if isinstance(value, bool):
+            return 'BOOL'
+        if isinstance(value, int):
+            return 'INT64'
+        if isinstance(value, float):
+            return 'FLOAT64'
+        if isinstance(value, datetime.datetime):
+            return 'DATETIME'
+        if isinstance(value, datetime.date):
+            return 'DATE'
+        return 'STRING'
 
     def close_connection(self):
-        if self.initialized():
+        self.close_executor()
+        if self.client is not None:
             self.client.close()
+        if self.storage_client is not None:
+            self.storage_client.transport.close()
+            self.storage_client = None
+
+    # Pre-fork worker: the client and its HTTP connections belong to the parent process, not closed here
+    # A new client is built on first use, as with BQ_LAZY_CLIENT
+    def after_fork(self):
+        super().after_fork()
+        self.lock = threading.Lock()
+        self.storage_client = None
+        if self.client is not None and self.app is not None:
+            self.client = None
+            self.lazy = True
 
     # Validates whether an app can be integrated with gbq_manager
     @staticmethod
@@ -0,0 +1,106 @@
+import threading
+
+from gbq_manager.circuit_breaker import CircuitBreaker
+from gbq_manager.executor import QueryExecutor, DEFAULT_MAX_JOBS
+
+# BigQuery backend interface used by AppBQContentManager
+# GBQManager runs query jobs in BigQuery
+# FakeBQManager runs them in process, for tests and benchmarks without Google Cloud access
+
+executor_lock = threading.Lock()
+
+
+class BQBackend:
+    # Bounded concurrency executor shared by every job of the backend, see gbq_manager/executor.py
+    # BQ_MAX_CONCURRENT_JOBS: max jobs in flight, BQ_JOB_PRIORITIES: "key:priority,..." (lower runs first)
+    executor = None
+    max_jobs = DEFAULT_MAX_JOBS
+    job_priorities = None
+    # Circuit breaker shared by every job of the backend, see gbq_manager/circuit_breaker.py
+    # BQ_BREAKER_FAILURES: consecutive failures opening it, BQ_BREAKER_RESET_TIMEOUT: seconds before a probe job
+    breaker = None
+    breaker_failures = 5
+    breaker_reset_timeout = 30
+
+    # Link backend to an app: any object with a 'config' dictionary
+    def init_app(self, app):
+        raise NotImplementedError
+
+    # Backend ready to run query jobs
+    def initialized(self) -> bool:
+        raise NotImplementedError
+
+    # Builds connections of backends initialized lazily, returns True if ready to run query jobs
+    # Called from a startup background task, so the first request does not wait for it
+    def connect(self) -> bool:
+        return self.initialized()
+
+    # Starts a query job with named query parameters
+    # The job provides job_id, done(), result(timeout) and cancel(), as google.cloud.bigquery.QueryJob
+    def query(self, sql_query, query_parameters=None, **job_options):
+        raise NotImplementedError
+
+    # Dry-runs a query: validates it and returns its estimated bytes processed, no bytes billed
+    def dry_run(self, sql_query, query_parameters=None) -> int:
+        raise NotImplementedError
+
+    # Last modification time of a table (project.dataset.table), seconds since epoch, None if it does not exist
+    def table_modified(self, table_id):
+        raise NotImplementedError
+
+    # Waits for a query job and returns its rows as a list of dictionaries
+    def fetch_rows(self, query_job, timeout=None) -> list:
+        raise NotImplementedError
+
+    # Waits for a query job and yields its rows page by page, each page a list of dictionaries
+    # Default: a single page with all rows
+    def iter_pages(self, query_job, timeout=None, page_size=None):
+        yield self.fetch_rows(query_job, timeout=timeout)
+
+    # Job concurrency settings of an app, before the executor is created
+    def configure_jobs(self, app):
+        self.max_jobs = app.config.get('BQ_MAX_CONCURRENT_JOBS') or self.max_jobs
+        self.job_priorities = app.config.get('BQ_JOB_PRIORITIES') or self.job_priorities
+        self.breaker_failures = app.config.get('BQ_BREAKER_FAILURES') or self.breaker_failures
+        self.breaker_reset_timeout = app.config.get('BQ_BREAKER_RESET_TIMEOUT') or self.breaker_reset_timeout
+        self.breaker = None
+
+    def get_executor(self) -> QueryExecutor:
+        if self.executor is None:
+            with executor_lock:
+                if self.executor is None:
+                    self.executor = QueryExecutor(self, max_jobs=self.max_jobs, priorities=self.job_priorities)
+        return self.executor
+
+    def get_breaker(self) -> CircuitBreaker:
+        if self.breaker is None:
+            with executor_lock:
+                if self.breaker is None:
+                    self.breaker = CircuitBreaker(failure_threshold=self.breaker_failures,
+                                                  reset_timeout=self.breaker_reset_timeout)
+        return self.breaker
+
+    # Runs a query job within the concurrency limit, returns a concurrent.futures.Future of its rows
+    # key: query key for per key priority, priority: explicit priority
+    def submit(self, sql_query, query_parameters=None, key=None, priority=None, timeout=None, **job_options):
+        return self.get_executor().submit(sql_query, query_parameters, key=key, priority=priority,
+                                          timeout=timeout, **job_options)
+
+    # Same as submit, returns an awaitable
+    def submit_async(self, sql_query, query_parameters=None, key=None, priority=None, timeout=None, **job_options):
+        return self.get_executor().submit_async(sql_query, query_parameters, key=key, priority=priority,
+                                                timeout=timeout, **job_options)
+
+    def close_connection(self):
+        self.close_executor()
+
+    # Called in a worker process forked from the process that used the backend (pre-fork workers)
+    # Executor threads do not survive fork: executor and breaker created again on first use
+    def after_fork(self):
+        self.executor = None
+        self.breaker = None
+
+    def close_executor(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -0,0 +1,86 @@
+import threading
+import time
+
+# Circuit breaker for BigQuery jobs
+# closed: jobs run. After failure_threshold consecutive job failures the breaker opens
+# open: no job runs, callers fail fast (or serve the last data they have) for reset_timeout seconds
+# half_open: one probe job every reset_timeout seconds. Its success closes the breaker, its failure opens it again
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+
+def is_backend_failure(exception) -> bool:
+    # Failures telling BigQuery is unhealthy: server errors, rate limits, timeouts, connection errors
+    # Errors in the request (invalid query, bytes billed limit exceeded, permissions) do not count
+    code = getattr(exception, 'code', None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code == 429
+    return True
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.next_probe_at = None
+        # Counters
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        # True if a job can run now. In half-open state, True for the probe job only
+        with self.lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            now = time.time()
+            if now >= self.next_probe_at:
+                # A probe lost without outcome (e.g. cancelled) only delays the next one
+                self.state = BREAKER_HALF_OPEN
+                self.next_probe_at = now + self.reset_timeout
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            if self.state != BREAKER_CLOSED:
+                self.state = BREAKER_CLOSED
+                self.opened_at = None
+                self.next_probe_at = None
+
+    def record_failure(self, exception=None):
+        if exception is not None and not is_backend_failure(exception):
+            # BigQuery answered: healthy
+            self.record_success()
+            return
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED
+                                                   and self.consecutive_failures >= self.failure_threshold):
+                self.state = BREAKER_OPEN
+                self.opened_at = time.time()
+                self.next_probe_at = self.opened_at + self.reset_timeout
+                self.trips += 1
+
+    def retry_after(self) -> float:
+        # Seconds until the next job may run, 0 when closed
+        with self.lock:
+            if self.state == BREAKER_CLOSED:
+                return 0.0
+            return max(0.0, self.next_probe_at - time.time())
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'state': self.state, 'consecutive_failures': self.consecutive_failures,
+                    'failures': self.failures, 'rejected': self.rejected, 'trips': self.trips,
+                    'opened_at': self.opened_at, 'next_probe_at': self.next_probe_at}
@@ -0,0 +1,215 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import logging
+import threading
+
+# Bounded concurrency query executor
+# At most max_jobs query jobs of a process run at the same time, whoever runs them:
+# jobs submitted for futures or awaitables, and jobs run by callers holding a job slot (sync or async)
+# Jobs waiting for a slot are started by priority (lower first), then in arrival order
+# Priority: explicit per job, or per query key (content registry key) from priorities, default PRIORITY_NORMAL
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+DEFAULT_MAX_JOBS = 8
+
+
+def parse_priorities(value) -> dict:
+    # Per key priorities from a "key:priority,key:priority" string, or a dictionary
+    if isinstance(value, dict):
+        return {key: int(priority) for key, priority in value.items()}
+    priorities = {}
+    for item in (value or '').split(','):
+        key, _, priority = item.rpartition(':')
+        if key.strip() and priority.strip():
+            priorities[key.strip()] = int(priority)
+    return priorities
+
+
+class SlotWaiter:
+    # A caller waiting for a job slot. A slot is granted once, unless the caller gave up waiting
+
+    def __init__(self, wake, cancel=None):
+        self.wake = wake
+        self.cancel = cancel
+        self.lock = threading.Lock()
+        self.granted = False
+        self.abandoned = False
+
+    def grant(self) -> bool:
+        with self.lock:
+            if self.abandoned:
+                return False
+            self.granted = True
+        self.wake()
+        return True
+
+    def abandon(self) -> bool:
+        # Returns True if a slot was granted meanwhile, to be released by the caller
+        with self.lock:
+            self.abandoned = True
+            return self.granted
+
+
+class QueryExecutor:
+
+    def __init__(self, backend, max_jobs=DEFAULT_MAX_JOBS, priorities=None):
+        self.backend = backend
+        self.max_jobs = max(1, int(max_jobs or DEFAULT_MAX_JOBS))
+        self.priorities = parse_priorities(priorities)
+        self.lock = threading.Lock()
+        # Heap of (priority, sequence, waiter)
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'queued': 0}
+        # Submitted jobs run in these threads, only once they hold a slot: never more threads busy than slots
+        self.threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_jobs,
+                                                             thread_name_prefix='bq-job')
+
+    def priority(self, key=None, priority=None) -> int:
+        if priority is not None:
+            return priority
+        return self.priorities.get(key, PRIORITY_NORMAL)
+
+    # Job slots
+
+    def request_slot(self, priority, waiter):
+        with self.lock:
+            if self.in_flight < self.max_jobs and not self.waiting:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            else:
+                heapq.heappush(self.waiting, (priority, next(self.sequence), waiter))
+                self.counters['queued'] += 1
+                return
+        waiter.grant()
+
+    def release(self):
+        # Hands the slot over to the next waiter, frees it if nobody waits
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    self.in_flight -= 1
+                    return
+                waiter = heapq.heappop(self.waiting)[2]
+            if waiter.grant():
+                return
+
+    def acquire(self, key=None, priority=None):
+        # Blocks the calling thread until a job slot is available
+        event = threading.Event()
+        self.request_slot(self.priority(key, priority), SlotWaiter(event.set))
+        event.wait()
+
+    async def acquire_async(self, key=None, priority=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        waiter = SlotWaiter(wake)
+        self.request_slot(self.priority(key, priority), waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if waiter.abandon():
+                self.release()
+            raise
+
+    @contextlib.contextmanager
+    def slot(self, key=None, priority=None):
+        self.acquire(key, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self, key=None, priority=None):
+        await self.acquire_async(key, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # Futures API
+
+    def submit_call(self, function, args=(), key=None, priority=None):
+        # Runs function(*args) in an executor thread once a slot is available, returns a concurrent.futures.Future
+        # A future cancelled while waiting for a slot never runs
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.counters['submitted'] += 1
+
+        def start():
+            if not future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.counters['cancelled'] += 1
+                self.release()
+                return
+            self.threads.submit(self.run, future, function, args)
+        self.request_slot(self.priority(key, priority), SlotWaiter(start, cancel=future.cancel))
+        return future
+
+    def submit(self, sql_query, query_parameters=None, key=None, priority=None, timeout=None, **job_options):
+        # Runs a query job once a slot is available, returns a concurrent.futures.Future of its rows
+        return self.submit_call(self.run_job, (sql_query, query_parameters, timeout, job_options),
+                                key=key, priority=priority)
+
+    def submit_async(self, sql_query, query_parameters=None, key=None, priority=None, timeout=None, **job_options):
+        # Same as submit, called from the event loop: returns an awaitable
+        return asyncio.wrap_future(self.submit(sql_query, query_parameters, key=key, priority=priority,
+                                               timeout=timeout, **job_options))
+
+    def map(self, queries, priority=None, timeout=None) -> list:
+        # Submits (key, sql_query, query_parameters) tuples, returns their futures in the same order
+        return [self.submit(sql_query, query_parameters, key=key, priority=priority, timeout=timeout)
+                for key, sql_query, query_parameters in queries]
+
+    def run(self, future, function, args):
+        try:
+            result = function(*args)
+        except Exception as e:
+            with self.lock:
+                self.counters['failed'] += 1
+            future.set_exception(e)
+        else:
+            with self.lock:
+                self.counters['completed'] += 1
+            future.set_result(result)
+        finally:
+            self.release()
+
+    def run_job(self, sql_query, query_parameters, timeout, job_options):
+        query_job = self.backend.query(sql_query, query_parameters, **job_options)
+        try:
+            return self.backend.fetch_rows(query_job, timeout=timeout)
+        except Exception:
+            # Best effort: do not keep paying for a job nobody will read, e.g. after a timeout
+            try:
+                query_job.cancel()
+            except Exception as e:
+                logging.log(level=logging.WARNING,
+                            msg="Exception {}:{} Method: {}".format(e.__class__, e, self.run_job.__name__))
+            raise
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, max_jobs=self.max_jobs, in_flight=self.in_flight,
+                        max_in_flight=self.max_in_flight, waiting=len(self.waiting))
+
+    def shutdown(self, wait=True):
+        # Submitted jobs still waiting for a slot are cancelled
+        with self.lock:
+            waiting, self.waiting = self.waiting, []
+        for priority, sequence, waiter in waiting:
+            if not waiter.abandon() and waiter.cancel is not None:
+                waiter.cancel()
+        self.threads.shutdown(wait=wait)
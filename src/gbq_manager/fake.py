@@ -0,0 +1,208 @@
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+
+from gbq_manager.backend import BQBackend
+
+# Tables created by DDL statements get a new modification time
+DDL_TABLE_PATTERN = re.compile(r'CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+`([^`]+)`', re.IGNORECASE)
+
+
+class InvalidQuery(Exception):
+    # Same status code as the BadRequest errors raised by BigQuery for invalid queries
+    code = 400
+
+
+class FakeQueryJob:
+    # In process query job, done after the backend simulated latency
+    # fail: None, or the error message the job fails with
+
+    def __init__(self, backend, job_id, sql_query, query_parameters, latency, fail, bytes_processed):
+        self.backend = backend
+        self.job_id = job_id
+        self.sql_query = sql_query
+        self.query_parameters = query_parameters
+        self.started = time.monotonic()
+        self.latency = latency
+        self.fail = fail
+        self.cancelled = False
+        self.rows = None
+        # Statistics reported by BigQuery jobs
+        self.total_bytes_processed = bytes_processed
+        self.total_bytes_billed = bytes_processed if not fail else 0
+        self.finished = False
+
+    def done(self, *args, **kwargs) -> bool:
+        if self.cancelled or time.monotonic() - self.started >= self.latency:
+            self.finish()
+            return True
+        return False
+
+    def finish(self):
+        with self.backend.lock:
+            if not self.finished:
+                self.finished = True
+                self.backend.in_flight -= 1
+
+    def result(self, timeout=None, *args, **kwargs):
+        remaining = self.latency - (time.monotonic() - self.started)
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Fake job {} not done after {}s".format(self.job_id, timeout))
+        if remaining > 0:
+            time.sleep(remaining)
+        self.finish()
+        if self.cancelled:
+            raise RuntimeError("Fake job {} cancelled".format(self.job_id))
+        if self.fail:
+            raise RuntimeError("{} in job {}".format(self.fail, self.job_id))
+        if self.rows is None:
+            self.rows = self.backend.rows_for(self.sql_query, self.query_parameters)
+        return self.rows
+
+    def cancel(self, *args, **kwargs):
+        with self.backend.lock:
+            if not self.cancelled:
+                self.cancelled = True
+                self.backend.cancelled += 1
+        return True
+
+
+class FakeBQManager(BQBackend):
+    # In process BigQuery backend returning canned rows
+    # rows: callable (sql_query, query_parameters) -> list of dictionaries, or a list returned for every query
+    #       default: one row with a hash of the query and its parameters
+    # latency: simulated job duration in seconds
+    # failure_rate: fraction of jobs failing when their result is requested
+    # bytes_per_job: bytes processed by every job, or callable (sql_query, query_parameters) -> bytes
+    #                raising InvalidQuery for queries BigQuery would reject
+    # tables: table id -> modification time (seconds since epoch), updated by CREATE TABLE statements
+    # connect_latency: simulated client construction time (credentials discovery), on init_app
+    #                  or on first use with app.config['BQ_LAZY_CLIENT'], as GBQManager
+
+    def __init__(self, rows=None, latency=0.0, failure_rate=0.0, bytes_per_job=10 * 1024 * 1024, seed=None,
+                 connect_latency=0.0):
+        self.app = None
+        self.connect_latency = connect_latency
+        self.connected = False
+        self.rows = rows
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bytes_per_job = bytes_per_job
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        # Counters
+        self.jobs = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.dry_runs = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queries = []
+        self.tables = {}
+
+    def init_app(self, app):
+        self.app = app
+        self.configure_jobs(app)
+        if not app.config.get('BQ_LAZY_CLIENT', False):
+            self.connect()
+
+    def connect(self) -> bool:
+        with self.lock:
+            if not self.connected:
+                time.sleep(self.connect_latency)
+                self.connected = True
+        return True
+
+    def initialized(self) -> bool:
+        return True
+
+    def after_fork(self):
+        super().after_fork()
+        self.lock = threading.Lock()
+
+    def query(self, sql_query, query_parameters=None, **job_options):
+        self.connect()
+        if job_options.get('dry_run'):
+            return self.dry_run_job(sql_query, query_parameters)
+        bytes_processed = self.bytes_for(sql_query, query_parameters or {})
+        maximum_bytes_billed = job_options.get('maximum_bytes_billed')
+        with self.lock:
+            self.jobs += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = None
+            if maximum_bytes_billed is not None and bytes_processed > maximum_bytes_billed:
+                fail = "Query exceeded limit for bytes billed: {}".format(maximum_bytes_billed)
+            elif self.random.random() < self.failure_rate:
+                fail = "Simulated BigQuery failure"
+            if fail:
+                self.failures += 1
+            self.queries.append((sql_query, dict(query_parameters or {})))
+            job_id = 'fake-job-{}'.format(next(self.job_ids))
+            if not fail:
+                # Scripts may create several tables
+                for ddl_table in DDL_TABLE_PATTERN.finditer(sql_query):
+                    self.tables[ddl_table.group(1)] = time.time()
+        return FakeQueryJob(self, job_id, sql_query, query_parameters or {}, self.latency, fail, bytes_processed)
+
+    def iter_pages(self, query_job, timeout=None, page_size=None):
+        rows = query_job.result(timeout=timeout)
+        page_size = page_size or 1000
+        for start in range(0, len(rows), page_size):
+            yield [dict(row) for row in rows[start:start + page_size]]
+
+    def dry_run_job(self, sql_query, query_parameters=None):
+        # Done at once, no rows, statistics only
+        with self.lock:
+            self.dry_runs += 1
+            self.in_flight += 1
+            job_id = 'fake-dry-run-{}'.format(next(self.job_ids))
+        query_job = FakeQueryJob(self, job_id, sql_query, query_parameters or {}, 0.0, None,
+                                 self.bytes_for(sql_query, query_parameters or {}))
+        query_job.total_bytes_billed = 0
+        query_job.finish()
+        return query_job
+
+    def dry_run(self, sql_query, query_parameters=None) -> int:
+        return self.dry_run_job(sql_query, query_parameters).total_bytes_processed
+
+    def table_modified(self, table_id):
+        return self.tables.get(table_id)
+
+    def bytes_for(self, sql_query, query_parameters):
+        if callable(self.bytes_per_job):
+            return self.bytes_per_job(sql_query, query_parameters)
+        return self.bytes_per_job
+
+    def fetch_rows(self, query_job, timeout=None) -> list:
+        return [dict(row) for row in query_job.result(timeout=timeout)]
+
+    def rows_for(self, sql_query, query_parameters):
+        if callable(self.rows):
+            return self.rows(sql_query, query_parameters)
+        if self.rows is not None:
+            return self.rows
+        digest = hashlib.sha1(sql_query.encode('utf-8')).hexdigest()[:12]
+        row = {'query': digest}
+        row.update({name: value if isinstance(value, (str, int, float)) else str(value)
+                    for name, value in query_parameters.items()})
+        return [row]
+
+    def reset(self):
+        with self.lock:
+            self.jobs = 0
+            self.failures = 0
+            self.cancelled = 0
+            self.dry_runs = 0
+            self.max_in_flight = self.in_flight
+            self.queries = []
+
+    def stats(self):
+        with self.lock:
+            return {'jobs': self.jobs, 'failures': self.failures, 'cancelled': self.cancelled,
+                    'dry_runs': self.dry_runs, 'in_flight': self.in_flight, 'max_in_flight': self.max_in_flight}
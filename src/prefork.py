@@ -0,0 +1,167 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+import uvicorn
+
+from gbq_content_manager import AppBQContentManager
+from gbq_content_manager.generations import ContentGenerations
+
+# Pre-fork multi-worker server, WEB_CONCURRENCY > 1
+# The parent process loads every registered content once, then forks the workers on a shared listening socket:
+# workers start with a warm cache, its memory pages shared copy-on-write with the parent and the other workers
+# The parent does not serve requests. It restarts workers that exit, and every CONTENT_GENERATION_REFRESH_INTERVAL
+# seconds loads again the contents gone stale and publishes them to the workers, see generations module
+# Refreshes run in a background thread, one at a time: workers are reaped and restarted while BigQuery jobs run
+# Workers only run BigQuery jobs for contents the parent has not loaded (parameters outside the registry lists)
+# Requires os.fork: Linux, macOS
+
+
+class PreforkServer:
+
+    def __init__(self, app, host='0.0.0.0', port=8080, workers=2, log_level='info'):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.log_level = log_level
+        self.content_manager = AppBQContentManager()
+        self.generations = ContentGenerations(app.config.get('CONTENT_GENERATION_PATH') or None,
+                                              interval=app.config.get('CONTENT_GENERATION_CHECK_INTERVAL', 1.0))
+        self.refresh_interval = app.config.get('CONTENT_GENERATION_REFRESH_INTERVAL', 60.0)
+        self.socket = None
+        # Worker pid -> start time
+        self.children = {}
+        self.stopping = False
+        self.published_at = 0.0
+        self.next_source_check = 0.0
+        self.refresh_thread = None
+
+    def bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def preload(self):
+        content_manager = self.content_manager
+        start = time.time()
+        content_manager.bq.connect()
+        loaded = content_manager.preload()
+        self.publish()
+        self.next_source_check = time.time() + content_manager.sources.interval
+        logging.log(level=logging.INFO, msg="Preloaded {} contents in {:.1f}s".format(loaded, time.time() - start))
+
+    def publish(self):
+        # New generation when contents were loaded since the last one
+        latest = max((local_content.loaded_at for _, local_content in self.content_manager.contents.items()
+                      if local_content.rows is not None), default=0.0)
+        if latest > self.published_at:
+            generation = self.content_manager.publish_generation(self.generations)
+            self.published_at = latest
+            logging.log(level=logging.INFO, msg="Published content generation {}".format(generation))
+
+    def refresh(self):
+        try:
+            check_sources = time.time() >= self.next_source_check
+            if check_sources:
+                self.next_source_check = time.time() + self.content_manager.sources.interval
+            self.content_manager.refresh_stale_contents(check_sources=check_sources)
+            self.publish()
+        except Exception as e:
+            logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                     self.refresh.__name__))
+
+    def start_refresh(self) -> bool:
+        # Skipped while the previous refresh is running, returns True if started
+        if self.refresh_thread is not None and self.refresh_thread.is_alive():
+            return False
+        self.refresh_thread = threading.Thread(target=self.refresh, name='content-generation-refresh', daemon=True)
+        self.refresh_thread.start()
+        return True
+
+    def spawn(self):
+        # Objects of the parent moved out of garbage collections: collections in workers do not write their pages
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.run_worker()
+            except BaseException as e:
+                code = 1
+                logging.log(level=logging.ERROR, msg="Exception {}:{} Method: {}".format(e.__class__, e,
+                                                                                         self.run_worker.__name__))
+            finally:
+                os._exit(code)
+        self.children[pid] = time.time()
+        return pid
+
+    def run_worker(self):
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.content_manager.after_fork(self.generations)
+        server = uvicorn.Server(uvicorn.Config(self.app, log_level=self.log_level))
+        server.run(sockets=[self.socket])
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        # Workers that exited are replaced, unless the server is stopping
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            self.children.pop(pid, None)
+            if not self.stopping:
+                logging.log(level=logging.WARNING, msg="Worker {} exited with status {}, restarted".format(
+                    pid, os.waitstatus_to_exitcode(status)))
+                self.spawn()
+
+    def terminate(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+
+    def run(self):
+        self.socket = self.bind()
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        try:
+            self.preload()
+            for _ in range(self.workers):
+                self.spawn()
+            next_refresh = time.time() + self.refresh_interval
+            while not self.stopping:
+                self.reap()
+                if time.time() >= next_refresh:
+                    self.start_refresh()
+                    next_refresh = time.time() + self.refresh_interval
+                time.sleep(0.5)
+        finally:
+            self.terminate()
+            # A refresh still running would publish to the removed directory: waited for a while
+            if self.refresh_thread is not None:
+                self.refresh_thread.join(timeout=10)
+            self.socket.close()
+            self.generations.remove()
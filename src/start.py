@@ -3,10 +3,16 @@ import os
 from uvicorn import run
 from uvicorn import run
 from app import create_app
+from prefork import PreforkServer
 
 app = create_app()
 
 if __name__ == '__main__':
     server_port = os.environ.get('PORT', '8080')
-    run(app=app, host='0.0.0.0', port=int(server_port))
+    workers = app.config.get('WEB_CONCURRENCY', 1)
+    if workers > 1:
+        # Workers forked with the contents loaded by this process, see prefork module
+        PreforkServer(app, host='0.0.0.0', port=int(server_port), workers=workers).run()
+    else:
+        run(app=app, host='0.0.0.0', port=int(server_port))
 
@@ -0,0 +1,28 @@
+import json
+import sys
+
+from app import create_app
+from gbq_content_manager import AppBQContentManager
+from gbq_content_manager.query_costs import QUERY_OK
+
+# Deploy time check of registered queries: dry-runs every query with representative parameters
+# Prints estimated bytes processed and status per query, exits with status 1 if any query
+# is invalid or would not be run (over budget with reject policy)
+# Usage, from src folder: python validate_queries.py
+
+if __name__ == '__main__':
+    app = create_app()
+    bq_cm = AppBQContentManager()
+    if not bq_cm.bq.initialized():
+        print("BigQuery client not initialized, check BQ_SA_KEY_JSON_FILE", file=sys.stderr)
+        sys.exit(2)
+    statuses = bq_cm.validate_queries()
+    results = bq_cm.query_costs.results()
+    print(json.dumps(results, indent=2, sort_keys=True))
+    failed = sorted(key for key, estimate in results.items() if not estimate['allowed'])
+    if failed:
+        print("Rejected queries: {}".format(', '.join(failed)), file=sys.stderr)
+        sys.exit(1)
+    flagged = sorted(key for key, status in statuses.items() if status != QUERY_OK)
+    if flagged:
+        print("Flagged queries: {}".format(', '.join(flagged)), file=sys.stderr)
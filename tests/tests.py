@@ -1,9 +1,36 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 import warnings
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.bigquery.table import Row
 
 # App specific imports
+from app import create_app
 from config import TestConfig
 from gbq_manager import GBQManager
+from gbq_manager.fake import FakeBQManager, InvalidQuery
+from gbq_content_manager import AppBQContentManager, BigQueryContent, snapshot
+from gbq_content_manager import encoding
+from gbq_content_manager.columnar import ColumnarRows
+from gbq_content_manager.cache import ContentCache, BoundedContentCache, LFU
+from gbq_content_manager.shared_cache import SQLiteContentStore
+from gbq_content_manager.query_templates import SOURCE_TABLE
+from gbq_content_manager.aggregate import rewrite_templates
+from gbq_content_manager.query_costs import QueryCostRegistry, MIN_BYTES_BILLED, DEFAULT_BYTES_BILLED
+from gbq_content_manager.single_flight import SingleFlight
+from gbq_content_manager.source_versions import SourceVersions
+from gbq_content_manager.admission import MissAdmission, AdmissionRejected
+from gbq_content_manager.generations import ContentGenerations
+from prefork import PreforkServer
 
 # Config import
 
@@ -53,6 +80,879 @@ class GBQManagerModelCase(unittest.TestCase):
         self.assertIsNotNone(self.bq.app)
         self.assertTrue(self.bq.initialized())
 
+    def test_3_http_pool_size(self):
+        # Client built with our authorized session, its pool sized for the job limit
+        self.bq.max_jobs = 12
+        with mock.patch('google.auth.default', return_value=(AnonymousCredentials(), 'test-project')):
+            client = self.bq.create_client("")
+        self.assertIsNotNone(client)
+        self.assertEqual(client.project, 'test-project')
+        adapter = client._http.get_adapter('https://bigquery.googleapis.com/bigquery/v2/projects')
+        self.assertEqual(adapter._pool_maxsize, 16)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 16)
+        self.bq.http_pool_size = 32
+        adapter = self.bq.http_session(AnonymousCredentials()).get_adapter('https://bigquery.googleapis.com')
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 32)
+
+
+class ContentManagerCase(unittest.TestCase):
+    # Content manager with an in process fake BigQuery backend, no Google Cloud access needed
+    def setUp(self):
+        self.app = MockFSOApp(config_class=TestConfig)
+        self.bq = FakeBQManager(latency=0.05)
+        self.cm = AppBQContentManager()
+        self.cm.init_app(self.app, bq=self.bq)
+        self.cm.contents = ContentCache()
+        self.cm.shared_contents = None
+        self.cm.single_flight = SingleFlight()
+        self.cm.poll_initial_delay = 0.01
+        self.cm.swr = False
+        self.cm.hard_ttl = None
+        self.cm.metrics.clear()
+        self.cm.aggregate_table = None
+        self.cm.aggregate_ready = False
+        self.cm.sources = SourceVersions(interval=600)
+
+    def age_contents(self, days=1):
+        for content_key, content in self.cm.contents.items():
+            content.last_run = content.last_run - datetime.timedelta(days=days)
+            content.loaded_at = content.loaded_at - days * 24 * 3600
+
+    def wait_refresh(self, content_key):
+        # Background refresh done: content loaded today
+        for _ in range(50):
+            if self.cm.contents.peek(content_key).last_run == datetime.date.today():
+                break
+            threading.Event().wait(0.05)
+
+    def test_0_load_content_cached(self):
+        data = self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(data[0]['country'], 'Spain')
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='Spain'), data)
+        self.assertEqual(self.bq.jobs, 1)
+
+    def test_1_load_content_async(self):
+        async def load():
+            # Cache miss polled without blocking the event loop: the cache hit is served meanwhile
+            miss = asyncio.create_task(self.cm.load_content_async(key='get_country_summary', country='France'))
+            await asyncio.sleep(0)
+            start = time.perf_counter()
+            hit = await self.cm.load_content_async(key='get_countries')
+            return time.perf_counter() - start, hit, await miss
+        self.cm.load_content(key='get_countries')
+        self.bq.latency = 0.3
+        hit_seconds, hit, miss = asyncio.run(load())
+        self.assertLess(hit_seconds, 0.1)
+        self.assertIn('get_countries', self.cm.contents)
+        self.assertEqual(miss[0]['country'], 'France')
+        self.assertEqual(self.bq.jobs, 2)
+
+    def test_2_job_timeout(self):
+        # Jobs not done within the timeout are cancelled, no data
+        self.addCleanup(setattr, self.cm, 'job_timeout', self.cm.job_timeout)
+        self.cm.job_timeout = 0.1
+        self.bq.latency = 1.0
+        self.assertIsNone(asyncio.run(self.cm.load_content_async(key='get_country_summary', country='Italy')))
+        self.assertEqual(self.bq.cancelled, 1)
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='Italy'))
+
+    def test_3_coalesce_threads(self):
+        self.bq.latency = 0.2
+        threads = [threading.Thread(target=self.cm.load_content, args=('get_countries',)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.bq.jobs, 1)
+        self.assertEqual(self.cm.stats()['single_flight']['coalesced'], 9)
+
+    def test_4_coalesce_async(self):
+        async def load():
+            return await asyncio.gather(*[self.cm.load_content_async(key='get_country_evolution', country='Spain')
+                                          for _ in range(10)])
+        results = asyncio.run(load())
+        self.assertEqual(self.bq.jobs, 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    def test_5_stale_while_revalidate(self):
+        self.cm.swr = True
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.age_contents()
+        self.bq.latency = 0.2
+        start = time.perf_counter()
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        # Stale content served at once, refreshed in background
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertLess(self.cm.contents.peek('get_country_summary@Spain').last_run, datetime.date.today())
+        self.wait_refresh('get_country_summary@Spain')
+        self.assertEqual(self.bq.jobs, 2)
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Spain').last_run, datetime.date.today())
+        # Past the hard TTL: refreshed inline
+        self.cm.hard_ttl = 3600
+        self.age_contents()
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Spain').last_run, datetime.date.today())
+        self.assertEqual(self.bq.jobs, 3)
+
+    def test_6_prefresh_hot_contents(self):
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.cm.load_content(key='get_country_summary', country='France')
+        for _ in range(self.cm.prefresh_min_hits):
+            self.cm.load_content(key='get_country_summary', country='Spain')
+        self.age_contents()
+        # Only the hot content is refreshed ahead of requests
+        self.assertEqual(self.cm.prefresh_hot_contents(), ['get_country_summary@Spain'])
+        self.wait_refresh('get_country_summary@Spain')
+        self.assertEqual(self.bq.jobs, 3)
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Spain').last_run, datetime.date.today())
+
+    def test_7_bounded_cache(self):
+        self.cm.contents = BoundedContentCache(max_entries=2)
+        for country in ('Spain', 'France', 'Italy'):
+            self.cm.load_content(key='get_country_summary', country=country)
+        self.assertEqual(self.cm.contents.keys(), ['get_country_summary@France', 'get_country_summary@Italy'])
+        self.assertEqual(self.cm.contents.stats()['evictions'], 1)
+        # Least frequently used evicted, even if more recently used
+        self.cm.contents = BoundedContentCache(max_entries=2, policy=LFU)
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.cm.load_content(key='get_country_summary', country='France')
+        self.cm.load_content(key='get_country_summary', country='Italy')
+        self.assertEqual(self.cm.contents.keys(), ['get_country_summary@Spain', 'get_country_summary@Italy'])
+        # Expired entries are misses
+        self.cm.contents = BoundedContentCache(ttl=0.05)
+        self.cm.contents.put('key', 'value')
+        time.sleep(0.1)
+        self.assertIsNone(self.cm.contents.get('key'))
+        self.assertEqual(self.cm.contents.stats()['expirations'], 1)
+
+    def test_8_shared_cache_tier(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.cm.shared_contents = SQLiteContentStore(os.path.join(tmp_dir, 'contents.db'))
+            data = self.cm.load_content(key='get_countries')
+            # Another worker: empty memory cache, content found in shared tier
+            self.cm.contents.clear()
+            self.assertEqual(self.cm.load_content(key='get_countries'), data)
+            self.assertEqual(self.bq.jobs, 1)
+            self.cm.shared_contents.close()
+
+    def test_9_canonical_content_keys(self):
+        self.cm.load_content(key='get_country_list_summary', country_list=['Spain', 'France'])
+        self.cm.load_content(key='get_country_list_summary', country_list=['France', ' Spain', 'Spain'])
+        self.assertEqual(self.bq.jobs, 1)
+        self.assertEqual(self.bq.queries[0][1], {'country_list': ['France', 'Spain']})
+        self.assertEqual(self.cm.contents.keys(), ['get_country_list_summary@France,Spain'])
+        with self.assertRaises(ValueError):
+            self.cm.load_content(key='get_country_closest_date', country='Spain', start_date='2021-02-30')
+
+    def test_10_prefetch_contents(self):
+        self.bq.rows = [{'bulk_country': 'Spain', 'total': 1}, {'bulk_country': 'France', 'total': 2}]
+        loaded = self.cm.prefetch_contents(keys=['get_country_summary'])
+        self.assertEqual(loaded, {'get_country_summary': 2})
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='France'), [{'total': 2}])
+        self.assertEqual(self.bq.jobs, 1)
+
+    @unittest.skipIf(snapshot.np is None, "numpy not installed")
+    def test_11_snapshot_contents(self):
+        rows = [{'country_region': 'Spain', 'province_state': 'Madrid', 'date': '2021-03-15',
+                 'confirmed': 200, 'deaths': 15},
+                {'country_region': 'Spain', 'province_state': 'Catalonia', 'date': '2021-03-15',
+                 'confirmed': 300, 'deaths': 25},
+                {'country_region': 'Spain', 'province_state': 'Madrid', 'date': '2021-02-15',
+                 'confirmed': 150, 'deaths': 12}]
+        content_snapshot = snapshot.ContentSnapshot.from_rows(rows)
+        self.assertEqual(content_snapshot.compute('get_country_summary', country='Spain'),
+                         [{'country_region': 'Spain', 'latest': '2021-03-15', 'total_confirmed': 500,
+                           'total_dead': 40, 'drate': 8.0}])
+        self.assertEqual(content_snapshot.compute('get_country_closest_date', country='Spain',
+                                                  start_date=datetime.date(2021, 3, 1)),
+                         [{'closest_available_date': '2021-02-15'}])
+
+    def test_12_decode_rows(self):
+        field_to_index = {'country_region': 0, 'total_confirmed': 1}
+        rows = iter([Row(('Spain', 500), field_to_index), Row(('France', 300), field_to_index)])
+        self.assertEqual(GBQManager.decode_rows(rows), [{'country_region': 'Spain', 'total_confirmed': 500},
+                                                        {'country_region': 'France', 'total_confirmed': 300}])
+
+        # Result iterators are read row by row, not converted through Arrow record batches
+        class RowIterator(list):
+            def to_arrow_iterable(self):
+                raise AssertionError('Arrow record batches used')
+        rows = RowIterator([Row(('Italy', 100), field_to_index)])
+        self.assertEqual(GBQManager.decode_rows(rows), [{'country_region': 'Italy', 'total_confirmed': 100}])
+
+    def test_13_metrics(self):
+        self.bq.failure_rate = 1.0
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='Spain'))
+        self.bq.failure_rate = 0.0
+        self.cm.contents.clear()
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        metrics = self.cm.metrics
+        self.assertEqual(metrics.content_requests.value('get_country_summary', 'miss'), 2)
+        self.assertEqual(metrics.content_requests.value('get_country_summary', 'hit'), 1)
+        self.assertEqual(metrics.bq_jobs.value('get_country_summary', 'ok'), 1)
+        self.assertEqual(metrics.bq_jobs.value('get_country_summary', 'error'), 1)
+        self.assertEqual(metrics.bq_job_duration.count('get_country_summary'), 2)
+        self.assertEqual(metrics.bq_bytes_billed.value('get_country_summary'), self.bq.bytes_per_job)
+        self.assertEqual(metrics.bq_rows.value('get_country_summary'), 1)
+        self.assertEqual(metrics.bq_in_flight.value(), 0)
+        text = metrics.render()
+        self.assertIn('bigquery_jobs_total{key="get_country_summary",outcome="ok"} 1', text)
+        self.assertIn('bigquery_job_duration_seconds_bucket{key="get_country_summary",le="+Inf"} 2', text)
+        self.assertIn('content_cache{stat="cache_entries"} 1', text)
+
+    def test_14_query_costs(self):
+        def bytes_per_job(sql_query, query_parameters):
+            if 'country_list' in query_parameters:
+                return 500 * MIN_BYTES_BILLED
+            if 'closest' in sql_query:
+                raise InvalidQuery("Syntax error")
+            return 2 * MIN_BYTES_BILLED
+        self.bq.bytes_per_job = bytes_per_job
+        self.cm.query_costs = QueryCostRegistry(budget=100 * MIN_BYTES_BILLED, policy='reject', factor=2)
+        statuses = self.cm.validate_queries()
+        self.assertEqual(statuses['get_country_summary'], 'ok')
+        self.assertEqual(statuses['get_country_latest_date_total'], 'ok')
+        self.assertEqual(statuses['get_country_list_summary'], 'over_budget')
+        self.assertEqual(statuses['get_country_closest_date'], 'invalid')
+        self.assertEqual(self.bq.jobs, 0)
+        # Over budget and invalid queries are never run
+        self.assertIsNone(self.cm.load_content(key='get_country_list_summary', country_list=['Spain']))
+        self.assertIsNone(self.cm.load_content(key='get_country_closest_date', country='Spain',
+                                               start_date='2021-01-01'))
+        self.assertEqual(self.bq.jobs, 0)
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(self.bq.jobs, 1)
+        self.assertEqual(self.cm.query_costs.maximum_bytes_billed('get_country_summary'), 4 * MIN_BYTES_BILLED)
+        # Jobs exceeding maximum_bytes_billed fail, not yet validated queries are capped by the budget
+        self.cm.query_costs.clear()
+        self.assertIsNone(self.cm.load_content(key='get_country_list_summary', country_list=['France']))
+        self.assertEqual(self.bq.failures, 1)
+
+    def test_15_aggregate_table(self):
+        aggregate_table = 'my-project.contents.summary_daily'
+        self.cm.aggregate_table = aggregate_table
+        self.cm.aggregate_sql_queries = rewrite_templates(self.cm.sql_queries, aggregate_table)
+        self.cm.aggregate_bulk_sql_queries = rewrite_templates(self.cm.bulk_sql_queries, aggregate_table, bulk=True)
+        self.bq.tables[SOURCE_TABLE] = time.time() - 60
+        self.assertTrue(self.cm.refresh_aggregate())
+        self.assertEqual(self.bq.jobs, 1)
+        self.assertIn('CREATE OR REPLACE TABLE `{}`'.format(aggregate_table), self.bq.queries[0][0])
+        self.assertIn('CREATE OR REPLACE TABLE `{}_by_country`'.format(aggregate_table), self.bq.queries[0][0])
+        # Hot per-country queries select precomputed rows of the country table
+        self.cm.load_content(key='get_country_evolution', country='Spain')
+        self.assertIn('`{}_by_country`'.format(aggregate_table), self.bq.queries[1][0])
+        self.assertNotIn('SUM(', self.bq.queries[1][0])
+        self.assertNotIn(SOURCE_TABLE, self.bq.queries[1][0])
+        self.cm.load_content(key='get_country_closest_date_total', country='Spain', start_date='2021-03-01')
+        self.assertIn('`{}_by_country`'.format(aggregate_table), self.bq.queries[2][0])
+        self.assertEqual(self.bq.queries[2][1], {'country': 'Spain', 'start_date': datetime.date(2021, 3, 1)})
+        # Territory queries read the territory table
+        self.cm.load_content(key='get_country_latest_date_total_by_territory', country='Spain')
+        self.assertIn('`{}`'.format(aggregate_table), self.bq.queries[3][0])
+        # Same parameters as the source table queries
+        for key, template in self.cm.aggregate_sql_queries.items():
+            self.assertEqual(template.parameters, self.cm.sql_queries[key].parameters)
+        for template in self.cm.aggregate_bulk_sql_queries.values():
+            self.assertIn('bulk_country', template.sql)
+            self.assertEqual(template.parameters, frozenset())
+        jobs = self.bq.jobs
+        # Built once per source table change, or when a table is missing
+        self.assertTrue(self.cm.refresh_aggregate())
+        self.assertEqual(self.bq.jobs, jobs)
+        self.bq.tables[SOURCE_TABLE] = time.time() + 60
+        self.assertTrue(self.cm.refresh_aggregate())
+        self.assertEqual(self.bq.jobs, jobs + 1)
+        self.bq.tables[SOURCE_TABLE] = time.time() - 60
+        self.assertTrue(self.cm.refresh_aggregate())
+        self.assertEqual(self.bq.jobs, jobs + 1)
+        del self.bq.tables[aggregate_table + '_by_country']
+        self.assertTrue(self.cm.refresh_aggregate())
+        self.assertEqual(self.bq.jobs, jobs + 2)
+        with self.assertRaises(ValueError):
+            rewrite_templates(self.cm.sql_queries, 'table`; DROP TABLE x')
+
+    def test_16_batch_contents(self):
+        def rows(sql_query, query_parameters):
+            if 'bulk_country' in sql_query:
+                return [{'bulk_country': 'Spain', 'total': 1}, {'bulk_country': 'France', 'total': 2}]
+            return [{'total': 0}]
+        self.bq.rows = rows
+        self.cm.load_content(key='get_countries')
+        items = [('get_country_summary', {'country': 'Spain'}), ('get_country_summary', {'country': 'France'}),
+                 ('get_countries', {}), ('get_country_summary', {}), ('unknown', {})]
+        results = asyncio.run(self.cm.get_contents_async(items))
+        # Cached content served, two countries of a per-country content loaded with one bulk query
+        self.assertEqual(self.bq.jobs, 2)
+        self.assertEqual(results[0][0], 'get_country_summary@Spain')
+        self.assertEqual(results[0][1].data, [{'total': 1}])
+        self.assertEqual(results[1][1].data, [{'total': 2}])
+        self.assertEqual(results[2][1].data, [{'total': 0}])
+        self.assertIsInstance(results[3][1], ValueError)
+        self.assertIsInstance(results[4][1], ValueError)
+
+    def test_17_stream_and_pages(self):
+        self.bq.rows = [{'territory': 'T{:03d}'.format(i)} for i in range(250)]
+
+        async def stream():
+            return [page async for page in self.cm.stream_content_async('get_country_territories', page_size=100,
+                                                                         country='Spain')]
+        pages = asyncio.run(stream())
+        self.assertEqual([len(page) for page in pages], [100, 100, 50])
+        # Streamed rows cached, served from memory next time
+        self.assertEqual(len(asyncio.run(stream())), 3)
+        self.assertEqual(self.bq.jobs, 1)
+        content = self.cm.get_content('get_country_territories', country='Spain')
+        rows, page_token = self.cm.content_page(content, 200)
+        self.assertEqual(len(rows), 200)
+        rows, next_page_token = self.cm.content_page(content, 200, page_token)
+        self.assertEqual(rows[0], {'territory': 'T200'})
+        self.assertIsNone(next_page_token)
+        content.data = content.data[:10]
+        with self.assertRaises(ValueError):
+            self.cm.content_page(content, 200, page_token)
+
+    def test_18_lazy_client_warm_up(self):
+        class LazyConfig(TestConfig):
+            settings = TestConfig.settings + ['BQ_LAZY_CLIENT', 'CONTENT_WARM_KEYS']
+            BQ_LAZY_CLIENT = True
+            CONTENT_WARM_KEYS = ['get_countries', 'unknown']
+        app = MockFSOApp(config_class=LazyConfig)
+        self.bq.init_app(app)
+        # No client built when linked to the app
+        self.assertFalse(self.bq.connected)
+        self.cm.init_app(app, bq=self.bq, contents=ContentCache())
+        self.assertEqual(self.cm.readiness_state()['status'], 'starting')
+        asyncio.run(self.cm.warm_up())
+        self.assertTrue(self.bq.connected)
+        self.assertEqual(self.cm.readiness_state()['status'], 'ready')
+        self.assertIsNotNone(self.cm.contents.peek('get_countries'))
+        self.assertEqual(self.bq.jobs, 1)
+        self.cm.warm_keys = ['get_countries']
+
+    def test_19_job_executor(self):
+        self.bq.max_jobs = 2
+        self.bq.latency = 0.05
+        futures = [self.bq.submit('SELECT {}'.format(i)) for i in range(6)]
+        self.assertEqual([len(future.result()) for future in futures], [1] * 6)
+        self.assertEqual(self.bq.max_in_flight, 2)
+        # Jobs waiting for a slot start by priority, then in arrival order
+        executor = self.bq.get_executor()
+        executor.acquire()
+        executor.acquire()
+        low = self.bq.submit('SELECT low', priority=20)
+        high = self.bq.submit('SELECT high', key='get_countries', priority=0)
+        normal = asyncio.run(self.run_released(executor, 'SELECT normal'))
+        low.result()
+        high.result()
+        self.assertEqual([query for query, parameters in self.bq.queries[-3:]],
+                         ['SELECT high', 'SELECT normal', 'SELECT low'])
+        self.assertEqual(len(normal), 1)
+        self.assertEqual(executor.stats()['in_flight'], 0)
+        self.assertEqual(executor.stats()['completed'], 9)
+
+    async def run_released(self, executor, sql_query):
+        awaitable = self.bq.submit_async(sql_query)
+        executor.release()
+        executor.release()
+        return await awaitable
+
+    def test_20_source_table_changes(self):
+        self.bq.tables[SOURCE_TABLE] = 1000.0
+        self.assertEqual(self.cm.check_sources(), [])
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Spain').source_version, 1000.0)
+        # Date rollover, source table unchanged: no job
+        self.age_contents()
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(self.cm.check_sources(), [])
+        self.assertEqual(self.bq.jobs, 1)
+        # Source table updated: contents loaded from the previous version run again
+        self.bq.tables[SOURCE_TABLE] = 2000.0
+        self.assertEqual(self.cm.check_sources(), [SOURCE_TABLE])
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        self.assertEqual(self.bq.jobs, 2)
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Spain').source_version, 2000.0)
+        self.assertEqual(self.cm.metrics.source_changes.value(SOURCE_TABLE), 1)
+
+    def test_21_failed_loads_and_breaker(self):
+        self.bq.get_breaker().failure_threshold = 3
+        data = self.cm.load_content(key='get_country_summary', country='Spain')
+        # Failed refresh: last good data served, no job until the retry time
+        self.age_contents()
+        self.bq.failure_rate = 1.0
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='Spain'), data)
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='Spain'), data)
+        self.assertEqual(self.bq.jobs, 2)
+        content = self.cm.contents.peek('get_country_summary@Spain')
+        self.assertEqual(content.failures, 1)
+        self.assertGreater(self.cm.content_retry_after(content), 0)
+        # Never loaded: no data until the retry time
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='France'))
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='France'))
+        self.assertEqual(self.bq.jobs, 3)
+        # Third consecutive failure opens the breaker: jobs fail fast
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='Italy'))
+        self.assertEqual(self.cm.bq.get_breaker().state, 'open')
+        self.assertIsNone(self.cm.load_content(key='get_country_summary', country='Germany'))
+        self.assertEqual(self.bq.jobs, 4)
+        self.assertEqual(self.cm.metrics.bq_jobs.value('get_country_summary', 'short_circuited'), 1)
+        self.assertEqual(self.cm.metrics.content_requests.value('get_country_summary', 'failed'), 2)
+        self.assertEqual(len(self.cm.backend_status()['failing_contents']), 4)
+        # Backend back: the probe job closes the breaker, failed contents load after their backoff
+        self.bq.failure_rate = 0.0
+        self.bq.get_breaker().next_probe_at = time.time()
+        self.cm.contents.peek('get_country_summary@Germany').retry_at = time.time()
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='Germany')[0]['country'], 'Germany')
+        self.assertEqual(self.cm.stats()['breaker']['state'], 'closed')
+        self.assertEqual(self.cm.contents.peek('get_country_summary@Germany').failures, 0)
+
+    def test_22_compact_rows(self):
+        rows = [{'territory': 'Madrid', 'total_confirmed': 200, 'drate': 7.5, 'flag': True},
+                {'territory': 'Catalonia', 'total_confirmed': None, 'drate': None, 'flag': False},
+                {'territory': None, 'total_confirmed': 2.5, 'drate': 1.0, 'flag': None}]
+        # Off by default: dict rows read as stored
+        content = self.cm.store_content(self.cm.build_content_request('get_country_territories', country='France'),
+                                        [dict(row) for row in rows])
+        self.assertIs(content.data, content.rows)
+        self.assertEqual(content.data, rows)
+        # Manager setting, not a class attribute shared by every app
+        self.assertFalse(hasattr(BigQueryContent, 'compact'))
+        self.cm.compact_rows = True
+        content = self.cm.store_content(self.cm.build_content_request('get_country_territories', country='Spain'),
+                                        [dict(row) for row in rows])
+        self.assertIsInstance(content.rows, ColumnarRows)
+        self.assertEqual(content.data, rows)
+        self.assertEqual(content.rows[1:], rows[1:])
+        self.assertEqual(self.cm.content_page(content, 2)[0], rows[:2])
+        self.assertEqual(content.rows.columns[2].typecode, 'd')
+        # Same columns: one schema tuple and one copy of repeated strings
+        other = self.cm.store_content(self.cm.build_content_request('get_country_territories', country='Italy'),
+                                      [dict(row) for row in rows])
+        self.assertIs(other.rows.schema, content.rows.schema)
+        self.assertIs(other.rows.columns[0][0], content.rows.columns[0][0])
+        self.assertFalse(hasattr(content, '__dict__'))
+        # Rows with different keys are kept as they are
+        mixed = [{'a': 1}, {'b': 2}]
+        self.assertIsNone(ColumnarRows.from_rows(mixed))
+
+    def test_23_miss_admission(self):
+        self.cm.load_content(key='get_countries')
+        self.cm.admission = MissAdmission(max_concurrent=1, max_queue=1, deadline=0.2)
+        self.bq.latency = 0.4
+
+        async def burst():
+            misses = [asyncio.create_task(self.cm.get_content_async('get_country_summary', country=country))
+                      for country in ('Spain', 'France', 'Italy')]
+            await asyncio.sleep(0.05)
+            # Cache hit served at once while misses are loaded and queued
+            start = time.perf_counter()
+            await self.cm.get_content_async('get_countries')
+            hit_seconds = time.perf_counter() - start
+            return hit_seconds, await asyncio.gather(*misses, return_exceptions=True)
+        hit_seconds, results = asyncio.run(burst())
+        self.assertLess(hit_seconds, 0.05)
+        self.assertEqual(results[0].data[0]['country'], 'Spain')
+        self.assertIsInstance(results[1], AdmissionRejected)
+        self.assertEqual(results[1].reason, 'deadline')
+        self.assertIsInstance(results[2], AdmissionRejected)
+        self.assertEqual(results[2].reason, 'queue_full')
+        stats = self.cm.stats()['admission']
+        self.assertEqual((stats['admitted'], stats['shed_queue_full'], stats['shed_deadline']), (1, 1, 1))
+        self.assertEqual((stats['active'], stats['waiting']), (0, 0))
+
+    def test_24_prefork_generations(self):
+        # Parent process loads and publishes contents, workers store newer ones without BigQuery jobs
+        def rows(sql_query, query_parameters):
+            if 'bulk_country' in sql_query:
+                return [{'bulk_country': 'Spain', 'country': 'Spain'}]
+            return [{'country': query_parameters.get('country')}]
+        self.bq.rows = rows
+        content_key = 'get_country_summary@Spain'
+        self.bq.tables[SOURCE_TABLE] = 1000.0
+        self.cm.check_sources()
+        self.cm.load_content(key='get_country_summary', country='Spain')
+        request = self.cm.build_content_request('get_country_summary', country='Spain')
+        forked_loaded_at = self.cm.contents.peek(content_key).loaded_at
+        with tempfile.TemporaryDirectory() as path:
+            parent = ContentGenerations(path)
+            self.assertEqual(self.cm.publish_generation(parent), 1)
+            # Source table updated: parent loads per-country contents again with bulk queries, publishes generation 2
+            self.bq.tables[SOURCE_TABLE] = 2000.0
+            self.assertIn(content_key, self.cm.refresh_stale_contents())
+            self.assertEqual(self.cm.publish_generation(parent), 2)
+            jobs = self.bq.jobs
+            # Worker forked at generation 1
+            self.cm.contents.clear()
+            self.cm.store_content(request, [{'country': 'Spain'}], loaded_at=forked_loaded_at, source_version=1000.0)
+            self.cm.sources.versions[SOURCE_TABLE] = 1000.0
+            worker = ContentGenerations(path, interval=0.02)
+            worker.generation = 1
+            self.cm.after_fork(worker)
+            self.addCleanup(setattr, self.cm, 'generations', None)
+            self.addCleanup(worker.stop_watcher)
+            deadline = time.time() + 2
+            while worker.stats()['generation'] < 2 and time.time() < deadline:
+                time.sleep(0.02)
+            self.assertEqual(worker.stats()['contents_loaded'], len(self.cm.contents))
+            self.assertGreater(len(self.cm.contents), 1)
+            self.assertEqual(self.cm.contents.peek(content_key).source_version, 2000.0)
+            self.assertEqual(self.cm.sources.version(SOURCE_TABLE), 2000.0)
+            self.assertEqual(self.cm.load_content(key='get_country_summary', country='Spain')[0]['country'], 'Spain')
+            self.assertEqual(self.bq.jobs, jobs)
+            # Contents not newer than the worker ones are not stored again
+            worker.stop_watcher()
+            self.cm.publish_generation(parent)
+            self.assertEqual(self.cm.load_generation(worker.read()), 0)
+
+    def test_25_job_cancelled(self):
+        # Cancelled callers cancel their job, started or still starting, and the cancellation is not swallowed
+        async def cancel(sql_query, cancelled):
+            task = asyncio.create_task(self.cm.bq_run_async(sql_query=sql_query, key='get_countries'))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            for _ in range(50):
+                if self.bq.cancelled == cancelled:
+                    break
+                await asyncio.sleep(0.02)
+        self.bq.latency = 1.0
+        asyncio.run(cancel('SELECT 1', 1))
+        self.assertEqual(self.bq.cancelled, 1)
+        # Cancelled while the client starts the job
+        self.bq.connected = False
+        self.bq.connect_latency = 0.2
+        asyncio.run(cancel('SELECT 2', 2))
+        self.assertEqual((self.bq.jobs, self.bq.cancelled), (2, 2))
+        self.assertEqual(self.cm.metrics.bq_jobs.value('get_countries', 'cancelled'), 2)
+        self.assertEqual(self.bq.get_breaker().state, 'closed')
+
+    def test_26_no_default_soft_ttl(self):
+        # Registered contents go stale when the source table changes, no soft TTL overrides it
+        self.assertEqual(self.cm.ttls, {})
+        self.bq.tables[SOURCE_TABLE] = 1000.0
+        self.cm.check_sources()
+        self.cm.load_content(key='get_countries')
+        self.bq.tables[SOURCE_TABLE] = 2000.0
+        self.cm.check_sources()
+        self.cm.load_content(key='get_countries')
+        self.assertEqual(self.bq.jobs, 2)
+
+    def test_27_bounded_cache_eviction_order(self):
+        cache = BoundedContentCache(max_entries=3, policy=LFU, sizeof=len)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.put('d', 'd')
+        self.assertEqual(cache.keys(), ['a', 'b', 'd'])
+        # Same use count: least recently used first
+        cache.put('e', 'e')
+        self.assertEqual(cache.keys(), ['a', 'b', 'e'])
+        # Least used bucket emptied by a removal: next one used
+        cache.pop('e')
+        cache.max_entries = 2
+        cache.put('f', 'f')
+        self.assertEqual(cache.keys(), ['a', 'f'])
+        # Stored again: uses kept
+        cache.put('a', 'aa')
+        cache.put('g', 'g')
+        self.assertEqual(cache.keys(), ['a', 'g'])
+        cache = BoundedContentCache(max_bytes=10, sizeof=len)
+        for value in ('x', 'aaaaaa', 'bbbbbb'):
+            cache.put(value, value)
+        self.assertEqual((cache.keys(), cache.bytes), (['bbbbbb'], 6))
+        # Alone over the limit: kept
+        cache.put('c' * 20, 'c' * 20)
+        self.assertEqual((cache.keys(), cache.bytes, cache.stats()['evictions']), (['c' * 20], 20, 3))
+
+    def test_28_country_case(self):
+        # Country names are compared as bound with the source table: names in another case are other contents
+        def rows(sql_query, query_parameters):
+            if 'bulk_country' in sql_query:
+                return [{'bulk_country': 'Spain', 'total': 1}]
+            return [{'total': 1 if query_parameters['country'] == 'Spain' else 0}]
+        self.bq.rows = rows
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='spain'), [{'total': 0}])
+        self.cm.prefetch_contents(keys=['get_country_summary'])
+        self.assertEqual(self.cm.contents.keys(), ['get_country_summary@spain', 'get_country_summary@Spain'])
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country='spain'), [{'total': 0}])
+        self.assertEqual(self.cm.load_content(key='get_country_summary', country=' Spain'), [{'total': 1}])
+        self.assertEqual(self.bq.queries[0][1], {'country': 'spain'})
+        self.assertEqual(self.bq.jobs, 2)
+
+    def test_29_prefork_refresh_thread(self):
+        # Parent refreshes in a background thread, one at a time, workers forked meanwhile get new locks
+        started = threading.Event()
+        release = threading.Event()
+
+        def refresh_stale_contents(check_sources=True):
+            # Refresh holding the cache and metrics locks, as a fork could happen during one
+            with self.cm.contents.lock, self.cm.metrics.content_requests.lock:
+                started.set()
+                release.wait(5)
+            return []
+        self.app.config['CONTENT_GENERATION_PATH'] = tempfile.mkdtemp()
+        server = PreforkServer(self.app)
+        self.addCleanup(server.generations.remove)
+        with mock.patch.object(self.cm, 'refresh_stale_contents', side_effect=refresh_stale_contents), \
+                mock.patch.object(server, 'publish') as publish:
+            self.assertTrue(server.start_refresh())
+            self.assertTrue(started.wait(2))
+            self.assertFalse(server.start_refresh())
+            worker = ContentGenerations(server.generations.path)
+            self.cm.after_fork(worker)
+            self.addCleanup(setattr, self.cm, 'generations', None)
+            self.addCleanup(worker.stop_watcher)
+            self.assertTrue(self.cm.contents.lock.acquire(timeout=1))
+            self.cm.contents.lock.release()
+            self.cm.load_content(key='get_countries')
+            self.assertEqual(self.cm.metrics.content_requests.value('get_countries', 'miss'), 1)
+            release.set()
+            server.refresh_thread.join(2)
+            self.assertFalse(server.refresh_thread.is_alive())
+            publish.assert_called_once_with()
+            self.assertTrue(server.start_refresh())
+            server.refresh_thread.join(2)
+
+    def test_30_default_bytes_billed(self):
+        # Default settings: no validation, no budget, jobs still carry a maximum_bytes_billed limit
+        self.assertEqual(self.cm.query_costs.status('get_countries'), 'unchecked')
+        self.assertEqual(self.cm.job_options('get_countries'), {'maximum_bytes_billed': DEFAULT_BYTES_BILLED})
+        self.bq.bytes_per_job = DEFAULT_BYTES_BILLED + 1
+        self.assertIsNone(self.cm.load_content(key='get_countries'))
+        self.assertEqual(self.bq.failures, 1)
+        # 0: no limit
+        self.assertIsNone(QueryCostRegistry(default_limit=0).maximum_bytes_billed('get_countries'))
+
+    def test_31_decode_arrow(self):
+        # With a BigQuery Storage client, results are read as Arrow record batches and decoded column by column
+        import pyarrow
+        record_batches = [pyarrow.RecordBatch.from_pydict({'country_region': ['Spain', 'France'],
+                                                           'total_confirmed': [500, None], 'drate': [1.5, 2.5]}),
+                          pyarrow.RecordBatch.from_pydict({'country_region': ['Italy'], 'total_confirmed': [100],
+                                                           'drate': [None]})]
+        storage_client = object()
+
+        class RowIterator:
+            def __init__(self, batches):
+                self.batches = batches
+                self.bqstorage_client = None
+
+            def to_arrow_iterable(self, bqstorage_client=None):
+                self.bqstorage_client = bqstorage_client
+                return iter(self.batches)
+
+        class QueryJob:
+            def __init__(self, rows):
+                self.rows = rows
+
+            def result(self, timeout=None):
+                return self.rows
+        bq = GBQManager()
+        bq.storage_client = storage_client
+        rows = RowIterator(record_batches)
+        data = bq.fetch_rows(QueryJob(rows))
+        self.assertIs(rows.bqstorage_client, storage_client)
+        self.assertIsInstance(data, ColumnarRows)
+        self.assertEqual(data.columns[1].typecode, 'q')
+        self.assertEqual(data.to_rows(), [{'country_region': 'Spain', 'total_confirmed': 500, 'drate': 1.5},
+                                          {'country_region': 'France', 'total_confirmed': None, 'drate': 2.5},
+                                          {'country_region': 'Italy', 'total_confirmed': 100, 'drate': None}])
+        self.assertEqual(bq.fetch_rows(QueryJob(RowIterator([]))), [])
+        # Stored as dict rows unless CONTENT_COMPACT_ROWS is set
+        content = self.cm.store_content(self.cm.build_content_request('get_country_summary', country='Spain'), data)
+        self.assertEqual(content.rows, data.to_rows())
+        # Without a BigQuery Storage client, rows are decoded one by one
+        bq.storage_client = None
+        field_to_index = {'country_region': 0}
+        self.assertEqual(bq.fetch_rows(QueryJob([Row(('Spain',), field_to_index)])), [{'country_region': 'Spain'}])
+
+
+class ContentRoutesCase(unittest.TestCase):
+    # HTTP level tests of the content routes, app created with the fake BigQuery backend
+
+    def setUp(self):
+        self.rows = [{'country_region': 'Spain', 'date': '2021-03-{:02d}'.format(day), 'total_confirmed': 100 * day}
+                     for day in range(1, 29)]
+        self.bq = FakeBQManager(rows=self.rows)
+        self.app = create_app(configclass=TestConfig, bq=self.bq)
+        self.cm = AppBQContentManager()
+        self.cm.contents = ContentCache()
+        self.cm.shared_contents = None
+        self.cm.single_flight = SingleFlight()
+        self.client = TestClient(self.app)
+
+    def test_0_accept_encoding(self):
+        response = self.client.get('/countries/Spain/evolution/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+        self.assertEqual(response.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(response.json(), self.rows)
+        response = self.client.get('/countries/Spain/evolution/', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('content-encoding', response.headers)
+        self.assertEqual(response.json(), self.rows)
+        response = self.client.get('/countries/Spain/evolution/', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('content-encoding', response.headers)
+        # Encoded once, served from the content cache
+        self.assertEqual(self.bq.jobs, 1)
+
+    @unittest.skipIf(encoding.brotli is None, "brotli not installed")
+    def test_1_accept_encoding_brotli(self):
+        response = self.client.get('/countries/Spain/evolution/', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['content-encoding'], 'br')
+        self.assertEqual(response.json(), self.rows)
+
+    def test_2_conditional_requests(self):
+        response = self.client.get('/countries/Spain/evolution/', headers={'Accept-Encoding': 'identity'})
+        etag = response.headers['etag']
+        last_modified = response.headers['last-modified']
+        # Fresh until midnight after the load
+        midnight = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+        max_age = int(response.headers['cache-control'].split('max-age=')[1])
+        self.assertGreater(max_age, 0)
+        self.assertLessEqual(max_age, midnight.timestamp() - time.time() + 1)
+        # Any encoding of the same data matches
+        response = self.client.get('/countries/Spain/evolution/', headers={'If-None-Match': etag,
+                                                                            'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['etag'], etag[:-1] + '-gzip"')
+        response = self.client.get('/countries/Spain/evolution/', headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/countries/Spain/evolution/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/countries/Spain/evolution/',
+                                   headers={'If-Modified-Since': 'Mon, 01 Mar 2021 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.bq.jobs, 1)
+
+    def test_3_batch_contents(self):
+        def rows(sql_query, query_parameters):
+            if 'bulk_country' in sql_query:
+                return [{'bulk_country': 'Spain', 'total': 1}, {'bulk_country': 'France', 'total': 2}]
+            return [{'total': 0}]
+        self.bq.rows = rows
+        batch = {'contents': [{'key': 'get_country_evolution', 'params': {'country': 'Spain'}},
+                              {'key': 'get_country_evolution', 'params': {'country': 'France'}},
+                              {'key': 'get_countries'},
+                              {'key': 'unknown'}]}
+        response = self.client.post('/contents/', json=batch, headers={'Accept-Encoding': 'identity'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['cache-control'], 'no-store')
+        results = response.json()
+        self.assertEqual(results[0], {'key': 'get_country_evolution', 'params': {'country': 'Spain'},
+                                      'content_key': 'get_country_evolution@Spain', 'data': [{'total': 1}]})
+        self.assertEqual(results[1]['data'], [{'total': 2}])
+        self.assertEqual(results[2]['data'], [{'total': 0}])
+        self.assertIn('error', results[3])
+        # One bulk job for both countries, one for the list of countries
+        self.assertEqual(self.bq.jobs, 2)
+        response = self.client.post('/contents/', json={'contents': [{'key': 'get_countries'}] * 51})
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post('/contents/', json={'contents': [{'params': {}}]})
+        self.assertEqual(response.status_code, 422)
+
+    def test_4_ndjson_and_pages(self):
+        rows = [{'country_region': 'C{:03d}'.format(i)} for i in range(250)]
+        self.bq.rows = rows
+        response = self.client.get('/countries/?format=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in response.text.splitlines()], rows)
+        response = self.client.get('/countries/', params={'limit': 100})
+        self.assertEqual(response.json(), rows[:100])
+        page_token = response.headers['x-next-page-token']
+        self.assertIn('rel="next"', response.headers['link'])
+        response = self.client.get('/countries/', params={'limit': 200, 'page_token': page_token})
+        self.assertEqual(response.json(), rows[100:])
+        self.assertNotIn('x-next-page-token', response.headers)
+        self.assertEqual(self.bq.jobs, 1)
+        response = self.client.get('/countries/', params={'limit': 100, 'page_token': 'not-a-token'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/countries/', params={'limit': 0})
+        self.assertEqual(response.status_code, 422)
+
+    def test_5_readiness(self):
+        class LazyConfig(TestConfig):
+            settings = TestConfig.settings + ['BQ_LAZY_CLIENT', 'CONTENT_WARM_KEYS']
+            BQ_LAZY_CLIENT = True
+            CONTENT_WARM_KEYS = ['get_countries']
+        self.bq = FakeBQManager(rows=self.rows, latency=0.1, connect_latency=0.2)
+        app = create_app(configclass=LazyConfig, bq=self.bq)
+        self.cm.contents = ContentCache()
+        # Startup tasks not run yet
+        response = TestClient(app).get('/readiness')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'starting')
+        with TestClient(app) as client:
+            # Served while the client is built and warm contents are loaded
+            self.assertEqual(client.get('/healthcheck').status_code, 200)
+            self.assertEqual(client.get('/readiness').status_code, 503)
+            for _ in range(50):
+                response = client.get('/readiness')
+                if response.status_code == 200:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['warm_contents'], {'get_countries': True})
+        self.assertTrue(self.bq.connected)
+        self.assertEqual(self.bq.jobs, 1)
+
+    def test_6_shed_misses(self):
+        self.assertEqual(self.client.get('/countries/').status_code, 200)
+        self.cm.admission = MissAdmission(max_concurrent=1, max_queue=0, deadline=2)
+        # Slot held by another load: misses shed at once, hits still served
+        self.cm.admission.acquire()
+        self.assertEqual(self.client.get('/countries/').status_code, 200)
+        for path in ('/countries/Spain/evolution/', '/contents/get_country_territories/?country=Spain&format=ndjson'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['retry-after'], '2')
+        self.assertEqual(self.cm.admission.stats()['shed_queue_full'], 2)
+        self.cm.admission.release()
+        self.assertEqual(self.client.get('/countries/Spain/evolution/').status_code, 200)
+        self.assertEqual(self.bq.jobs, 2)
+
+    def test_7_encoding_weights(self):
+        size = encoding.MIN_COMPRESS_SIZE
+        self.assertEqual(encoding.choose_encoding('gzip;q=0.000', size), 'identity')
+        self.assertEqual(encoding.choose_encoding('gzip ; Q = 0.0', size), 'identity')
+        self.assertEqual(encoding.choose_encoding('gzip;q=0.001', size), 'gzip')
+        self.assertEqual(encoding.choose_encoding('gzip;q=abc', size), 'identity')
+        self.assertEqual(encoding.choose_encoding('*', size), 'gzip')
+        self.assertEqual(encoding.choose_encoding('*;q=0, identity', size), 'identity')
+        self.assertEqual(encoding.choose_encoding('gzip, *;q=0', size), 'gzip')
+        self.assertEqual(encoding.choose_encoding('gzip;q=0.5, identity;q=0.8', size), 'identity')
+        self.assertEqual(encoding.choose_encoding('gzip;q=0.5', size - 1), 'identity')
+        with mock.patch.object(encoding, 'brotli', object()):
+            self.assertEqual(encoding.choose_encoding('gzip, br', size), 'br')
+            self.assertEqual(encoding.choose_encoding('gzip, br;q=0', size), 'gzip')
+            self.assertEqual(encoding.choose_encoding('gzip;q=1.0, br;q=0.9', size), 'gzip')
+            self.assertEqual(encoding.choose_encoding('*;q=0.5, br;q=0', size), 'gzip')
+
+    def test_8_json_without_orjson(self):
+        data = [{'drate': float('nan'), 'total': float('inf'), 'days': [1.5, float('-inf')],
+                 'date': datetime.date(2023, 2, 1)}]
+        expected = b'[{"drate":null,"total":null,"days":[1.5,null],"date":"2023-02-01"}]'
+        self.assertEqual(encoding.encode_json(data), expected)
+        with mock.patch.object(encoding, 'orjson', None):
+            self.assertEqual(encoding.encode_json(data), expected)
+            self.assertEqual(encoding.encode_json([{'total': 2}]), b'[{"total":2}]')
+
+
+    def test_9_shutdown_stops_schedulers(self):
+        threads = list(self.cm.scheduler_threads)
+        self.assertTrue(threads)
+        with TestClient(self.app) as client:
+            self.assertEqual(client.get('/healthcheck').status_code, 200)
+        self.assertEqual(self.cm.scheduler_threads, [])
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertIsNone(self.cm.source_stop)
+
 
 if __name__ == '__main__':
-    unittest.main(verbosity=2)
\ No newline at end of file
+    unittest.main(verbosity=2)